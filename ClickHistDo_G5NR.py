@@ -1,16 +1,57 @@
+from cache_G5NR import atomicWrite, ImageCache
 import calendar
+from caseNotebook_G5NR import CaseNotebookBuilder, markdownCell
+from catalog_G5NR import CaseCatalog
 import datetime
+from idvRender_G5NR import joinISL, RenderScheduler
+from multiprocessing.pool import ThreadPool
+import numpy as np
 from PIL import Image
 import os
-import StringIO
+from quicklook_G5NR import cropEvents, decodeFrame, defaultBaseURL, \
+    makeImageURL, QuicklookFetcher
 from subprocess import call
 import sys
-import time
-import urllib
+from templates_G5NR import TemplateCache
 import webbrowser
 
 __author__ = 'niznik'
 
+# Preset longitude dummy values in the .xidv templates to be replaced by the
+# values calculated for each case
+centerLonFiller = '-154.123456789'
+lonLenFiller = '2.123456789'
+minLonFiller = '-155.1851851835'
+maxLonFiller = '-153.0617283945'
+incLonFiller = '0.345678912'
+
+# Same, but latitude
+centerLatFiller = '0.135792468'
+latLenFiller = '1.592592592'
+minLatFiller = '-0.660503828'
+maxLatFiller = '0.932088764'
+incLatFiller = '0.234567891'
+
+# Same, but time and metadata
+startTimeFiller = '1117594837000'
+endTimeFiller = '1117616461000'
+startOffsetFiller = '-119.87654321'
+endOffsetFiller = '361.23456789'
+metadataFiller = 'replaceme_METADATASTRING_replaceme'
+
+bundlePlaceholders = [centerLonFiller, lonLenFiller, minLonFiller,
+                      maxLonFiller, incLonFiller, centerLatFiller,
+                      latLenFiller, minLatFiller, maxLatFiller, incLatFiller,
+                      startTimeFiller, endTimeFiller, startOffsetFiller,
+                      endOffsetFiller, metadataFiller]
+
+# Dummy values in the .isl template
+islPlaceholders = ['BUNDLENAME', 'MOVIENAME', 'IMAGENAME', '"METADATA"']
+
+# Templates filled in for each case
+islTemplate = './Templates/idvMovieOutput_fillIn.isl'
+caseNotebookTemplate = './Templates/caseNotebookTemplate.ipynb'
+
 # ClickHistDo is very much specific to the implementation of ClickHist
 
 # In this implementation, input data and relevant axis data are used
@@ -57,10 +98,39 @@ class ClickHistDo:
         self.timeLen = len(self.times)
         self.startDatetime = startDatetime
 
+        # The order of the dimensions in the x and y data (slowest changing
+        # first, as in np.unravel_index) and where the data starts along each
+        # of lons, lats, and times, for data that is a subset of them (kwargs
+        # may replace these (dimOrder, indexOffsets, e.g. {'lon': lowLonInt,
+        # 'lat': lowLatInt} with the full lon and lat arrays, and dataShape,
+        # the data's length along each dimension if it stops short of the end
+        # of the arrays))
+        self.dimOrder = ('time', 'lat', 'lon')
+        self.indexOffsets = {'lon': 0, 'lat': 0, 'time': 0}
+        if 'dimOrder' in kwargs:
+            self.dimOrder = tuple(kwargs['dimOrder'])
+        if 'indexOffsets' in kwargs:
+            self.indexOffsets.update(kwargs['indexOffsets'])
+        if sorted(self.dimOrder) != ['lat', 'lon', 'time']:
+            raise ValueError('dimOrder should contain \'lon\', \'lat\', '
+                             'and \'time\'')
+        self.dataShape = {'lon': self.lonLen-self.indexOffsets['lon'],
+                          'lat': self.latLen-self.indexOffsets['lat'],
+                          'time': self.timeLen-self.indexOffsets['time']}
+        if 'dataShape' in kwargs:
+            self.dataShape.update(kwargs['dataShape'])
+
+        # The date and time (and Unix time) of every time, worked out once
+        self.datetimes = np.array([startDatetime +
+                                   datetime.timedelta(0, float(time))
+                                   for time in self.times], dtype=object)
+        self.unixTimes = np.array([calendar.timegm(dt.timetuple())
+                                   for dt in self.datetimes], dtype=np.int64)
+
         # Set default values for variable names, metadata, and
         # percentiles
         # (xVarName and yVarName can be changed by kwargs below,
-        # the rest changed on an individual 'do')
+        # the rest are used by a 'do' that isn't passed them)
         self.xVarName = 'xVar'
         self.yVarName = 'yVar'
         self.metadata = ''
@@ -80,6 +150,27 @@ class ClickHistDo:
         # Set name of the case notebook file
         self.sessionName = caseNotebookFilenameTag
 
+        # Open the catalog of saved cases (kwargs may replace its location
+        # with catalogPath). A new catalog starts with any cases already in
+        # the session's Output folder.
+        self.catalogPath = './'+self.sessionName+'/Output/cases.sqlite'
+        if 'catalogPath' in kwargs:
+            self.catalogPath = kwargs['catalogPath']
+        if not os.path.exists(os.path.dirname(self.catalogPath)):
+            os.makedirs(os.path.dirname(self.catalogPath))
+        self.catalog = CaseCatalog(self.catalogPath,
+                                   './'+self.sessionName+'/Output')
+
+        # Read and compile every template (and parse the case notebook
+        # template) once, so that each do only has to fill in the values
+        # (templates are read again only if they change)
+        self.templates = TemplateCache()
+        for bundleInFilename in self.bundleInFilenames:
+            self.templates.load('./Templates/'+bundleInFilename+'.xidv',
+                                bundlePlaceholders)
+        self.templates.load(islTemplate, islPlaceholders)
+        self.notebooks = CaseNotebookBuilder(caseNotebookTemplate)
+
         self.openTab = False
         if 'openTab' in kwargs:
             self.openTab = kwargs['openTab']
@@ -105,6 +196,41 @@ class ClickHistDo:
         if not isinstance(self.imageVar, list):
             raise TypeError('imageVar should be a list')
 
+        # Set where the quicklook images come from and how patient to be
+        # with the server (the images are all fetched at the same time)
+        self.imageBaseURL = defaultBaseURL
+        self.imageTimeout = 10.
+        self.imageRetries = 2
+        if 'imageBaseURL' in kwargs:
+            self.imageBaseURL = kwargs['imageBaseURL']
+        if 'imageTimeout' in kwargs:
+            self.imageTimeout = kwargs['imageTimeout']
+        if 'imageRetries' in kwargs:
+            self.imageRetries = kwargs['imageRetries']
+
+        # Set where downloaded images are kept for later cases (and
+        # sessions), and whether to only use those (offline)
+        self.imageCacheDir = None
+        self.imageCacheMaxBytes = 2**30
+        self.offline = False
+        if 'imageCacheDir' in kwargs:
+            self.imageCacheDir = kwargs['imageCacheDir']
+        if 'imageCacheMaxBytes' in kwargs:
+            self.imageCacheMaxBytes = kwargs['imageCacheMaxBytes']
+        if 'offline' in kwargs:
+            self.offline = kwargs['offline']
+
+        imageCache = None
+        if self.imageCacheDir is not None:
+            imageCache = ImageCache(self.imageCacheDir,
+                                    self.imageCacheMaxBytes)
+        self.brokenLinkFrame = None
+        self.fetcher = QuicklookFetcher(timeout=self.imageTimeout,
+                                        retries=self.imageRetries,
+                                        workers=max(len(self.imageVar), 1),
+                                        cache=imageCache,
+                                        offline=self.offline)
+
 #This is a CLASS called a "do"
     def do(self, flatIndex, **kwargs):
 
@@ -117,20 +243,298 @@ class ClickHistDo:
         latitude, and time of the data point).
         :param kwargs: metadata - words to display in the output specific
         to the case, xPer,yPer - the percentiles of the x and y data, xyVals -
-        a string containing the x and y data values to display to the user
+        a string containing the x and y data values to display to the user,
+        xVal,yVal - the x and y data values (for the case catalog),
+        clickImage - the image of the ClickHist figure with the point marked
+        (an RGBA array)
         :return:
         """
 
-        # Check if the metadata tag was included
-        # Also check if the x and y percentiles were passed along
-        if 'metadata' in kwargs:
-            self.metadata = kwargs['metadata']
-        if 'xPer' in kwargs:
-            self.xPer = kwargs['xPer']
-        if 'yPer' in kwargs:
-            self.yPer = kwargs['yPer']
+        # The metadata and percentiles stay with this case (describeCase
+        # uses the defaults for any that weren't passed), so that cases can
+        # be done on several threads at once
+        self.makeOutputFolders()
+
+        # Notify the user that the processing has begun
+        print('Saving IDV bundle(s)...')
 
-        # Make sure output folders exist
+        # Determine the longitude, latitude, and time of the point passed
+        # to Do, and everything else that the files for the case need
+        case = self.describeCase(flatIndex, **kwargs)
+
+        # Inform the user of the time and location of the point
+        # And if passed, the values of X and Y as well
+        for stat in case['stats']:
+            if stat != '':
+                print(stat)
+
+        for ii in range(0, len(self.imageVar)):
+            print('\nLink to '+self.imageVar[ii]+' image: ' +
+                  case['imageURLs'][ii])
+            if self.openTab is True:
+                webbrowser.open(case['imageURLs'][ii], new=1)
+        print('')
+
+        # A case that was already saved only has its bundles written again,
+        # so nothing is fetched for it
+        saved = self.isSaved(case)
+
+        # Otherwise, start downloading all of the images now (unless they
+        # were already decoded for an earlier case), so that they arrive
+        # while the bundles are being written
+        imageFrames = []
+        if not saved:
+            imageFrames = self.fetcher.iterFrames(case['imageURLs'],
+                                                  case['imageKeys'])
+
+        self.writeBundles(case)
+        for tag in self.bundleOutTags:
+            # Inform the user of success
+            print('Bundle \''+tag+'\' Saved!')
+        print('')
+
+        # Create a Case Notebook!
+        print('Creating Case Notebook ('+case['commonFilename'] +
+              '.ipynb)')
+        if saved:
+            print('Notebook previously created - returning...')
+            self.recordSaved(case)
+            return
+
+        # First image is the scatterplot with highlighted point that defines
+        # the case, passed straight from ClickHist (or, from older versions,
+        # copied into the Images folder so it is not lost after it is
+        # overwritten)
+        if kwargs.get('clickImage') is not None:
+            self.saveImage(kwargs['clickImage'], case['chImageFile'])
+        elif os.path.isfile('./Output/Tmp/mostRecentCH.png'):
+            call('cp ./Output/Tmp/mostRecentCH.png '+case['chImageFile'],
+                 shell=True)
+
+        # Open new notebook cells with the RESULTS of Image() calls in them
+        print('Adding quicklook images to the notebook')
+        print('Now looping over '+str(self.imageVar)+'...')
+
+        # Each image is handled as soon as it arrives
+        for ii, frame in imageFrames:
+            print(' trying '+self.imageVar[ii]+'...')
+            # Use the image, or a broken link image of the same size
+            if frame is None:
+                print('Couldn\'t open the G5NR image...is the server down?')
+                frame = self.loadBrokenLinkFrame()
+                if frame is None:
+                    continue
+                print('(Using Broken Link Image)')
+            # A problem with one image only loses that image
+            try:
+                self.writeImages(ii, frame, [case])
+            except Exception as error:
+                print('Couldn\'t crop the '+self.imageVar[ii]+' image (' +
+                      repr(error)+') - skipping it')
+
+        self.writeNotebook(case)
+        print('Case Notebook created!')
+
+        # Record the case and everything made for it in the catalog
+        self.recordCase(case)
+
+        return
+
+    def doMany(self, flatIndices, **kwargs):
+        """
+        Saves the bundles, ISL scripts, quicklook images, and Case Notebooks
+        for many points at once. Images are fetched once per time and
+        cropped for all cases at that time together, and the files are
+        written on a pool of worker threads. Cases already in the catalog
+        are skipped, so an interrupted call can simply be run again.
+        :param flatIndices: the locations of the points in the flattened
+        data (see do)
+        :param kwargs: metadata - words to display in the output specific
+        to each case, xPer,yPer - lists with the percentiles of each point
+        (needed, since they are part of the name of each case), xVal,yVal -
+        lists with the values of each point (optional), workers - the
+        number of threads
+        writing files (default 4), islBatchSize - also write ISL scripts
+        that each render this many of the new cases (see writeBatchISL and
+        renderCases), progress - a function called as
+        progress(stage, done, total) as each case finishes each stage
+        ('describe', 'bundles', 'images', 'notebooks', 'catalog'),
+        instead of printing a summary of each stage
+        :return: a list with a dict for each point, with its flatIndex,
+        commonFilename, status ('created', 'skipped' (already saved, or the
+        same flat index as an earlier point), or 'failed'), error (why it
+        failed or was skipped as a repeat), artifacts (the (kind, path) of
+        each file made), and batchISL (the batch ISL script for the case, if
+        any)
+        """
+        if kwargs.get('xPer') is None or kwargs.get('yPer') is None:
+            raise ValueError('doMany needs the xPer and yPer of every point')
+        if (len(kwargs['xPer']) != len(flatIndices) or
+                len(kwargs['yPer']) != len(flatIndices)):
+            raise ValueError('xPer and yPer need one value per point')
+
+        workers = 4
+        islBatchSize = None
+        progress = None
+        if 'workers' in kwargs:
+            workers = kwargs['workers']
+        if 'islBatchSize' in kwargs:
+            islBatchSize = kwargs['islBatchSize']
+        if 'progress' in kwargs:
+            progress = kwargs['progress']
+
+        def report(stage, done, total):
+            if progress is not None:
+                progress(stage, done, total)
+            elif done == total:
+                print(stage+': '+str(done)+'/'+str(total))
+
+        self.makeOutputFolders()
+
+        # Find the coordinates of every point at once, then describe each
+        # case (a point outside of the data only fails its own case)
+        flatIndices = np.asarray(flatIndices, dtype=np.int64)
+        points = self.resolveIndices(flatIndices)
+        cases = []
+        # Each case is only done once: a flat index given again is skipped,
+        # and a point whose case has the same name as an earlier point's
+        # (names use whole degrees, so nearby points on a fine grid can
+        # share one) fails instead of overwriting the earlier case's files
+        firstByIndex = {}
+        firstByName = {}
+        for ii in range(0, len(flatIndices)):
+            flatIndex = int(flatIndices[ii])
+            caseKwargs = {}
+            if 'metadata' in kwargs:
+                caseKwargs['metadata'] = kwargs['metadata']
+            for name in ['xPer', 'yPer', 'xVal', 'yVal']:
+                if kwargs.get(name) is not None:
+                    caseKwargs[name] = kwargs[name][ii]
+            if flatIndex in firstByIndex:
+                case = self.undescribedCase(
+                    flatIndex, 'skipped',
+                    'describe: same flat index as point ' +
+                    str(firstByIndex[flatIndex]))
+            elif not points['valid'][ii]:
+                case = self.undescribedCase(flatIndex, 'failed',
+                                            'describe: flat index outside ' +
+                                            'of the data')
+            else:
+                try:
+                    case = self.describeCase(
+                        flatIndex,
+                        indices=(int(points['lonIndex'][ii]),
+                                 int(points['latIndex'][ii]),
+                                 int(points['timeIndex'][ii])),
+                        chImage=False, **caseKwargs)
+                except Exception as error:
+                    case = self.undescribedCase(flatIndex, 'failed',
+                                                'describe: '+repr(error))
+            firstByIndex.setdefault(flatIndex, ii)
+
+            commonFilename = case['commonFilename']
+            if commonFilename is not None and commonFilename in firstByName:
+                case = self.undescribedCase(
+                    flatIndex, 'failed',
+                    'describe: same commonFilename as point ' +
+                    str(firstByName[commonFilename]))
+                case['commonFilename'] = commonFilename
+            elif commonFilename is not None:
+                firstByName[commonFilename] = ii
+                if self.isSaved(case):
+                    case['status'] = 'skipped'
+                    self.recordSaved(case)
+            cases.append(case)
+            report('describe', ii+1, len(flatIndices))
+        todo = [case for case in cases if case['status'] is None]
+
+        # Run a stage for every case that hasn't failed yet, on the pool
+        pool = ThreadPool(workers)
+
+        def runStage(stage, function, stageCases):
+            def runCase(case):
+                try:
+                    function(case)
+                except Exception as error:
+                    case['status'] = 'failed'
+                    case['error'] = stage+': '+repr(error)
+                return case
+            stageCases = [case for case in stageCases
+                          if case['status'] is None]
+            done = 0
+            for case in pool.imap_unordered(runCase, stageCases):
+                done += 1
+                report(stage, done, len(stageCases))
+            return
+
+        try:
+            runStage('bundles', self.writeBundles, todo)
+
+            # Fetch the images for one time at a time (in time order), and
+            # crop every case at that time from the same decoded images
+            casesByTime = {}
+            for case in todo:
+                casesByTime.setdefault(case['time'], []).append(case)
+            done = 0
+            for caseTime in sorted(casesByTime.keys()):
+                timeCases = [case for case in casesByTime[caseTime]
+                             if case['status'] is None]
+                if len(timeCases) > 0:
+                    try:
+                        for ii, frame in self.fetcher.iterFrames(
+                                timeCases[0]['imageURLs'],
+                                timeCases[0]['imageKeys']):
+                            if frame is None:
+                                frame = self.loadBrokenLinkFrame()
+                            if frame is not None:
+                                self.writeImages(ii, frame, timeCases,
+                                                 pool)
+                    except Exception as error:
+                        for case in timeCases:
+                            case['status'] = 'failed'
+                            case['error'] = 'images: '+repr(error)
+                done += len(casesByTime[caseTime])
+                report('images', done, len(todo))
+
+            runStage('notebooks', self.writeNotebook, todo)
+
+            # Write the batch ISL scripts for the cases that made it this
+            # far (before the catalog, so a resumed run writes them again)
+            if islBatchSize is not None:
+                batchCases = [case for case in todo
+                              if case['status'] is None]
+                batchTag = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+                for bb in range(0, len(batchCases), islBatchSize):
+                    batch = batchCases[bb:bb+islBatchSize]
+                    path = ('./'+self.sessionName+'/Output/Scripts/' +
+                            'islBatch_'+batchTag+'_' +
+                            "{:04.0f}".format(bb//islBatchSize)+'.isl')
+                    self.writeBatchISL(batch, path)
+                    for case in batch:
+                        case['batchISL'] = path
+
+            runStage('catalog', self.recordCase, todo)
+        finally:
+            pool.terminate()
+
+        results = []
+        for case in cases:
+            status = case['status']
+            if status is None:
+                status = 'created'
+            results.append({'flatIndex': int(case['flatIndex']),
+                            'commonFilename': case['commonFilename'],
+                            'status': status,
+                            'error': case['error'],
+                            'artifacts': self.caseArtifacts(case),
+                            'batchISL': case['batchISL']})
+        return results
+
+    def makeOutputFolders(self):
+        """
+        Makes sure output folders exist
+        :return:
+        """
         #
         # Tmp is where some files are processed before being moved to their
         # proper locations
@@ -141,6 +545,7 @@ class ClickHistDo:
         # .zidv output
         # Images is where the image and movies generated by the .isl script
         # are stored
+        # CaseNotebooks is where the Case Notebooks are written
         #
         # Note that GeneratedBundlesZ and Images are not necessary at runtime
         # here, but they will be needed as soon as the user runs the .isl
@@ -162,40 +567,40 @@ class ClickHistDo:
             call('mkdir '+self.sessionName+'/Output/Scripts/', shell=True)
         if not os.path.exists('./'+self.sessionName+'/Output/Images/'):
             call('mkdir '+self.sessionName+'/Output/Images/', shell=True)
+        if not os.path.exists('./'+self.sessionName+'/Output/CaseNotebooks/'):
+            call('mkdir '+self.sessionName+'/Output/CaseNotebooks', shell=True)
+        return
 
-        # Notify the user that the processing has begun
-        print('Saving IDV bundle(s)...')
-
-        # Grab the current Unix/Epoch time as a placeholder tag for the
-        # temporary results and create lists that can be iterated in the
-        # event of more than one bundle template
-        basisBundleFiles = []
-        tempBundleFiles = []
-        currentUnixTime = str(int(time.time()))
-        for ii in range(0, len(self.bundleInFilenames)):
-            basisBundleFiles.append('./Templates/' +
-                                    self.bundleInFilenames[ii] + '.xidv')
-            tempBundleFiles.append('./Tmp/tempBundle_' +
-                                   currentUnixTime+str(ii)+'.xidv')
+    def describeCase(self, flatIndex, **kwargs):
+        """
+        Works out everything needed to write the files for one case (its
+        time and location, strings for the user, filenames, and the values
+        for the templates), without changing anything in the ClickHistDo,
+        so that many cases can be handled at the same time
+        :param flatIndex: Location of data in the flattened, 1D x and y data
+        arrays (see do)
+        :param kwargs: metadata, xPer, yPer, xyVals, xVal, yVal (see do),
+        indices - the (lon, lat, time) indices if they are already known,
+        chImage - False if there is no ClickHist image for the case
+        :return: a dict describing the case
+        """
+        metadata = kwargs.get('metadata', self.metadata)
+        xPer = kwargs.get('xPer', self.xPer)
+        yPer = kwargs.get('yPer', self.yPer)
 
-        # Determine the longitude, latitude, and time of the point passed
-        # to Do
-        inputLonIndex, inputLatIndex, inputTimeIndex = \
-            self.find3DIndices(flatIndex)
+        # Determine the longitude, latitude, and time of the point
+        if 'indices' in kwargs:
+            inputLonIndex, inputLatIndex, inputTimeIndex = kwargs['indices']
+        else:
+            inputLonIndex, inputLatIndex, inputTimeIndex = \
+                self.find3DIndices(flatIndex)
         inputLon = self.lons[inputLonIndex]
         inputLat = self.lats[inputLatIndex]
-        
-# debug a time error (it was in the dataset, not the code)
-#        print 'self.startDatetime', self.startDatetime 
-#        print 'self.times[inputTimeIndex]', self.times[inputTimeIndex]
-#        print 'datetime.timedelta(0, (self.times[inputTimeIndex]))', \
-#        datetime.timedelta(0, (self.times[inputTimeIndex]))
 
-        inputDatetime = (self.startDatetime +
-                         datetime.timedelta(0, (self.times[inputTimeIndex])))
-        inputTime = int(calendar.timegm(inputDatetime.timetuple()))
+        inputDatetime = self.datetimes[inputTimeIndex]
+        inputTime = int(self.unixTimes[inputTimeIndex])
 
-        # Inform the user of the time and location of the point
+        # The time and location of the point
         # And if passed, the values of X and Y as well
         timeString = str(inputDatetime)
         locationString = ("{:3.0f}".format(inputLon)+' E ' +
@@ -208,36 +613,6 @@ class ClickHistDo:
             perString = ('x%: '+"{:2.3f}".format(kwargs['xPer'])+' ' +
                          'y%: '+"{:2.3f}".format(kwargs['yPer']))
 
-        print(inputDatetime)
-        print("{:3.0f}".format(inputLon)+' E '+"{:2.0f}".format(inputLat)+' N')
-        if 'xyVals' in kwargs:
-            print(kwargs['xyVals'])
-        if ('xPer' in kwargs) and ('yPer' in kwargs):
-            print('x%: '+"{:2.3f}".format(kwargs['xPer'])+' ' +
-                  'y%: '+"{:2.3f}".format(kwargs['yPer']))
-
-        urlSave = []
-        for ii in range(0, len(self.imageVar)):
-
-            url = ('http://g5nr.nccs.nasa.gov/static/naturerun/fimages/' +
-                   self.imageVar[ii].upper() +
-                   '/Y'+"{:4d}".format(inputDatetime.year) +
-                   '/M'+"{:02d}".format(inputDatetime.month) +
-                   '/D'+"{:02d}".format(inputDatetime.day) +
-                   '/'+self.imageVar[ii]+'_globe_c1440_NR_BETA9-SNAP_' +
-                   "{:4d}".format(inputDatetime.year) +
-                   "{:02d}".format(inputDatetime.month) +
-                   "{:02d}".format(inputDatetime.day) +
-                   '_'+"{:02d}".format(inputDatetime.hour) +
-                   "{:02d}".format(inputDatetime.minute) +
-                   'z.png')
-            urlSave.append(url)
-
-            print('\nLink to '+self.imageVar[ii]+' image: '+url)
-            if self.openTab is True:
-                webbrowser.open(url, new=1)
-        print('')
-
         # Based on the lon, lat, and time, determine all necessary input
         # to create an .xidv bundle
         # First, the edges of the display window
@@ -248,12 +623,12 @@ class ClickHistDo:
 
         # Next, the start and end time for the time looping
         adjTime = int(inputTime)*1000
-        startTime = str(long(adjTime-self.dtFromCenter))
-        endTime = str(long(adjTime+self.dtFromCenter))
+        startTime = str(int(adjTime-self.dtFromCenter))
+        endTime = str(int(adjTime+self.dtFromCenter))
         # IDV wants these in minutes (hence dividing by 60*1000 to convert
         # out of milliseconds)
         startOffset = str(0)
-        endOffset = str((self.dtFromCenter*2)/(60*1000))
+        endOffset = str((self.dtFromCenter*2)//(60*1000))
 
         # Determine the filename based on the quantiles of the scatterplot parameters 
         timeTag = self.convertToYMDT(inputTime)
@@ -267,356 +642,318 @@ class ClickHistDo:
 #                          timeTag)
 #Newer, BEM likes better. Hope sign is allowed for Lat and Lon
         commonFilename = (self.xVarName+'_quantile_'+
-                          "{:005.3f}".format(min(self.xPer, 99.999))+'_' +
+                          "{:005.3f}".format(min(xPer, 99.999))+'_' +
                           self.yVarName+'_quantile_'+
-                          "{:005.3f}".format(min(self.yPer, 99.999))+'_' +
+                          "{:005.3f}".format(min(yPer, 99.999))+'_' +
                           'lat_'+str("%02i"%inputLat)+'_' +
                           'lon_'+str("%03i"%inputLon)+'_' +
                           'time_'+timeTag)
+        outputDir = './'+self.sessionName+'/Output/'
+
+        # Pair each dummy value with the value that replaces it
+        bundleReplacements = {minLonFiller: westLon,
+                              maxLonFiller: eastLon,
+                              minLatFiller: southLat,
+                              maxLatFiller: northLat,
+                              centerLonFiller: str(inputLon),
+                              centerLatFiller: str(inputLat),
+                              lonLenFiller: str(self.lonOffset*2),
+                              latLenFiller: str(self.latOffset*2),
+                              incLonFiller: str(self.lonOffset/2.),
+                              incLatFiller: str(self.latOffset/2.),
+                              startTimeFiller: startTime,
+                              endTimeFiller: endTime,
+                              startOffsetFiller: startOffset,
+                              endOffsetFiller: endOffset,
+                              metadataFiller: metadata}
+
+        chImageFile = None
+        if kwargs.get('chImage', True):
+            chImageFile = outputDir+'Images/'+commonFilename+'_CH.png'
+
+        return {'flatIndex': flatIndex,
+                'lon': inputLon,
+                'lat': inputLat,
+                'datetime': inputDatetime,
+                'time': inputTime,
+                'metadata': metadata,
+                'xPer': kwargs.get('xPer'),
+                'yPer': kwargs.get('yPer'),
+                'xVal': kwargs.get('xVal'),
+                'yVal': kwargs.get('yVal'),
+                'stats': [timeString, locationString, xyValString,
+                          perString],
+                'commonFilename': commonFilename,
+                'bundleReplacements': bundleReplacements,
+                'bundleFiles': [outputDir+'GeneratedBundles/' +
+                                commonFilename+'_'+tag+'.xidv'
+                                for tag in self.bundleOutTags],
+                'islFile': (outputDir+'Scripts/zidv_Maker_' +
+                            commonFilename+'.isl'),
+                'chImageFile': chImageFile,
+                'imageURLs': [makeImageURL(imageVar, inputDatetime,
+                                           self.imageBaseURL)
+                              for imageVar in self.imageVar],
+                'imageKeys': [(imageVar, inputDatetime)
+                              for imageVar in self.imageVar],
+                'imageFiles': [None]*len(self.imageVar),
+                'notebookFile': (outputDir+'CaseNotebooks/' +
+                                 commonFilename+'.ipynb'),
+                'batchISL': None,
+                'status': None,
+                'error': None}
+
+    def undescribedCase(self, flatIndex, status, error):
+        """
+        Stands in for a case that isn't described (it couldn't be, or it
+        would repeat another case), so that doMany can report it and go on
+        with the others
+        :param flatIndex: the flat index of the point
+        :param status: 'failed' or 'skipped'
+        :param error: why
+        :return: a dict with the entries of a case that doMany uses
+        """
+        return {'flatIndex': flatIndex,
+                'commonFilename': None,
+                'bundleFiles': [],
+                'islFile': None,
+                'chImageFile': None,
+                'imageFiles': [],
+                'notebookFile': None,
+                'batchISL': None,
+                'status': status,
+                'error': error}
+
+    def isSaved(self, case):
+        """
+        Checks whether a case was already saved (by do or doMany)
+        :param case: a case, from describeCase
+        :return: True if the case is in the catalog or its notebook exists
+        """
+        return (self.catalog.hasCase(case['commonFilename']) or
+                os.path.isfile(case['notebookFile']))
 
-        # The flag for dealing with backup in OS X and Linux is different but -i.bckp works for both
-        # Set it here based on the OS that was determined upon initialization
-        backupTag = '-i.bckp'
-        if self.os.startswith('darwin'):
-            backupTag = '-i.bckp'
-        elif self.os.startswith('linux'):
-            backupTag = '-i.bckp'
-        else:
-            print('Unsupported OS detected')
-            print('Functionality might not work as intended...')
-
-        # Preset longitude dummy values in the .xidv template to be
-        # replaced by the values calculated above
-        centerLonFiller = '-154.123456789'
-        lonLenFiller = '2.123456789'
-        minLonFiller = '-155.1851851835'
-        maxLonFiller = '-153.0617283945'
-        incLonFiller = '0.345678912'
-
-        # Same, but latitude
-        centerLatFiller = '0.135792468'
-        latLenFiller = '1.592592592'
-        minLatFiller = '-0.660503828'
-        maxLatFiller = '0.932088764'
-        incLatFiller = '0.234567891'
-
-        # Same, but time and metadata
-        startTimeFiller = '1117594837000'
-        endTimeFiller = '1117616461000'
-        startOffsetFiller = '-119.87654321'
-        endOffsetFiller = '361.23456789'
-        metadataFiller = 'replaceme_METADATASTRING_replaceme'
-
-# Section for modifying .xidv template bundles:         
-        # change finalBundleFile to a list of filenames and loop over them
-        finalBundles = []
-        for ii in range(0, len(basisBundleFiles)):
-
-            finalBundleFile = ('./'+self.sessionName+'/Output/GeneratedBundles/' +
-                               commonFilename+'_' +
-                               self.bundleOutTags[ii]+'.xidv')
-            finalBundles.append('../GeneratedBundles/' +
-                                commonFilename+'_' +
-                               self.bundleOutTags[ii]+'.xidv')
-
-            # Each call to sed here replaces one of the dummy lon/lat/time
-            # values with the values appropriate to the passed data point
-            call('sed \'s/'+minLonFiller+'/'+westLon+'/\' ' +
-                 basisBundleFiles[ii] + ' > '+tempBundleFiles[ii],
-                 shell=True)
-            call('sed '+backupTag+' \'s/'+maxLonFiller+'/'+eastLon+'/\' ' +
-                 tempBundleFiles[ii], shell=True)
-            call('sed '+backupTag+' \'s/'+minLatFiller+'/'+southLat+'/\' ' +
-                 tempBundleFiles[ii], shell=True)
-            call('sed '+backupTag+' \'s/'+maxLatFiller+'/'+northLat+'/\' ' +
-                 tempBundleFiles[ii], shell=True)
-            call('sed '+backupTag+' \'s/'+centerLonFiller+'/'+str(inputLon) +
-                 '/\' '+tempBundleFiles[ii], shell=True)
-            call('sed '+backupTag+' \'s/'+centerLatFiller+'/'+str(inputLat) +
-                 '/\' '+tempBundleFiles[ii], shell=True)
-            call('sed '+backupTag+' \'s/'+lonLenFiller+'/' +
-                 str(self.lonOffset*2) + '/\' '+tempBundleFiles[ii],
-                 shell=True)
-            call('sed '+backupTag+' \'s/'+latLenFiller+'/' +
-                 str(self.latOffset*2) + '/\' '+tempBundleFiles[ii],
-                 shell=True)
-            call('sed '+backupTag+' \'s/'+incLonFiller+'/' +
-                 str(self.lonOffset/2.) + '/\' '+tempBundleFiles[ii],
-                 shell=True)
-            call('sed '+backupTag+' \'s/'+incLatFiller+'/' +
-                 str(self.latOffset/2.) + '/\' '+tempBundleFiles[ii],
-                 shell=True)
-            call('sed '+backupTag+' \'s/'+startTimeFiller+'/'+startTime +
-                 '/\' ' + tempBundleFiles[ii], shell=True)
-            call('sed '+backupTag+' \'s/'+endTimeFiller+'/'+endTime+'/\' ' +
-                 tempBundleFiles[ii], shell=True)
-            call('sed '+backupTag+' \'s/'+startOffsetFiller+'/'+startOffset +
-                 '/\' '+tempBundleFiles[ii], shell=True)
-            call('sed '+backupTag+' \'s/'+endOffsetFiller+'/'+endOffset +
-                 '/\' ' + tempBundleFiles[ii], shell=True)
-            call('sed '+backupTag+' \'s/'+metadataFiller+'/'+self.metadata +
-                 '/\' ' + tempBundleFiles[ii], shell=True)
-                            
-            # Save the bundle with a recognizable filename
-            call('mv '+tempBundleFiles[ii]+' '+finalBundleFile, shell=True)
-            call('rm '+tempBundleFiles[ii]+'.bckp', shell=True)
-
-            # Inform the user of success
-            print('Bundle \''+self.bundleOutTags[ii]+'\' Saved!')
-
-        print('')
-        
-# End section for modifying .xidv bundles, now modify .isl template
+    def writeBundles(self, case):
+        """
+        Writes the .xidv bundles and the .isl script for a case
+        :param case: a case, from describeCase
+        :return:
+        """
+        # Each of the dummy lon/lat/time values is replaced with the value
+        # appropriate to the passed data point, all in one pass, and the
+        # bundle is saved with a recognizable filename
+        for ii in range(0, len(self.bundleInFilenames)):
+            self.templates.renderTo('./Templates/' +
+                                    self.bundleInFilenames[ii]+'.xidv',
+                                    case['bundleFiles'][ii],
+                                    case['bundleReplacements'])
 
         # Now create the ISL file - a bit less involved
-        basisISL = './Templates/idvMovieOutput_fillIn.isl'
-        tempISL = './'+self.sessionName+'/Output/Scripts/zidv_Maker_'+commonFilename+'.isl'
-
-        # Process a few replacements via sed
-
-        call('sed \'s/BUNDLENAME/'+commonFilename+'_'+self.bundleOutTags[0] +
-             '/\' '+basisISL+' > '+tempISL, shell=True)
-        call('sed '+backupTag+' \'s/MOVIENAME/'+commonFilename+'/\' ' +
-             tempISL, shell=True)
-        call('sed '+backupTag+' \'s/IMAGENAME/'+commonFilename+'/\' ' +
-             tempISL, shell=True)
-        call('sed '+backupTag+' \'s/\"METADATA\"/\"'+self.metadata+'\"/\' ' +
-             tempISL, shell=True)
-
-        # Clean up backup files
-        call('rm '+tempISL+'.bckp', shell=True)
-
-# End section for modifying .isl scripts
-
+        self.templates.renderTo(islTemplate, case['islFile'],
+                                self.islReplacements(case))
+        return
 
-#The section to actually write the JSON of the .ipynb notebook
-        # Create a Case Notebook!
-        caseNotebookFilename = (commonFilename+'.ipynb')
-        print('Creating Case Notebook ('+caseNotebookFilename +
-              ')')
- 
-        if not os.path.exists('./'+self.sessionName+'/Output/CaseNotebooks/'):
-            call('mkdir '+self.sessionName+'/Output/CaseNotebooks', shell=True)
+    def islReplacements(self, case):
+        """
+        :param case: a case, from describeCase
+        :return: the values to fill in the ISL template with for the case
+        """
+        return {'BUNDLENAME': (case['commonFilename']+'_' +
+                               self.bundleOutTags[0]),
+                'MOVIENAME': case['commonFilename'],
+                'IMAGENAME': case['commonFilename'],
+                '"METADATA"': '"'+case['metadata']+'"'}
 
-        if(os.path.isfile('./'+self.sessionName+'/Output/CaseNotebooks/' +
-                          caseNotebookFilename) == True):
-            print('Notebook previously created - returning...')
-            return
-        
-        #Copy the template (it must exist already)
-        print('Copy the template')
+    def writeBatchISL(self, cases, path):
+        """
+        Writes one ISL script that renders several cases, so that IDV only
+        has to start once for all of them
+        :param cases: cases, from describeCase
+        :param path: the file to write
+        :return:
+        """
+        atomicWrite(path, joinISL([self.templates.render(
+            islTemplate, self.islReplacements(case)) for case in cases]))
+        return
 
-        call('cp ./Templates/caseNotebookTemplate.ipynb ' +
-             './'+self.sessionName+'/Output/CaseNotebooks/'+caseNotebookFilename, shell=True)
+    def renderCases(self, results, **kwargs):
+        """
+        Runs IDV on the ISL scripts of cases (from doMany), several at a
+        time, to make their movies, images, and .zidv files. What has been
+        rendered is kept in the session's Output/renderStatus.json, so
+        cases that are already done are not rendered again.
+        :param results: the results of doMany (cases that failed are left
+        out)
+        :param kwargs: command, workers, retries, timeout (see
+        RenderScheduler), progress (see RenderScheduler.run)
+        :return: a dict from the commonFilename of each case to its render
+        status ('done', 'failed', or 'pending')
+        """
+        sessionDir = './'+self.sessionName
+        scheduler = RenderScheduler(
+            command=kwargs.get('command'), workers=kwargs.get('workers'),
+            retries=kwargs.get('retries', 1), timeout=kwargs.get('timeout'),
+            cwd=sessionDir,
+            statusPath=sessionDir+'/Output/renderStatus.json')
+
+        # Batch scripts come first, then each case's own script for cases
+        # that aren't in a batch
+        for result in results:
+            if result['status'] == 'failed':
+                continue
+            script = result.get('batchISL')
+            if script is None:
+                scripts = [path for kind, path in result['artifacts']
+                           if kind == 'script']
+                if len(scripts) == 0:
+                    continue
+                script = scripts[0]
+            scheduler.add(os.path.relpath(script, sessionDir),
+                          [result['commonFilename']])
+        return scheduler.run(kwargs.get('progress'))
+
+    def writeImages(self, ii, frame, cases, pool=None):
+        """
+        Crops one quicklook image around each of several cases at the same
+        time (very specific to G5NR images on the web site), marks the
+        point, and saves the crops
+        :param ii: the position of the image in imageVar
+        :param frame: the decoded global image
+        :param cases: cases (from describeCase), all at the time of frame
+        :param pool: a ThreadPool to save the crops on (optional)
+        :return:
+        """
+        crops = cropEvents(frame, [case['lon'] for case in cases],
+                           [case['lat'] for case in cases])
+        for cc in range(0, len(cases)):
+            cases[cc]['imageFiles'][ii] = self.imagePath(cases[cc], ii)
+        saves = [(crops[cc], cases[cc]['imageFiles'][ii])
+                 for cc in range(0, len(cases))]
+        if pool is None:
+            for image, path in saves:
+                self.saveImage(image, path)
+        else:
+            pool.map(lambda save: self.saveImage(save[0], save[1]), saves)
+        return
 
-    # Now insert case specific information into the template
+    def imagePath(self, case, ii):
+        """
+        :param case: a case, from describeCase
+        :param ii: the position of the image in imageVar
+        :return: the path of the case's crop of that quicklook image
+        """
+        return ('./'+self.sessionName+'/Output/Images/' +
+                case['commonFilename']+'_'+self.imageVar[ii]+'.png')
 
-        pathToCaseNB = './'+self.sessionName+'/Output/CaseNotebooks/'+caseNotebookFilename
+    def saveImage(self, image, path):
+        """
+        Saves an image as a PNG (atomically, so that a partial image is
+        never seen)
+        :param image: the image, as an array of RGB(A) values
+        :param path: the file to write
+        :return:
+        """
+        atomicWrite(path,
+                    lambda outFile: Image.fromarray(image).save(outFile,
+                                                                'PNG'))
+        return
 
+    def writeNotebook(self, case):
+        """
+        Writes the Case Notebook for a case
+        :param case: a case, from describeCase (with its images written)
+        :return:
+        """
         date = str(datetime.datetime.now().replace(second=0,
                                                    microsecond=0))
-        # Creation date
-        call('sed '+backupTag+' \'s/INSERT_DATE/'+date+'/\' ' +
-             pathToCaseNB, shell=True)
-        call('rm '+pathToCaseNB+'.bckp', shell=True)
-
-    # Grab a copy of the .ipynb as a string list called lines. 
-    # Code will change that, then write it out. 
-        inFile = open('./'+self.sessionName+'/Output/CaseNotebooks/' +
-                      caseNotebookFilename, 'r')
-        lines = inFile.readlines()
-        inFile.close()
-
-        # Add case metadata under the line containing the string called Quick Stats
-        insertIndexMeta = -1
-        for ll in range(0, len(lines)-1):
-            if 'Quick Stats' in lines[ll]:
-                insertIndexMeta = ll
-
-        lines[insertIndexMeta] += ','
-        lines.insert(insertIndexMeta+1, '    \"'+timeString+'<br>\",\n')
-        lines.insert(insertIndexMeta+2, '    \"'+locationString+'<br>\",\n')
-        lines.insert(insertIndexMeta+3, '    \"'+xyValString+'<br>\",\n')
-        lines.insert(insertIndexMeta+4, '    \"'+perString+'<br>\"\n')
-       
-        #define where to add new image cells 
-        insertImageCells = insertIndexMeta+7 # After the close of metadata cell above
-        
-        
-        # The next thing I want at the top is the quicklook imagery. This involves adding new cells.
-        if True:   # BEM is too lazy to reindent this block so make it a if True:
-            linesToAdd = []
-
-            
-            # First image is the scatterplot with highlighted point that defines the case
-            # Copy it into the Images folder so it is not lost after it is overwritten
-            call('cp ./Tmp/mostRecentCH.png ./'+self.sessionName+'/Output/Images/' +
-                 commonFilename+'_CH.png', shell=True)
-
-            # Open a new notebook cell of type Markdown and put the name there
-            self.appendCellStart(linesToAdd, 'markdown')
-            linesToAdd.append('    \"**Common Filename:** `' +
-                              commonFilename+'`\",\n')
-            # Appending the actual image, instead of a command to fetch it, involves ![]
-            linesToAdd.append('    \"![](../Images/' + commonFilename +
-                              '_CH.png)\"\n')
-            self.appendCellEnd(linesToAdd, False)
-            
-            
-            # Open new notebook cells with the RESULTS of Image() calls in them
-            print 'Adding quicklook images to the notebook'        
-            print 'Now looping over ', self.imageVar, '...'
-            
-            for ii in range(0, len(self.imageVar)):
-                print ' trying ', self.imageVar[ii], '...'
-                # Load an image, or use a broken link image of the same size
-                imageLoaded = 1
-                try:
-                    imgFile = StringIO.StringIO(urllib.urlopen(urlSave[ii]).read())
-                    imgIn = Image.open(imgFile)
-                except IOError:
-                    print('Couldn\'t open the G5NR image...is the server down?')
-                    imgIn = Image.open('BrokenLinkImage.png')
-                    print('(Using Broken Link Image)')
-                    # imageLoaded = 0, I changed this to use a dummy image instead of no image
-
-                imgInWidth = imgIn.size[0]
-                imgInHeight = imgIn.size[1]
-
-                #Crop the image, very specific to G5NR images on the web site
-                if imageLoaded == 1:
-                    outImageWidthHalf = int(imgInWidth*(30./360.))
-                    outImageHeightHalf = int(imgInHeight*(15./180.))
-
-                    # NASA images start at 17.5 W, not 0 E so we need to account
-                    # for that. Pulled out the numerator to make things clearer.
-                    lonOffset = 17.5
-                    numForCentX = (inputLon+lonOffset) % 360
-
-                    cropCentX = int((numForCentX/360.)*imgInWidth)
-                    cropCentY = int((-1.*(inputLat-90.)/180.)*imgInHeight)
-                    centToEdgeX = outImageWidthHalf
-                    centToEdgeY = outImageHeightHalf
-
-                    imgToSave = Image.new("RGB", (outImageWidthHalf*2,
-                                                  outImageHeightHalf*2))
-
-                    leftEdge = cropCentX-centToEdgeX
-                    rightEdge = cropCentX+centToEdgeX
-                    upperEdge = cropCentY-centToEdgeY
-                    lowerEdge = cropCentY+centToEdgeY
-
-                    boxHeightOffset = 0
-
-                    if lowerEdge >= imgInHeight:
-                        boxHeightOffset = lowerEdge - imgInHeight
-                        lowerEdge = imgInHeight-1
-                        upperEdge = lowerEdge-centToEdgeY*2
-                    elif upperEdge < 0:
-                        boxHeightOffset = upperEdge
-                        upperEdge = 0
-                        lowerEdge = upperEdge+centToEdgeY*2
-
-                    imgCrop1, imgCrop2 = None, None
-
-                    if leftEdge < 0:
-                        imgCrop1 = imgIn.crop((leftEdge+imgInWidth,
-                                               upperEdge,
-                                               imgInWidth-1,
-                                               lowerEdge))
-                        imgCrop2 = imgIn.crop((0,
-                                               upperEdge,
-                                               rightEdge,
-                                               lowerEdge))
-                    elif rightEdge >= imgInWidth:
-                        imgCrop1 = imgIn.crop((leftEdge,
-                                               upperEdge,
-                                               imgInWidth-1,
-                                               lowerEdge))
-                        imgCrop2 = imgIn.crop((0,
-                                               upperEdge,
-                                               rightEdge-imgInWidth,
-                                               lowerEdge))
-                    else:
-                        imgCrop1 = imgIn.crop((leftEdge,
-                                               upperEdge,
-                                               rightEdge,
-                                               lowerEdge))
-
-                    imgToSave.paste(imgCrop1, (0, 0))
-                    if imgCrop2 is not None:
-                        imgToSave.paste(imgCrop2, (imgCrop1.size[0], 0))
-
-                    pix = imgToSave.load()
-
-                    saveCenterW = imgToSave.size[0]/2
-                    saveCenterH = imgToSave.size[1]/2
-                    sqRad = 5
-
-                    for x in range(saveCenterW-sqRad, saveCenterW+sqRad+1, 1):
-                        for y in range(saveCenterH+boxHeightOffset-sqRad,
-                                       saveCenterH+boxHeightOffset+sqRad+1, 1):
-                            pix[x, y] = (255, 0, 0)
-
-                    # output cropped image
-                    saveFilename = (commonFilename + '_' + self.imageVar[ii] +
-                                    '.png')
-                    imgToSave.save('./'+self.sessionName+'/Output/Images/' + saveFilename)
-
-                    # Now put the cropped image in a markdown cell. 
-                    self.appendCellStart(linesToAdd, 'markdown')
-                    linesToAdd.append('    \"![](../Images/' +
-                                      saveFilename+')\"\n')
-                    self.appendCellEnd(linesToAdd, False)
-
-
-                #endif ImageLoaded
-            #endfor loop over all images wanted
-#        except: 
-#            print 'Problem with the quicklook images!'
-
-            # Now insert this block of linesToAdd[] containing the image cells into lines[]
-            for ll in range(0, len(linesToAdd)):
-                lines.insert(insertImageCells+ll, linesToAdd[ll])
-
-            
-    # Next part of the notebook is the IDV commands with the filename prepopulated
-            
-        # Add the load calls for all generated bundles, find the right cell 
-        insertIndexLoad = -1
-        for ll in range(0, len(lines)-1):
-            if 'loadBundle()' in lines[ll]:
-                insertIndexLoad = ll
-
-        lines[insertIndexLoad] = ('    \"#loadBundle(\''+finalBundles[0] +
-                                  '\')\\n\",\n')
-        for bb in range(1, len(finalBundles)):
-            lines.insert(insertIndexLoad+bb, '    \"#loadBundle(\'' +
-                         finalBundles[bb]+'\')\\n\"')
-            if bb != len(finalBundles)-1:
-                lines[insertIndexLoad+bb] += ','
-            lines[insertIndexLoad+bb] += '\n'
-
-        # Stub to add something at the very end of the Case Notebook if desired
-        #insertIndexEnd = -1
-        #for ll in range(0, len(lines)-1):
-        #    if lines[ll] == ' ],\n' and lines[ll+1] == ' \"metadata\": {\n':
-        #        insertIndexEnd = ll
-
-
-
-    # WRITE THE NOTEBOOK
-            outFile = open('./Tmp/'+caseNotebookFilename, 'w')
-            outFile.writelines(lines)
-            outFile.close()
-            call('mv ./Tmp/'+caseNotebookFilename +
-                 ' ./'+self.sessionName+'/Output/CaseNotebooks/'+caseNotebookFilename, shell=True)
 
-        print('Case Notebook created!')
+        # The next thing I want at the top is the imagery. This involves
+        # adding new cells.
+        # A Markdown cell with the name, then the ClickHist image (instead
+        # of a command to fetch it, which involves ![])
+        nameCell = ['**Common Filename:** `'+case['commonFilename']+'`']
+        if case['chImageFile'] is not None:
+            nameCell.append('![](../Images/' +
+                            os.path.basename(case['chImageFile'])+')')
+        topCells = [markdownCell(nameCell)]
+
+        # Then a cell with each quicklook image, in imageVar order
+        for imageFile in case['imageFiles']:
+            if imageFile is not None:
+                topCells.append(markdownCell(['![](../Images/' +
+                                              os.path.basename(imageFile) +
+                                              ')']))
+
+        # The IDV commands come with the filenames of all generated bundles
+        # prepopulated, then the notebook is written all at once
+        notebook = self.notebooks.build(
+            date, case['stats'], topCells,
+            ['../GeneratedBundles/'+os.path.basename(bundleFile)
+             for bundleFile in case['bundleFiles']])
+        self.notebooks.write(notebook, case['notebookFile'])
+        return
+
+    def recordCase(self, case):
+        """
+        Records a case and everything made for it in the catalog (last, so
+        that a case is only in the catalog once all of its files exist)
+        :param case: a case, from describeCase
+        :return:
+        """
+        self.catalog.addCase(case['commonFilename'],
+                             self.caseArtifacts(case),
+                             flatIndex=case['flatIndex'], lat=case['lat'],
+                             lon=case['lon'], time=case['time'],
+                             xVarName=self.xVarName, yVarName=self.yVarName,
+                             xValue=case['xVal'], yValue=case['yVal'],
+                             xPer=case['xPer'], yPer=case['yPer'],
+                             metadata=case['metadata'])
+        return
 
+    def recordSaved(self, case):
+        """
+        Records a case that was already saved in the catalog, if it isn't
+        there yet (a run that stopped after writing the notebook, but before
+        recording the case, leaves it out)
+        :param case: a case, from describeCase
+        :return:
+        """
+        if self.catalog.hasCase(case['commonFilename']):
+            return
+        # Its images were written by the earlier run
+        case['imageFiles'] = [self.imagePath(case, ii)
+                              for ii in range(0, len(self.imageVar))]
+        self.recordCase(case)
         return
 
-    
+    def caseArtifacts(self, case):
+        """
+        :param case: a case, from describeCase
+        :return: the (kind, path) of each file that exists for the case
+        """
+        artifacts = ([('bundle', bundleFile)
+                      for bundleFile in case['bundleFiles']] +
+                     [('script', case['islFile']),
+                      ('image', case['chImageFile'])] +
+                     [('image', imageFile)
+                      for imageFile in case['imageFiles']] +
+                     [('notebook', case['notebookFile'])])
+        return [(kind, path) for kind, path in artifacts
+                if path is not None and os.path.isfile(path)]
+
+    def loadBrokenLinkFrame(self):
+        """
+        Loads the image used in place of G5NR images that can't be fetched
+        :return: the decoded image, or None if there isn't one
+        """
+        if self.brokenLinkFrame is None:
+            try:
+                with open('BrokenLinkImage.png', 'rb') as imageFile:
+                    self.brokenLinkFrame = decodeFrame(imageFile.read())
+            except IOError:
+                print('(No Broken Link Image either - skipping the image)')
+        return self.brokenLinkFrame
+
     def convertToYMDT(self, unixTime):
         """
         Converts a Unix/Epoch time given in seconds to a YMDT string for
@@ -634,33 +971,52 @@ class ClickHistDo:
         """
         Finds the index of the appropriate latitude, longitude, and time
         based on the 1D index for the flattened data. This is accomplished
-        by the input data following the assumed order (when flattened, loop
-        through all longitudes, then all longitudes for the next latitude, etc.
-        until both all latitudes and longitudes have been seen for a time, then
-        next time, etc.)
+        by the input data following dimOrder (by default, when flattened,
+        loop through all longitudes, then all longitudes for the next
+        latitude, etc. until both all latitudes and longitudes have been seen
+        for a time, then next time, etc.), with indexOffsets added so that
+        the indices are into lons, lats, and times
         :param flatIndex: The 1D index of the x and y data in the flattened
-        arrays
+        arrays, or an array of them
         :return: (1) the index of the longitude, (2) the index of the latitude,
-        (3) the index of the time
+        (3) the index of the time (ints, or arrays of them for an array of
+        flat indices)
         """
-        lonIndex = flatIndex%self.lonLen
-        latIndex = (flatIndex/self.lonLen)%self.latLen
-        timeIndex = flatIndex/(self.lonLen*self.latLen)
-        return lonIndex, latIndex, timeIndex
-
-    def appendCellStart(self, lineList, cellType):
-
-        lineList.append('  {\n',)
-        lineList.append('   \"cell_type\": \"'+cellType+'\",\n')
-        lineList.append('   \"metadata\": {},\n')
-        lineList.append('   \"source\": [\n')
-
-    def appendCellEnd(self, lineList, lastCell):
-
-        lineList.append('   ]\n')
-
-        if lastCell is False:
-            lineList.append('  },\n')
-        else:
-            lineList.append('  }\n')
-
+        dimIndices = np.unravel_index(flatIndex,
+                                      [self.dataShape[dim]
+                                       for dim in self.dimOrder])
+        indices = []
+        for dim in ['lon', 'lat', 'time']:
+            index = dimIndices[self.dimOrder.index(dim)] + \
+                self.indexOffsets[dim]
+            if np.ndim(index) == 0:
+                index = int(index)
+            indices.append(index)
+        return indices[0], indices[1], indices[2]
+
+    def resolveIndices(self, flatIndices):
+        """
+        Finds the longitude, latitude, and time of many points at once
+        :param flatIndices: the 1D indices of the points in the flattened x
+        and y data (a list or array)
+        :return: a dict of arrays, one entry per point: valid (False for
+        flat indices outside of the data, whose other entries are those of
+        the first point of the data), lonIndex, latIndex, timeIndex (indices
+        into lons, lats, and times), lon, lat, time (as in times), datetime,
+        and unixTime (in seconds)
+        """
+        flatIndices = np.asarray(flatIndices, dtype=np.int64)
+        dataSize = int(np.prod([self.dataShape[dim]
+                                for dim in self.dimOrder]))
+        valid = (flatIndices >= 0) & (flatIndices < dataSize)
+        lonIndices, latIndices, timeIndices = \
+            self.find3DIndices(np.where(valid, flatIndices, 0))
+        return {'valid': valid,
+                'lonIndex': lonIndices,
+                'latIndex': latIndices,
+                'timeIndex': timeIndices,
+                'lon': np.asarray(self.lons)[lonIndices],
+                'lat': np.asarray(self.lats)[latIndices],
+                'time': np.asarray(self.times)[timeIndices],
+                'datetime': self.datetimes[timeIndices],
+                'unixTime': self.unixTimes[timeIndices]}
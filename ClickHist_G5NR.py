@@ -4,20 +4,41 @@
 
 # List of imports
 # ClickHistDo_Empty is used by default - can be overridden by user input.
+# ClickHistCache saves precomputed histograms and plot positions between
+# sessions.
+# hashlib fingerprints a sample of the data for the cache key when the data
+# isn't backed by files.
 # clear_output is needed to reset messages sent to the user.
 # pylab is needed for colorbars, plt is needed for plot visualizations, and
 # rcParams is needed to disable plot toolbars.
+# BoundaryNorm and ListedColormap map the bin of each scatter point to its
+# color.
+# LineCollection and PolyCollection draw the grid lines and 1D histogram bars
+# all at once, and ScalarMappable and Normalize set up the colorbar.
 # np is used for math.
+# spatial is used to find the nearest scatter point to a click.
 # stats is used to determine percentiles.
 # sys used to detect user platform - needed for differences in os x and
 # linux sed calls.
+# queue (Queue in Python 2) and threading run ClickHistDo in the background
+# so that the plot stays responsive.
+from cache_G5NR import ClickHistCache, makeKey
+import hashlib
 from IPython.display import clear_output
 from matplotlib import pylab, pyplot as plt, rcParams
+from matplotlib.cm import ScalarMappable
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.colors import BoundaryNorm, ListedColormap, Normalize
 import numpy as np
 import os
-from scipy import stats
+from scipy import spatial, stats
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 from subprocess import call
 import sys
+import threading
 
 __author__ = 'niznik'
 __clickHistImpName__ = 'CHAD G5NR'
@@ -25,7 +46,24 @@ __version__ = '1.1.4'
 __chversion__ = '1.0.2'
 
 
-class ClickHist:
+def findBins(data, binEdges):
+    """
+    Determines the bin of every value at once, using the same rules as
+    np.histogram2d: each bin includes its lower edge, and the last bin also
+    includes its upper edge
+    :param data: array of values to place in bins
+    :param binEdges: all bin edges
+    :return: an array with the bin of each value, or -1 for values outside
+    of the bin edges (including NaN)
+    """
+    binNum = len(binEdges)-1
+    bins = np.searchsorted(binEdges, data, side='right')-1
+    bins[data == binEdges[-1]] = binNum-1
+    bins[bins >= binNum] = -1
+    return bins
+
+
+class ClickHist(object):
     def __init__(self, xBinEdges, yBinEdges, xData, yData, **kwargs):
 
         """
@@ -38,6 +76,199 @@ class ClickHist:
         :return: a new instance of ClickHist
         """
 
+        # Set up the options, figure, and bins, none of which need the data
+        self.setUp(xBinEdges, yBinEdges, **kwargs)
+
+        # Store the raw x and y data as flattened, 1D views where that can be
+        # done without a copy (otherwise they are read a block at a time, see
+        # iterBlocks). Masked values are left out of the histogram and plot.
+        # In float32 mode, data that isn't float32 already is converted.
+        if self.float32:
+            if xData.dtype != np.float32:
+                xData = xData.astype(np.float32)
+            if yData.dtype != np.float32:
+                yData = yData.astype(np.float32)
+        self.dataShape = np.shape(xData)
+        self.dataSize = int(np.prod(self.dataShape))
+        self.xData, self.xMask = self.flatView(xData)
+        self.yData, self.yMask = self.flatView(yData)
+
+        # In density mode, every point is placed in the plot (and indexed)
+        if self.plotMode == 'density':
+            self.maxPlottedInBin = max(self.dataSize, 1)
+
+        # Set up the percentile lookups for clicked points
+        # 'scan' checks all of the data on every click, 'sorted' sorts each
+        # axis once up front so that each lookup is a binary search, and
+        # 'sketch' keeps a fine-grained histogram of each axis
+        self.xPercentiles = self.makePercentileEngine(self.xData, self.xMask,
+                                                      self.xBinEdges)
+        self.yPercentiles = self.makePercentileEngine(self.yData, self.yMask,
+                                                      self.yBinEdges)
+
+        # Use the histogram and plot positions from the cache if this data
+        # was seen before with the same bins and plot density
+        cached = None
+        if self.cacheDir is not None:
+            self.cache = ClickHistCache(self.cacheDir, self.cacheMaxBytes)
+            self.cacheKey = self.makeCacheKey()
+            cached = self.cache.load(self.cacheKey)
+
+        if cached is not None:
+            print('Using cached plot positions...')
+            self.seed = int(cached['seed'])
+            self.setHist(cached['hist'])
+            self.xDataFrac = cached['xDataFrac']
+            self.yDataFrac = cached['yDataFrac']
+            self.pointBins = cached['pointBins']
+            self.plotPos = cached['plotPos']
+        else:
+            # Calculate the histogram internally here, a block at a time,
+            # unless it was passed in (hist)
+            if self.histGiven is not None:
+                hist = np.asarray(self.histGiven, dtype=np.float64)
+                if hist.shape != (self.xBinNum, self.yBinNum):
+                    raise ValueError('hist should be '+str(self.xBinNum) +
+                                     ' x '+str(self.yBinNum))
+            else:
+                hist = np.zeros(self.xBinNum*self.yBinNum)
+                for xBlock, yBlock, xMask, yMask, flatOffset in \
+                        self.iterBlocks():
+                    binIds = self.findBinIds(xBlock, yBlock, xMask, yMask)
+                    hist += np.bincount(binIds[binIds >= 0],
+                                        minlength=self.xBinNum*self.yBinNum)
+            self.setHist(hist.reshape(self.xBinNum, self.yBinNum))
+
+            # Call generatePlotPositions() to calculate the fractional
+            # position of the x and y data in the plot as well as determine
+            # the bin of each scatter point (which sets its color). Also keep
+            # track of the location in the original data arrays of the x and
+            # y data. This is necessary due to the design decision to not
+            # plot every point (which would be time consuming and
+            # pointlessly plot many points over each other).
+            self.xDataFrac, self.yDataFrac,\
+                self.pointBins, self.plotPos = self.generatePlotPositions()
+
+            if self.cacheDir is not None:
+                self.cache.save(self.cacheKey, hist=self.hist,
+                                xDataFrac=self.xDataFrac,
+                                yDataFrac=self.yDataFrac,
+                                pointBins=self.pointBins,
+                                plotPos=self.plotPos, seed=self.seed)
+
+        self.finishSetUp()
+
+        # end of __init__
+
+    @classmethod
+    def fromChunks(cls, xBinEdges, yBinEdges, chunks, **kwargs):
+
+        """
+        Creates an instance of ClickHist from data that is read one chunk at
+        a time (e.g. netCDF time slabs), so that the full x and y data never
+        need to be in memory. The histogram is accumulated chunk by chunk,
+        and each bin keeps a random sample of at most maxPlottedInBin points
+        for the scatter. Percentiles come from the 'sketch' engine, the only
+        one that doesn't need all of the data at once.
+        :param xBinEdges: edges of the histogram on the x-axis
+        :param yBinEdges: edges of the histogram on the y-axis
+        :param chunks: an iterable of (xChunk, yChunk, flatOffset) tuples,
+        where flatOffset is the position of the first value of the chunk in
+        the flattened, 1D data (i.e. what ClickHistDo expects)
+        :param kwargs: same options as ClickHist, except that
+        percentileEngine can only be 'sketch' (in density mode, every point
+        is counted in the image, but only the sample can be clicked on)
+        :return: a new instance of ClickHist
+        """
+
+        if kwargs.get('percentileEngine', 'sketch') != 'sketch':
+            raise ValueError('fromChunks only supports the \'sketch\' ' +
+                             'percentileEngine')
+        self = cls.__new__(cls)
+        kwargs['percentileEngine'] = 'sketch'
+        self.setUp(xBinEdges, yBinEdges, **kwargs)
+
+        # The raw data is never stored
+        self.xData = None
+        self.yData = None
+        self.xMask = None
+        self.yMask = None
+        self.dataShape = None
+        self.dataSize = 0
+
+        self.xPercentiles = SketchPercentiles(self.xBinEdges)
+        self.yPercentiles = SketchPercentiles(self.yBinEdges)
+        hist = np.zeros(self.xBinNum*self.yBinNum)
+
+        # The sample kept for the scatter: positions in the flattened data,
+        # the x and y values, and the bin and random sort key of each point
+        sample = (np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0),
+                  np.zeros(0, dtype=np.int64), np.zeros(0))
+
+        print('Reading chunks...')
+        for xChunk, yChunk, flatOffset in chunks:
+            if self.float32:
+                xChunk = xChunk.astype(np.float32)
+                yChunk = yChunk.astype(np.float32)
+            xChunk, xMask = [np.ravel(member) if member is not None else None
+                             for member in self.flatView(xChunk)]
+            yChunk, yMask = [np.ravel(member) if member is not None else None
+                             for member in self.flatView(yChunk)]
+            self.dataSize += xChunk.size
+
+            self.xPercentiles.add(xChunk, xMask)
+            self.yPercentiles.add(yChunk, yMask)
+            binIds = self.findBinIds(xChunk, yChunk, xMask, yMask)
+            inHist = np.where(binIds >= 0)[0]
+            hist += np.bincount(binIds[inHist],
+                                minlength=self.xBinNum*self.yBinNum)
+
+            # Give every point in the histogram a random sort key and keep
+            # the maxPlottedInBin points with the smallest keys in each bin,
+            # which is a random sample of all points seen so far
+            chunkSample = (inHist+flatOffset, xChunk[inHist], yChunk[inHist],
+                           binIds[inHist],
+                           self.random.random_sample(len(inHist)))
+
+            if self.plotMode == 'density':
+                xChunkFrac, yChunkFrac, chunkBins = self.calcPlotPositions(
+                    chunkSample[1], chunkSample[2], chunkSample[3])
+                chunkRaster = self.calcDensityRaster(xChunkFrac, yChunkFrac)
+                if self.densityRaster is None:
+                    self.densityRaster = chunkRaster
+                else:
+                    self.densityRaster += chunkRaster
+            sample = [np.concatenate(pair)
+                      for pair in zip(sample, chunkSample)]
+            order = self.selectPlotted(sample[3], sample[4])
+            sample = [member[order] for member in sample]
+
+        hist = hist.reshape(self.xBinNum, self.yBinNum)
+        self.setHist(hist)
+
+        # Put the sample in the same order as generatePlotPositions()
+        # (by bin, then by position in the data)
+        plotPos, xValues, yValues, binIds, sortKey = sample
+        order = np.lexsort((plotPos, binIds))
+        self.plotPos = plotPos[order]
+        self.xDataFrac, self.yDataFrac, self.pointBins = \
+            self.calcPlotPositions(xValues[order], yValues[order],
+                                   binIds[order])
+
+        self.finishSetUp()
+
+        return self
+
+    def setUp(self, xBinEdges, yBinEdges, **kwargs):
+        """
+        Handles the options, figure, bins, and interactivity, i.e. everything
+        that does not depend on the data
+        :param xBinEdges: edges of the histogram on the x-axis
+        :param yBinEdges: edges of the histogram on the y-axis
+        :param kwargs: many options - see wiki for now
+        :return:
+        """
+
         # Start by determining the OS and disabling figure toolbars
         self.os = sys.platform
         rcParams['toolbar'] = 'None'
@@ -93,6 +324,102 @@ class ClickHist:
         if 'quantiles' in kwargs:
             self.quantiles = kwargs['quantiles']
 
+        # Set the default handling of the data
+        # kwargs may replace these (percentileEngine, float32, blockSize)
+        # float32 stores the data, fractions, and positions in 32 bits, and
+        # blockSize is the number of values processed at a time
+        self.percentileEngine = 'scan'
+        self.float32 = False
+        self.blockSize = 2**20
+
+        if 'percentileEngine' in kwargs:
+            self.percentileEngine = kwargs['percentileEngine']
+        if 'float32' in kwargs:
+            self.float32 = kwargs['float32']
+        if 'blockSize' in kwargs:
+            self.blockSize = kwargs['blockSize']
+
+        # Set the default sampling and caching options
+        # kwargs may replace these (seed, cacheDir, cacheMaxBytes, cacheKey,
+        # cacheSamples)
+        # seed sets which points are plotted in bins with more than
+        # maxPlottedInBin points, and setting cacheDir saves the histogram
+        # and plot positions there so that later sessions can reuse them
+        # cacheKey (any string that changes whenever the data does) and
+        # cacheSamples (how many values of data that isn't memory mapped
+        # from a file are hashed) set how the data is found in the cache
+        # (see makeCacheKey)
+        self.seed = None
+        self.cacheDir = None
+        self.cacheMaxBytes = 2**30
+        self.cacheKeyGiven = None
+        self.cacheSamples = 2**16
+
+        if 'seed' in kwargs:
+            self.seed = kwargs['seed']
+        if 'cacheDir' in kwargs:
+            self.cacheDir = kwargs['cacheDir']
+        if 'cacheMaxBytes' in kwargs:
+            self.cacheMaxBytes = kwargs['cacheMaxBytes']
+        if 'cacheKey' in kwargs:
+            self.cacheKeyGiven = kwargs['cacheKey']
+        if 'cacheSamples' in kwargs:
+            self.cacheSamples = kwargs['cacheSamples']
+
+        # Set the 2D histogram, if it was already counted
+        # kwargs may replace this (hist)
+        # hist (x bins by y bins, e.g. from G5NRDataset.allPairHists) saves
+        # a pass over the data to count it
+        self.histGiven = None
+
+        if 'hist' in kwargs:
+            self.histGiven = kwargs['hist']
+
+        # Set the default way of showing the points in the 2D histogram
+        # kwargs may replace these (plotMode, densityRes)
+        # 'scatter' plots up to maxPlottedInBin points per bin, while
+        # 'density' counts every point in a densityRes x densityRes image
+        # (and any point can be clicked on)
+        self.plotMode = 'scatter'
+        self.densityRes = 400
+        self.densityRaster = None
+
+        if 'plotMode' in kwargs:
+            self.plotMode = kwargs['plotMode']
+        if 'densityRes' in kwargs:
+            self.densityRes = kwargs['densityRes']
+        if self.plotMode not in ['scatter', 'density']:
+            raise ValueError('plotMode should be \'scatter\' or ' +
+                             '\'density\'')
+
+        # Set whether to run without a figure
+        # kwargs may replace this (headless)
+        # headless skips creating the figure entirely, so that cases can be
+        # selected with selectNearest and doAt without a display
+        self.headless = False
+
+        if 'headless' in kwargs:
+            self.headless = kwargs['headless']
+
+        # Set how clicked cases are passed to the doObject
+        # kwargs may replace these (doWorkers, doQueueSize)
+        # With doWorkers > 0, a confirmed click only queues the case (up to
+        # doQueueSize cases can wait), and that many background threads call
+        # the doObject, so the plot stays responsive. 0 calls the doObject
+        # right away, inside the click.
+        self.doWorkers = 2
+        self.doQueueSize = 20
+
+        if 'doWorkers' in kwargs:
+            self.doWorkers = kwargs['doWorkers']
+        if 'doQueueSize' in kwargs:
+            self.doQueueSize = kwargs['doQueueSize']
+
+        self.seedGiven = self.seed is not None
+        if self.seed is None:
+            self.seed = np.random.randint(0, 2**31-1)
+        self.random = np.random.RandomState(self.seed)
+
         # Set parameters that help place the 2D histogram locations
         # These should not change unless you want to experiment with placements
         self.xPixFracStart = 0.3
@@ -113,6 +440,46 @@ class ClickHist:
         self.xPixFracEnd_1DY = self.xPixFracStart-0.1
         self.xPixFracLen_1DY = self.xPixFracEnd_1DY-self.xPixFracStart_1DY
 
+        # Set the 2D histogram data needed for plotting
+        self.xBinEdges = xBinEdges
+        self.yBinEdges = yBinEdges
+        self.xBinNum = len(self.xBinEdges)-1
+        self.yBinNum = len(self.yBinEdges)-1
+        self.xBinEdgesFrac = np.arange(0., self.xBinNum+1., 1.)/self.xBinNum
+        self.yBinEdgesFrac = np.arange(0., self.yBinNum+1., 1.)/self.yBinNum
+
+        # Set the doObject that is used when a point is selected twice
+        self.doObject = None
+
+        # Set metadata, if any, passed by the user (default to blank)
+        self.metadata = ''
+        if 'metadata' in kwargs:
+            self.metadata = kwargs['metadata']
+
+        # Track the previously selected point (see __call__)
+        self.lastClickLoc = -1
+
+        # The queue of cases waiting for the doObject, the finished cases
+        # waiting to be reported, counts of cases in each state, and the
+        # flat indices of the cases queued or running (see submitPoint)
+        self.doQueue = queue.Queue(maxsize=self.doQueueSize)
+        self.doDone = queue.Queue()
+        self.doThreads = []
+        self.doLock = threading.Lock()
+        self.doCounts = {'queued': 0, 'running': 0, 'done': 0, 'failed': 0}
+        self.doPending = set()
+        self.doResults = []
+        self.doTimer = None
+        self.statusText = None
+
+        # Without a figure there is nothing else to set up
+        if self.headless:
+            self.figure = None
+            self.figDPI = self.figDPIReq
+            self.figXPixels = self.figXPixelsReq
+            self.figYPixels = self.figYPixelsReq
+            return
+
         # Create the figure and retrieve the actual DPI/pixel sizes
         # Checking here for quirks of getting a slightly smaller or bigger
         # figure than the requested size
@@ -139,23 +506,48 @@ class ClickHist:
                                              self.xPixFracLen+self.cbLen,
                                              self.yPixFracLen])
 
-        # Store the raw x and y data into a flattened, 1D array
-        self.xData = xData.flatten()
-        self.yData = yData.flatten()
+        # Set up interactivity
+        # Button press event tracks if there are clicks
+        # thinking makes sure that the previous click is processed before a new
+        # click is considered
+        # This also tracks the dot drawn at the click, the connecting line,
+        # and the location of the previous click
+        # The dot and line are only drawn with blitting (see
+        # blitClickMarkers) on top of a cached copy of the rest of the plot,
+        # which is saved after every full draw
+        self.cid = self.figure.canvas.mpl_connect('button_press_event', self)
+        self.drawCid = self.figure.canvas.mpl_connect('draw_event',
+                                                      self.onDraw)
+        self.thinking = 0
+        self.clicksInHist2D = 0
+        self.lastClickDot = self.axes_2D.scatter([], [],
+                                                 s=self.scatmarksize,
+                                                 c='#ff4080',
+                                                 edgecolors='#000000',
+                                                 lw=0, animated=True)
+        self.lastClickLine, = self.axes_2D.plot([], [], '-',
+                                                color='#ff4080',
+                                                animated=True)
+        self.background = None
+
+        # A copy of the whole figure (without the click markers) from the
+        # last full draw, that case images are made from (see snapshotClick)
+        self.snapshotBase = None
+
+        # Show the state of queued cases in the corner of the figure
+        self.statusText = self.figure.text(0.99, 0.01, '', ha='right',
+                                           fontsize=5)
 
-        # Set the 2D histogram data needed for plotting
-        self.xBinEdges = xBinEdges
-        self.yBinEdges = yBinEdges
-        self.xBinNum = len(self.xBinEdges)-1
-        self.yBinNum = len(self.yBinEdges)-1
-        self.xBinEdgesFrac = np.arange(0., self.xBinNum+1., 1.)/self.xBinNum
-        self.yBinEdgesFrac = np.arange(0., self.yBinNum+1., 1.)/self.yBinNum
+        return
 
-        # Calculate the histogram internally here
-        # (In the future: allow to be passed as a kwarg instead?)
-        self.hist, A, B = np.histogram2d(self.xData, self.yData,
-                                       [self.xBinEdges, self.yBinEdges])
-        del A, B
+    def setHist(self, hist):
+        """
+        Stores the 2D histogram along with the logarithmic and 1D histograms
+        derived from it
+        :param hist: the 2D histogram (x bins by y bins) of counts
+        :return:
+        """
+        self.hist = hist
         self.totalCounts = np.sum(self.hist)
 
         # Set a maximum and minimum power
@@ -183,42 +575,36 @@ class ClickHist:
         self.histYLog = np.where(self.histYLog < self.minPower,
                                  self.minPower, self.histYLog)
 
-        # Set up interactivity
-        # Button press event tracks if there are clicks
-        # thinking makes sure that the previous click is processed before a new
-        # click is considered
-        # This also tracks the dot drawn at the click, the connecting line,
-        # and the location of the previous click
-        self.cid = self.figure.canvas.mpl_connect('button_press_event', self)
-        self.thinking = 0
-        self.clicksInHist2D = 0
-        self.lastClickLoc = -1
-        self.lastClickDot = []
-        self.lastClickLine = []
-
-        # Call generatePlotPositions() to calculate the fractional position
-        # of the x and y data in the plot as well as determine the color of
-        # each scatter point (NOTE: pointColors may be replaced in a future
-        # version. Also keep track of the location in the original data arrays
-        # of the x and y data. This is necessary due to the design decision
-        # to not plot every point (which would be time consuming and
-        # pointlessly plot many points over each other).
-        self.xDataFrac, self.yDataFrac,\
-            self.pointColors, self.plotPos = self.generatePlotPositions()
+        # Set the color of each 2D bin, used to color the scatter points
+        self.binColors = self.calcBinColors()
 
-        # Set the doObject that is used when a point is selected twice
-        self.doObject = None
+        return
 
-        # Set metadata, if any, passed by the user (default to blank)
-        self.metadata = ''
-        if 'metadata' in kwargs:
-            self.metadata = kwargs['metadata']
+    def finishSetUp(self):
+        """
+        Finishes initialization once the plot positions are known
+        :return:
+        """
+
+        # In density mode, count the points in each pixel of the image
+        # (fromChunks counts them as it goes)
+        if self.plotMode == 'density' and self.densityRaster is None:
+            self.densityRaster = self.calcDensityRaster(self.xDataFrac,
+                                                        self.yDataFrac)
+
+        # In float32 mode, positions also use a smaller type when possible
+        if self.float32 and self.dataSize < 2**31:
+            self.plotPos = self.plotPos.astype(np.int32)
+
+        # Index the scatter points so that clicks don't need to check the
+        # distance to every plotted point
+        self.buildSpatialIndex()
 
         # Inform the user that the plot was successfully initialized
         print('ClickHist Initialized!')
         print('Call showPlot() to see plot.')
 
-        # end of __init__
+        return
 
     #__call__() function
     #Describes what to do when the user clicks on the plot
@@ -282,38 +668,15 @@ class ClickHist:
                 locOfMinError = self.findNearestPointToClick(xClickFracInPlot,
                                                              yClickFracInPlot)
 
-                # If this wasn't the first click, remove the point and line
-                # drawn last time to the closest point
-                if self.clicksInHist2D > 1:
-                    self.lastClickDot.remove()
-                    lineToRemove = self.lastClickLine.pop()
-                    lineToRemove.remove()
-
-                # Generate this call's click point and the line from the
-                # click to that point
-                self.lastClickDot = self.axes_2D.scatter(xClickFracInPlot,
-                                                         yClickFracInPlot,
-                                                         s=self.scatmarksize,
-                                                         c='#ff4080',
-                                                         edgecolors='#000000',
-                                                         lw=0)
-                closestDataXFrac = self.xDataFrac[locOfMinError]
-                closestDataYFrac = self.yDataFrac[locOfMinError]
-                self.lastClickLine = self.axes_2D.plot([xClickFracInPlot,
-                                                        closestDataXFrac],
-                                                        [yClickFracInPlot,
-                                                         closestDataYFrac],
-                                                       '-', color='#ff4080')
-                # Redraw the figure with the click point and line
-                plt.draw()
+                # Move the click point and the line from the click to the
+                # closest point, then draw just those on top of the cached
+                # plot
+                self.moveClickMarkers(xClickFracInPlot, yClickFracInPlot,
+                                      locOfMinError)
+                self.blitClickMarkers()
 
                 # Get the actual data values for the closest scatter point
-                closestDataX = self.convertFracToValue(
-                    self.xDataFrac[locOfMinError], self.xBinEdges,
-                    self.xBinEdgesFrac)
-                closestDataY = self.convertFracToValue(
-                    self.yDataFrac[locOfMinError], self.yBinEdges,
-                    self.yBinEdgesFrac)
+                closestDataX, closestDataY = self.pointValues(locOfMinError)
 
                 # If this wasn't the same point as last time, just inform
                 # the user of the new closest point
@@ -335,31 +698,13 @@ class ClickHist:
                 # for ClickHistDo and then call it.
                 else:
                     clear_output()
-                    plt.savefig('./Output/Tmp/mostRecentCH.png')
                     if self.doObject is None:
                         print('(Doing nothing - no doObject set...)')
                     else:
-                        xPercentile = self.findPercentile(self.xData,
-                                                          closestDataX)
-                        yPercentile = self.findPercentile(self.yData,
-                                                          closestDataY)
-                        # This can be edited to do just about anything!
-                        # Here is an implementation with specific
-                        # IDV functionality
-                        # --- USER EDIT FOR CLICKHISTDO ---
-                        self.doObject.do(self.plotPos[locOfMinError],
-                                         metadata=self.metadata,
-                                         xPer=xPercentile,
-                                         yPer=yPercentile,
-                                         xyVals=('X=' +
-                                                 self.xFmtStr.format(
-                                                     closestDataX) +
-                                                 ' '+self.xUnits +
-                                                 ' Y=' +
-                                                 self.yFmtStr.format(
-                                                     closestDataY) +
-                                                 ' '+self.yUnits))
-                        # --- END USER EDIT FOR CLICKHISTDO ---
+                        clickImage = self.snapshotClick(xClickFracInPlot,
+                                                        yClickFracInPlot,
+                                                        locOfMinError)
+                        self.submitPoint(locOfMinError, clickImage)
 
                     # This should probably not be touched - it checks for
                     # whether or not to reset the closest point
@@ -414,23 +759,355 @@ class ClickHist:
             # Allow for future clicks to be processed since we're done.
             self.thinking = 0
 
+    def selectNearest(self, xVal, yVal):
+        """
+        Finds the scatter point closest to a location given in data values,
+        the same way a click at that location would (i.e. by distance on the
+        plot, not in data units), without needing a figure
+        :param xVal: the x value (with units) of the location
+        :param yVal: the y value (with units) of the location
+        :return: the location of the point in the flattened data (as passed
+        to ClickHistDo), and the x and y values of the point
+        """
+        locOfMinError = self.findNearestPointToValues(xVal, yVal)
+        closestDataX, closestDataY = self.pointValues(locOfMinError)
+        return self.plotPos[locOfMinError], closestDataX, closestDataY
+
+    def doAt(self, xVal, yVal):
+        """
+        Calls ClickHistDo for the scatter point closest to a location given
+        in data values, exactly as double clicking that location would, so
+        that cases can be selected by a script (including in headless mode)
+        :param xVal: the x value (with units) of the location
+        :param yVal: the y value (with units) of the location
+        :return: whatever ClickHistDo returns
+        """
+        if self.doObject is None:
+            raise ValueError('No doObject set - call setDo first')
+
+        locOfMinError = self.findNearestPointToValues(xVal, yVal)
+
+        # With a figure, make the case image with the click markers just
+        # like a click
+        clickImage = None
+        if self.figure is not None:
+            xFrac = self.convertValueToFrac(xVal, self.xBinEdges,
+                                            self.xBinEdgesFrac)
+            yFrac = self.convertValueToFrac(yVal, self.yBinEdges,
+                                            self.yBinEdgesFrac)
+            self.moveClickMarkers(xFrac, yFrac, locOfMinError)
+            clickImage = self.snapshotClick(xFrac, yFrac, locOfMinError)
+
+        self.lastClickLoc = locOfMinError
+        return self.doPoint(locOfMinError, clickImage)
+
+    def doPoint(self, locOfMinError, clickImage=None):
+        """
+        Passes a scatter point, along with its percentiles and values, to
+        ClickHistDo
+        :param locOfMinError: the index of the scatter point
+        :param clickImage: the image of the figure with the point marked
+        (from snapshotClick), if any, passed on as clickImage
+        :return: whatever ClickHistDo returns
+        """
+        closestDataX, closestDataY = self.pointValues(locOfMinError)
+        doKwargs = {}
+        if clickImage is not None:
+            doKwargs['clickImage'] = clickImage
+        xPercentile = self.xPercentiles.percentile(closestDataX)
+        yPercentile = self.yPercentiles.percentile(closestDataY)
+        # This can be edited to do just about anything!
+        # Here is an implementation with specific IDV functionality
+        # --- USER EDIT FOR CLICKHISTDO ---
+        return self.doObject.do(self.plotPos[locOfMinError],
+                                metadata=self.metadata,
+                                xPer=xPercentile,
+                                yPer=yPercentile,
+                                xVal=closestDataX,
+                                yVal=closestDataY,
+                                xyVals=('X=' +
+                                        self.xFmtStr.format(closestDataX) +
+                                        ' '+self.xUnits +
+                                        ' Y=' +
+                                        self.yFmtStr.format(closestDataY) +
+                                        ' '+self.yUnits),
+                                **doKwargs)
+        # --- END USER EDIT FOR CLICKHISTDO ---
+
+    def submitPoint(self, locOfMinError, clickImage=None):
+        """
+        Passes a scatter point to ClickHistDo (see doPoint), in the
+        background if doWorkers > 0: the case waits in a queue for one of
+        the worker threads, and pollDo reports it once it is finished
+        :param locOfMinError: the index of the scatter point
+        :param clickImage: the image of the figure with the point marked
+        (see doPoint)
+        :return: True if the case was queued (or done), False if the queue
+        was full or the case is already queued or running
+        """
+        if self.doWorkers <= 0:
+            self.doPoint(locOfMinError, clickImage)
+            return True
+
+        # Start the workers the first time they are needed
+        if len(self.doThreads) == 0:
+            for ii in range(0, self.doWorkers):
+                doThread = threading.Thread(target=self.doWorker)
+                doThread.daemon = True
+                doThread.start()
+                self.doThreads.append(doThread)
+
+        # A case that is already queued or running isn't queued again, so
+        # that two workers never write the same case at once
+        flatIndex = int(self.plotPos[locOfMinError])
+        with self.doLock:
+            if flatIndex in self.doPending:
+                print('(That case is already queued or running)')
+                return False
+            try:
+                self.doQueue.put_nowait((locOfMinError, clickImage))
+            except queue.Full:
+                print('(Too many cases waiting - click again once one ' +
+                      'is finished)')
+                return False
+            self.doPending.add(flatIndex)
+            self.doCounts['queued'] += 1
+        print('Case queued ('+self.statusMessage()+')')
+        self.startDoTimer()
+        self.updateStatusText()
+        return True
+
+    def doWorker(self):
+        """
+        Runs queued cases through ClickHistDo until the program ends (each
+        background thread runs this)
+        :return:
+        """
+        while True:
+            locOfMinError, clickImage = self.doQueue.get()
+            with self.doLock:
+                self.doCounts['queued'] -= 1
+                self.doCounts['running'] += 1
+            result = {'flatIndex': self.plotPos[locOfMinError],
+                      'result': None, 'error': None}
+            try:
+                result['result'] = self.doPoint(locOfMinError, clickImage)
+            except Exception as error:
+                result['error'] = error
+            with self.doLock:
+                self.doPending.discard(int(result['flatIndex']))
+                self.doCounts['running'] -= 1
+                if result['error'] is None:
+                    self.doCounts['done'] += 1
+                else:
+                    self.doCounts['failed'] += 1
+            self.doDone.put(result)
+            self.doQueue.task_done()
+
+    def pollDo(self):
+        """
+        Reports the cases that have finished since the last call (called by
+        a timer on the figure, so that the figure is only touched by the
+        thread that draws it)
+        :return: the finished cases, as dicts with the flatIndex, the result
+        from ClickHistDo, and the error, if any
+        """
+        finished = []
+        while True:
+            try:
+                finished.append(self.doDone.get_nowait())
+            except queue.Empty:
+                break
+        for result in finished:
+            if result['error'] is None:
+                print('Case '+str(result['flatIndex'])+' finished')
+            else:
+                print('Case '+str(result['flatIndex'])+' failed: ' +
+                      repr(result['error']))
+        self.doResults.extend(finished)
+
+        if len(finished) > 0:
+            self.updateStatusText()
+        # Stop polling once nothing is left
+        with self.doLock:
+            idle = self.doCounts['queued']+self.doCounts['running'] == 0
+        if idle and self.doDone.empty() and self.doTimer is not None:
+            self.doTimer.stop()
+            self.doTimer = None
+        return finished
+
+    def waitForDo(self):
+        """
+        Waits until every queued case is finished (e.g. in a script)
+        :return: the cases that finished since pollDo was last called (see
+        pollDo)
+        """
+        self.doQueue.join()
+        return self.pollDo()
+
+    def statusMessage(self):
+        """
+        :return: a short description of the cases in each state
+        """
+        with self.doLock:
+            counts = dict(self.doCounts)
+        return (str(counts['queued'])+' queued, ' +
+                str(counts['running'])+' running, ' +
+                str(counts['done'])+' done, ' +
+                str(counts['failed'])+' failed')
+
+    def updateStatusText(self):
+        """
+        Shows the state of the cases in the corner of the figure
+        :return:
+        """
+        if self.statusText is None:
+            return
+        self.statusText.set_text('Cases: '+self.statusMessage())
+        self.figure.canvas.draw_idle()
+        return
+
+    def startDoTimer(self):
+        """
+        Starts checking for finished cases on the figure's event loop
+        (without a figure, call pollDo or waitForDo instead)
+        :return:
+        """
+        if self.figure is None or self.doTimer is not None:
+            return
+        self.doTimer = self.figure.canvas.new_timer(interval=250)
+        self.doTimer.add_callback(self.pollDo)
+        self.doTimer.start()
+        return
+
+    def pointValues(self, locOfMinError):
+        """
+        :param locOfMinError: the index of a scatter point
+        :return: the actual x and y data values of the scatter point
+        """
+        closestDataX = self.convertFracToValue(self.xDataFrac[locOfMinError],
+                                               self.xBinEdges,
+                                               self.xBinEdgesFrac)
+        closestDataY = self.convertFracToValue(self.yDataFrac[locOfMinError],
+                                               self.yBinEdges,
+                                               self.yBinEdgesFrac)
+        return closestDataX, closestDataY
+
+    def moveClickMarkers(self, xClickFracInPlot, yClickFracInPlot,
+                         locOfMinError):
+        """
+        Moves the click point and the line from the click to the closest
+        point (without drawing them)
+        :param xClickFracInPlot: the fractional x location of the click
+        :param yClickFracInPlot: the fractional y location of the click
+        :param locOfMinError: the index of the closest scatter point
+        :return:
+        """
+        self.lastClickDot.set_offsets([[xClickFracInPlot, yClickFracInPlot]])
+        self.lastClickLine.set_data([xClickFracInPlot,
+                                     self.xDataFrac[locOfMinError]],
+                                    [yClickFracInPlot,
+                                     self.yDataFrac[locOfMinError]])
+        return
+
+    def snapshotClick(self, xClickFracInPlot, yClickFracInPlot,
+                      locOfMinError):
+        """
+        Makes the image of the figure with a click marked, by drawing the
+        click point and the line to the closest point onto the copy of the
+        figure kept from the last full draw (so the scatter isn't drawn
+        again for every case)
+        :param xClickFracInPlot: the fractional x location of the click
+        :param yClickFracInPlot: the fractional y location of the click
+        :param locOfMinError: the index of the closest scatter point
+        :return: the image (a height x width x 4 RGBA array), or None if the
+        canvas doesn't keep a copy of the figure, in which case the figure
+        is saved to ./Output/Tmp/mostRecentCH.png instead (see
+        saveClickFigure)
+        """
+        if self.snapshotBase is None:
+            self.figure.canvas.draw()
+        if self.snapshotBase is None:
+            self.saveClickFigure()
+            return None
+
+        image = self.snapshotBase.copy()
+        height, width = image.shape[:2]
+        # Pixel locations of the click and the point, with row 0 at the top
+        pixels = self.axes_2D.transData.transform(
+            [[xClickFracInPlot, yClickFracInPlot],
+             [self.xDataFrac[locOfMinError], self.yDataFrac[locOfMinError]]])
+        pixels[:, 1] = height-1-pixels[:, 1]
+        markerColor = np.array([255, 64, 128, 255], dtype=np.uint8)
+
+        # The line, one pixel at every step along its longest direction
+        steps = int(np.ceil(np.amax(np.abs(pixels[1]-pixels[0]))))+1
+        lineCols = np.rint(np.linspace(pixels[0, 0], pixels[1, 0],
+                                       steps)).astype(int)
+        lineRows = np.rint(np.linspace(pixels[0, 1], pixels[1, 1],
+                                       steps)).astype(int)
+        inside = ((lineCols >= 0) & (lineCols < width) &
+                  (lineRows >= 0) & (lineRows < height))
+        image[lineRows[inside], lineCols[inside]] = markerColor
+
+        # The click point, as a filled circle the size of the scatter marks
+        # (whose size is an area in points squared)
+        radius = max(np.sqrt(self.scatmarksize)/2.*self.figDPI/72., 1.)
+        rowStart = max(int(pixels[0, 1]-radius), 0)
+        rowEnd = min(int(pixels[0, 1]+radius)+1, height)
+        colStart = max(int(pixels[0, 0]-radius), 0)
+        colEnd = min(int(pixels[0, 0]+radius)+1, width)
+        rows, cols = np.ogrid[rowStart:rowEnd, colStart:colEnd]
+        dot = ((rows-pixels[0, 1])**2+(cols-pixels[0, 0])**2 <= radius**2)
+        image[rowStart:rowEnd, colStart:colEnd][dot] = markerColor
+        return image
+
+    def saveClickFigure(self):
+        """
+        Saves the figure, including the click markers, for ClickHistDo (only
+        needed when snapshotClick can't be used)
+        :return:
+        """
+        # The click markers are left out of normal draws, so include them
+        # just for the saved figure
+        self.lastClickDot.set_animated(False)
+        self.lastClickLine.set_animated(False)
+        self.figure.savefig('./Output/Tmp/mostRecentCH.png')
+        self.lastClickDot.set_animated(True)
+        self.lastClickLine.set_animated(True)
+        self.figure.canvas.draw()
+        return
+
     def showPlot(self):
         """
         Displays the plot once all the prep work is finished.
         :return:
         """
-        # Starting out with a 'dummy' call to pcolor just to set the colorbar
-        # for later
-        p = self.axes_2D.pcolor(self.xBinEdgesFrac, self.yBinEdgesFrac,
-                                np.transpose(self.histLog),
-                                vmin=self.minPower, vmax=self.maxPower,
-                                cmap='Spectral_r')
-        self.axes_2D.cla()
-
-        # Scatter all of the points, previously filtered so that plot density
-        # is as desired
-        self.axes_2D.scatter(self.xDataFrac, self.yDataFrac,
-                             s=self.scatmarksize, c=self.pointColors, lw=0)
+
+        if self.figure is None:
+            raise ValueError('There is no plot to show in headless mode')
+
+        if self.plotMode == 'density':
+            # Show the fraction of points in each pixel (on a log scale,
+            # with the same colors and limits as the colorbar) as an image,
+            # so every point is shown at a fixed cost
+            self.axes_2D.imshow(np.ma.log10(np.ma.masked_equal(
+                                    self.densityRaster, 0) *
+                                    (1.0/self.totalCounts)),
+                                origin='lower', extent=(0, 1, 0, 1),
+                                aspect='auto', interpolation='nearest',
+                                cmap='Spectral_r', vmin=self.minPower,
+                                vmax=self.maxPower)
+        else:
+            # Scatter all of the points, previously filtered so that plot
+            # density is as desired
+            # Each point's bin is looked up in the table of bin colors
+            binNum = self.xBinNum*self.yBinNum
+            self.axes_2D.scatter(self.xDataFrac, self.yDataFrac,
+                                 s=self.scatmarksize, c=self.pointBins,
+                                 cmap=ListedColormap(self.binColors),
+                                 norm=BoundaryNorm(np.arange(binNum+1)-0.5,
+                                                   binNum), lw=0)
         # Deal with x-axis labeling
         self.axes_2D.set_xlim(self.xBinEdgesFrac[0], self.xBinEdgesFrac[-1])
         self.axes_2D.set_xticks(self.xBinEdgesFrac)
@@ -444,17 +1121,22 @@ class ClickHist:
                                      rotation=360)
         self.axes_2D.tick_params(axis='y', labelsize=6)
 
-        # Draw the bin separation lines for the 2D histogram
-        for yy in range(0, self.yBinNum):
-            self.axes_2D.axhline(y=self.yBinEdgesFrac[yy], color='#000000')
-        for xx in range(0, self.xBinNum):
-            self.axes_2D.axvline(x=self.xBinEdgesFrac[xx], color='#000000')
-
+        # Draw the bin separation lines for the 2D histogram, and then the
+        # quantile lines, each as a single collection
+        binLines = ([[(0, yy), (1, yy)] for yy in self.yBinEdgesFrac[:-1]] +
+                    [[(xx, 0), (xx, 1)] for xx in self.xBinEdgesFrac[:-1]])
+        self.axes_2D.add_collection(LineCollection(binLines,
+                                                   colors='#000000'))
+        quantileLines = []
         for quantile in self.quantiles:
-            self.axes_2D.axvline(x=np.percentile(self.xDataFrac, quantile),
-                                 ls='--', lw=0.5, color='#888888')
-            self.axes_2D.axhline(y=np.percentile(self.yDataFrac, quantile),
-                                 ls='--', lw=0.5, color='#888888')
+            xQuantile = np.percentile(self.xDataFrac, quantile)
+            yQuantile = np.percentile(self.yDataFrac, quantile)
+            quantileLines.append([(xQuantile, 0), (xQuantile, 1)])
+            quantileLines.append([(0, yQuantile), (1, yQuantile)])
+        self.axes_2D.add_collection(LineCollection(quantileLines,
+                                                   linestyles='dashed',
+                                                   linewidths=0.5,
+                                                   colors='#888888'))
 
         # Set other aesthetics for the plot
         self.axes_2D.set_title(self.xVarName+' vs '+self.yVarName,
@@ -466,45 +1148,28 @@ class ClickHist:
         self.axes_2D.xaxis.set_label_coords(0.5, -0.43)
         self.axes_2D.yaxis.set_label_coords(-0.43, 0.5)
 
-        # Create the colorbar
-        cbar = plt.colorbar(p, ticks=self.histTicks,
+        # Create the colorbar (from a mappable that only holds the colormap
+        # and the range of powers)
+        colorScale = ScalarMappable(norm=Normalize(vmin=self.minPower,
+                                                   vmax=self.maxPower),
+                                    cmap='Spectral_r')
+        colorScale.set_array(np.array([]))
+        cbar = plt.colorbar(colorScale, ax=self.axes_2D,
+                            ticks=self.histTicks,
                             fraction=((self.cbLen /
                                       (self.xPixFracLen+self.cbLen)) -
                                       self.cbPad),
                             pad=self.cbPad)
         cbar.ax.tick_params(labelsize=8)
 
-        # Draw the x-axis 1D histogram, first to set the axes, and then again
-        # to draw each bar with the proper color
-        self.axes_1DX.bar(self.xBinEdgesFrac[:-1], self.histXLog-self.minPower,
-                          width=1./self.xBinNum)
-        for ii in range(0,self.xBinNum):
-            cbPercent = (self.histXLog[ii]-self.minPower)*\
-                        (1.0/abs(self.minPower))
-            barColorsX = pylab.cm.Spectral_r(cbPercent)
-            self.axes_1DX.bar(self.xBinEdgesFrac[ii], self.histXLog[ii] -
-                              self.minPower, width=1./self.xBinNum,
-                              color=barColorsX)
-            if ii != 0:
-                self.axes_1DX.axvline(x=self.xBinEdgesFrac[ii],
-                                      ls='--', lw=1, color='#444444')
+        # Draw the x-axis 1D histogram as one collection of bars, each with
+        # the proper color, along with the bin separation lines
+        self.drawBars(self.axes_1DX, self.xBinEdgesFrac, self.histXLog, False)
         self.axes_1DX.xaxis.set_visible(False)
         self.axes_1DX.yaxis.set_visible(False)
 
-        # Draw the y-axis 1D histogram, first to set the axes, and then again
-        # to draw each bar with the proper color
-        self.axes_1DY.barh(self.yBinEdgesFrac[:-1], self.histYLog -
-                           self.minPower, height=1./self.yBinNum)
-        for ii in range(0,self.yBinNum):
-            cbPercent = ((self.histYLog[ii]-self.minPower) *
-                         (1.0/abs(self.minPower)))
-            barColorsY = pylab.cm.Spectral_r(cbPercent)
-            self.axes_1DY.barh(self.yBinEdgesFrac[ii], self.histYLog[ii] -
-                               self.minPower, height=1./self.yBinNum,
-                               color=barColorsY)
-            if ii != 0:
-                self.axes_1DY.axhline(y=self.yBinEdgesFrac[ii],
-                                      ls='--', lw=1, color='#444444')
+        # Same for the y-axis 1D histogram, with horizontal bars
+        self.drawBars(self.axes_1DY, self.yBinEdgesFrac, self.histYLog, True)
         self.axes_1DY.xaxis.set_visible(False)
         self.axes_1DY.yaxis.set_visible(False)
 
@@ -512,13 +1177,16 @@ class ClickHist:
         # There is currently no implemented method to change all of the
         # fractional paramters if the window is resized, so clicking would
         # break
+        # Non-interactive backends (e.g. Agg) have no window at all
         print('(Using '+plt.get_backend()+')')
-        if plt.get_backend() == 'Qt4Agg':
-            figMan = plt.get_current_fig_manager()
+        figMan = plt.get_current_fig_manager()
+        hasWindow = getattr(figMan, 'window', None) is not None
+        if not hasWindow:
+            print('(No window to show the plot in - use figure.savefig)')
+        elif plt.get_backend() == 'Qt4Agg':
             figMan.window.setFixedSize(self.figXPixelsReq, self.figYPixelsReq)
             figMan.window.statusBar().hide()
         elif plt.get_backend() == 'TkAgg':
-            figMan = plt.get_current_fig_manager()
             figMan.window.resizable(False, False)
         else:
             print('Warning - undetected figure manager. Resizing window ' +
@@ -532,8 +1200,93 @@ class ClickHist:
                          'Built on ClickHist Version '+__chversion__,
                          fontsize=4)
 
-        plt.show()
+        if hasWindow:
+            plt.show()
+
+        return
+
+    def drawBars(self, axes, binEdgesFrac, histLog, horizontal):
+        """
+        Draws a 1D histogram as a single collection of colored bars, plus the
+        dashed lines separating the bins
+        :param axes: the axes to draw in
+        :param binEdgesFrac: the fractional bin edge values along the axis
+        :param histLog: the logarithmic 1D histogram
+        :param horizontal: True to draw horizontal bars (y-axis histogram)
+        :return:
+        """
+        heights = histLog-self.minPower
+        barColors = pylab.cm.Spectral_r(heights*(1.0/abs(self.minPower)))
+        bars = []
+        separators = []
+        for ii in range(0, len(heights)):
+            low = binEdgesFrac[ii]
+            high = binEdgesFrac[ii+1]
+            bars.append([(low, 0), (low, heights[ii]),
+                         (high, heights[ii]), (high, 0)])
+            if ii != 0:
+                separators.append([(low, 0), (low, 1)])
+        bars = np.array(bars)
+        separators = np.array(separators)
+        if horizontal:
+            bars = bars[:, :, ::-1]
+            separators = separators[:, :, ::-1]
+
+        axes.add_collection(PolyCollection(bars, facecolors=barColors,
+                                           edgecolors='none'))
+        # The separators span the whole axes in the direction of the bars
+        separatorTransform = axes.get_xaxis_transform()
+        if horizontal:
+            separatorTransform = axes.get_yaxis_transform()
+        axes.add_collection(LineCollection(separators, linestyles='dashed',
+                                           linewidths=1, colors='#444444',
+                                           transform=separatorTransform))
+
+        if horizontal:
+            axes.set_ylim(binEdgesFrac[0], binEdgesFrac[-1])
+            axes.set_xlim(0, max(np.amax(heights), 1)*1.05)
+        else:
+            axes.set_xlim(binEdgesFrac[0], binEdgesFrac[-1])
+            axes.set_ylim(0, max(np.amax(heights), 1)*1.05)
+        return
+
+    def onDraw(self, event):
+        """
+        Saves a copy of the 2D histogram (for blitting) and of the whole
+        figure (for case images) after every full draw of the figure and
+        then puts the click markers back on top of it
+        :param event: a draw event
+        :return:
+        """
+        try:
+            self.background = self.figure.canvas.copy_from_bbox(
+                self.axes_2D.bbox)
+        except AttributeError:
+            # This canvas can't blit
+            self.background = None
+        try:
+            self.snapshotBase = np.array(self.figure.canvas.buffer_rgba())
+        except AttributeError:
+            # This canvas doesn't keep the image (see saveClickFigure)
+            self.snapshotBase = None
+        self.axes_2D.draw_artist(self.lastClickDot)
+        self.axes_2D.draw_artist(self.lastClickLine)
+        return
 
+    def blitClickMarkers(self):
+        """
+        Redraws only the click markers, on top of the saved copy of the 2D
+        histogram, so that the scatter doesn't need to be drawn again.
+        Falls back on a full draw if there is no saved copy yet.
+        :return:
+        """
+        if self.background is None:
+            self.figure.canvas.draw_idle()
+            return
+        self.figure.canvas.restore_region(self.background)
+        self.axes_2D.draw_artist(self.lastClickDot)
+        self.axes_2D.draw_artist(self.lastClickLine)
+        self.figure.canvas.blit(self.axes_2D.bbox)
         return
 
     def generatePlotPositions(self):
@@ -542,90 +1295,337 @@ class ClickHist:
         This method calculates the x and y coordinates in the plot for each
         scatter point, xDataFrac and yDataFrac, using a fractional
         system with 0 and 1 as end points (e.g. 0.5 is "halfway"),
-        the appropriate color to shade each point, pointColors, based on a
-        colorbar generated using the maximum and minimum powers for the plot,
-        and plotPos, which keeps track of the index of the x and y data
-        in their original arrays.
-
-        The color stored could be used in theory to determine the bin to which
-        a particular point belongs. (NOTE: There is perhaps an argument to
-        replace pointColors with "pointBin" or something similar in a future
-        version, but sticking with legacy implementation for now.) This is
-        needed to deal with the potential for uneven bin spacings.
+        the 2D bin of each point, pointBins, which sets the color to shade
+        each point (see binColors), and plotPos, which keeps track of the
+        index of the x and y data in their original arrays.
+
+        Storing the bin (instead of a color per point, as in earlier
+        versions) is needed to deal with the potential for uneven bin
+        spacings, and keeps the scatter small: one small integer per point,
+        mapped through a single lookup table of colors when drawing.
         Additionally, this method thins out the data to meet the expectations
         of the point density per bin indicated by the user (maxPlottedInBin).
 
+        Every point is assigned to its 2D bin once (see findBinIds), so the
+        scatter follows the same bin edge rules as np.histogram2d. Points are
+        then grouped by bin by sorting, a block of data at a time, instead of
+        searching all of the data once per bin.
+
         :return: (1) Flattened x-axis histogram data containing the fractional
         position of each scatter point on the plot (e.g. 0.5 represents the
         middle of the plot, multiplied by a hypothetical width of 500 for the
         2D histogram yields 250 pixels from the left),
         (2) Same as (1), but for y-axis data, and
-        (3) the associated color for each x-y scatter point based on the
-        color bar generated by minPower and maxPower.
+        (3) the 2D bin (x bin*yBinNum + y bin) of each x-y scatter point, and
         (4) The indices of the selected x and y data in the original
         xData and yData arrays.
         """
 
-        # Initialize the arrays that will be returned in the end
         print('Calculating pos...')
-        xDataFrac = []
-        yDataFrac = []
-        pointColors = []
-        plotPos = []
-        for v1bin in range(0, self.xBinNum):
-            for v2bin in range(0, self.yBinNum):
-
-                # Calculate the middle point of each bin, determine its span
-                # in either direction (i.e. 1/2 of its width), and then find
-                # all points that belong to that particular bin
-                xBinMid = (self.xBinEdges[v1bin]+self.xBinEdges[v1bin+1])/2.
-                yBinMid = (self.yBinEdges[v2bin]+self.yBinEdges[v2bin+1])/2.
-                xAcceptError = (self.xBinEdges[v1bin+1] -
-                                self.xBinEdges[v1bin])/2.
-                yAcceptError = (self.yBinEdges[v2bin+1] -
-                                self.yBinEdges[v2bin])/2.
-                localMatches = np.intersect1d(np.where(np.abs(self.xData -
-                       xBinMid) < xAcceptError), np.where(np.abs(self.yData -
-                       yBinMid) < yAcceptError))
-                numOfLocalMatches = len(localMatches)
-
-                # If there is at least one member to a bin...
-                if(numOfLocalMatches != 0):
-                    # If there are more points than the density allows,
-                    # shuffle them before picking out the first
-                    # maxPlottedInBin points for the plot.
-                    if numOfLocalMatches > self.maxPlottedInBin:
-                        np.random.shuffle(localMatches)
-                    for mm in range(0, min(numOfLocalMatches,
-                                           self.maxPlottedInBin)):
-
-                        # Keep track of the position of matches in the
-                        # original xData and yData variables so that
-                        # they can be found easily when ClickHistDo is called
-                        plotPos.append(localMatches[mm])
-
-                        # Get the x and y data, calculate the fractional
-                        # position, and then store it
-                        xDataTemp = self.xData[localMatches[mm]]
-                        yDataTemp = self.yData[localMatches[mm]]
-                        xDataFracTemp = ((1.0*v1bin/self.xBinNum) +
-                            (self.calcFracPastBinMin(xDataTemp, self.xBinEdges,
-                                                     v1bin)/self.xBinNum))
-                        yDataFracTemp = ((1.0*v2bin/self.yBinNum) +
-                            (self.calcFracPastBinMin(yDataTemp, self.yBinEdges,
-                                                     v2bin)/self.yBinNum))
-                        xDataFrac.append(xDataFracTemp)
-                        yDataFrac.append(yDataFracTemp)
-
-                        # Calculate the color of the scatterpoint based on its
-                        # bin
-                        locLogCount = self.histLog[v1bin, v2bin]
-                        cbPercent = ((locLogCount-self.minPower) *
-                                     (1.0/abs(self.minPower)))
-                        pointColors.append(pylab.cm.Spectral_r(cbPercent))
-
-        return np.array(xDataFrac), np.array(yDataFrac), \
-            np.array(pointColors), np.array(plotPos)
+
+        # If there are more points in a bin than the density allows, give
+        # them a random sort key before picking out the first maxPlottedInBin
+        # points for the plot. Points in all other bins keep a key of zero so
+        # they stay in the order of the original data (lexsort is stable).
+        # This is done a block at a time, with each block merged into the
+        # points picked so far. If no bin has too many points, every point
+        # is kept and they only need to be sorted by bin once at the end.
+        overfull = self.hist.ravel() > self.maxPlottedInBin
+        thinning = np.any(overfull)
+        plotPos = [np.zeros(0, dtype=np.int64)]
+        binIds = [np.zeros(0, dtype=np.int64)]
+        shuffleKey = [np.zeros(0)]
+        for xBlock, yBlock, xMask, yMask, flatOffset in self.iterBlocks():
+            blockBinIds = self.findBinIds(xBlock, yBlock, xMask, yMask)
+            inHist = np.where(blockBinIds >= 0)[0]
+            blockBinIds = blockBinIds[inHist]
+            blockShuffleKey = np.zeros(len(inHist))
+            blockOverfull = overfull[blockBinIds]
+            blockShuffleKey[blockOverfull] = self.random.random_sample(
+                np.count_nonzero(blockOverfull))
+
+            # Keep track of the position of matches in the original xData
+            # and yData variables so that they can be found easily when
+            # ClickHistDo is called
+            plotPos.append(inHist+flatOffset)
+            binIds.append(blockBinIds)
+            shuffleKey.append(blockShuffleKey)
+            if thinning:
+                plotPos = [np.concatenate(plotPos)]
+                binIds = [np.concatenate(binIds)]
+                shuffleKey = [np.concatenate(shuffleKey)]
+                order = self.selectPlotted(binIds[0], shuffleKey[0])
+                plotPos = [plotPos[0][order]]
+                binIds = [binIds[0][order]]
+                shuffleKey = [shuffleKey[0][order]]
+
+        plotPos = np.concatenate(plotPos)
+        binIds = np.concatenate(binIds)
+        if not thinning:
+            order = np.argsort(binIds, kind='mergesort')
+            plotPos = plotPos[order]
+            binIds = binIds[order]
+
+        xDataFrac, yDataFrac, pointBins = self.calcPlotPositions(
+            self.dataAt(self.xData, plotPos), self.dataAt(self.yData, plotPos),
+            binIds)
+
+        return xDataFrac, yDataFrac, pointBins, plotPos
+
+    def selectPlotted(self, binIds, sortKey):
+        """
+        Thins out the points in each bin to at most maxPlottedInBin, keeping
+        the points with the smallest sort keys (ties stay in their original
+        order)
+        :param binIds: the 2D bin of each point (x bin*yBinNum + y bin)
+        :param sortKey: the sort key of each point
+        :return: the indices of the kept points, ordered by bin and then by
+        sort key
+        """
+        order = np.lexsort((sortKey, binIds))
+        binCounts = np.bincount(binIds, minlength=self.xBinNum*self.yBinNum)
+        binStarts = np.cumsum(binCounts)-binCounts
+        rankInBin = np.arange(len(order))-binStarts[binIds[order]]
+        return order[rankInBin < self.maxPlottedInBin]
+
+    def calcPlotPositions(self, xValues, yValues, binIds):
+        """
+        Calculates the fractional position of scatter points
+        :param xValues: the x data of each point
+        :param yValues: the y data of each point
+        :param binIds: the 2D bin (x bin*yBinNum + y bin) of each point
+        :return: (1) the fractional x position of each point, (2) the
+        fractional y position of each point, and (3) the 2D bin of each
+        point, stored in the smallest type that fits
+        """
+        xBins = binIds//self.yBinNum
+        yBins = binIds % self.yBinNum
+
+        # Calculate the fractional position of each point straight into
+        # arrays of the final type
+        fracType = np.float64
+        if self.float32:
+            fracType = np.float32
+        xDataFrac = np.empty(len(binIds), dtype=fracType)
+        yDataFrac = np.empty(len(binIds), dtype=fracType)
+        np.add(xBins, self.calcFracPastBinMin(xValues, self.xBinEdges, xBins),
+               out=xDataFrac)
+        np.add(yBins, self.calcFracPastBinMin(yValues, self.yBinEdges, yBins),
+               out=yDataFrac)
+        xDataFrac /= self.xBinNum
+        yDataFrac /= self.yBinNum
+
+        binType = np.uint16
+        if self.xBinNum*self.yBinNum > 2**16:
+            binType = np.int32
+
+        return xDataFrac, yDataFrac, binIds.astype(binType)
+
+    def calcDensityRaster(self, xDataFrac, yDataFrac):
+        """
+        Counts the points in each pixel of a densityRes x densityRes image of
+        the 2D histogram, all in one pass
+        :param xDataFrac: the fractional x position of each point
+        :param yDataFrac: the fractional y position of each point
+        :return: the count of points in each pixel (rows are y, starting
+        from the bottom, and columns are x)
+        """
+        xPixels = np.minimum((xDataFrac*self.densityRes).astype(np.intp),
+                             self.densityRes-1)
+        yPixels = np.minimum((yDataFrac*self.densityRes).astype(np.intp),
+                             self.densityRes-1)
+        counts = np.bincount(yPixels*self.densityRes+xPixels,
+                             minlength=self.densityRes**2)
+        return counts.reshape(self.densityRes, self.densityRes)
+
+    def calcBinColors(self):
+        """
+        Calculates the color of every 2D bin, using the colorbar generated by
+        minPower and maxPower. Scatter points get the color of their bin.
+        :return: an array with the color (RGBA) of each 2D bin, in the order
+        of the bins in pointBins
+        """
+        cbPercent = ((self.histLog.ravel()-self.minPower) *
+                     (1.0/abs(self.minPower)))
+        return pylab.cm.Spectral_r(cbPercent)
+
+    @property
+    def pointColors(self):
+        """
+        The color of each scatter point (looked up from its bin)
+        """
+        return self.binColors[self.pointBins]
+
+    def makeCacheKey(self):
+        """
+        Builds the key for this ClickHist in the cache from the x and y
+        data, the bins, and the options that change the plot positions.
+        So that a warm start doesn't have to read all of the data, the data
+        is identified by the first of these that applies:
+        (1) the cacheKey option, if the caller gave one
+        (2) the file, size, modification time, and position in the file of
+        data memory mapped read only (e.g. np.load with mmap_mode='r')
+        (3) a hash of cacheSamples values spread evenly through the data
+        A sampled hash misses changes to values between the samples, so data
+        that is changed in place should be given a cacheKey that changes
+        with it.
+        :return: the cache key
+        """
+        dataArrays = [self.xData, self.yData, self.xMask, self.yMask]
+        if self.cacheKeyGiven is not None:
+            dataKey = ('given', self.cacheKeyGiven)
+        else:
+            identities = [self.fileIdentity(data) for data in dataArrays
+                          if data is not None]
+            if None not in identities:
+                dataKey = ('files', identities,
+                           [data is None for data in dataArrays])
+            else:
+                positions = np.unique(np.linspace(
+                    0, self.dataSize-1,
+                    min(self.cacheSamples, self.dataSize)).astype(np.int64))
+                dataHash = hashlib.sha1()
+                for data in dataArrays:
+                    if data is not None:
+                        dataHash.update(np.ascontiguousarray(
+                            self.dataAt(data, positions)).tobytes())
+                    dataHash.update(b'|')
+                dataKey = ('sampled', positions.size, dataHash.hexdigest())
+        explicitSeed = None
+        if self.seedGiven:
+            explicitSeed = self.seed
+        return makeKey(dataKey, str(self.xData.dtype),
+                       str(self.yData.dtype), self.dataShape,
+                       np.asarray(self.xBinEdges, dtype=float),
+                       np.asarray(self.yBinEdges, dtype=float),
+                       self.maxPlottedInBin, self.float32, explicitSeed)
+
+    def fileIdentity(self, data):
+        """
+        Identifies data that is memory mapped read only from a file, without
+        reading it
+        :param data: an array
+        :return: the file, its size and modification time, and the dtype,
+        shape, strides, and position in the file of the data, or None if the
+        data isn't memory mapped read only
+        """
+        # Views (e.g. from reshape) keep the np.memmap they came from as
+        # their base
+        mapped = data
+        while isinstance(mapped.base, np.ndarray):
+            mapped = mapped.base
+        if (not isinstance(mapped, np.memmap) or mapped.filename is None or
+                mapped.mode != 'r'):
+            return None
+        fileStat = os.stat(mapped.filename)
+        position = (mapped.offset +
+                    data.__array_interface__['data'][0] -
+                    mapped.__array_interface__['data'][0])
+        return (os.path.abspath(mapped.filename), fileStat.st_size,
+                fileStat.st_mtime, str(data.dtype), data.shape, data.strides,
+                position)
+
+    def findBinIds(self, xValues, yValues, xMask=None, yMask=None):
+        """
+        Determines the 2D bin of every point at once
+        :param xValues: 1D array of x data
+        :param yValues: 1D array of y data
+        :param xMask: 1D array that is True where the x data is masked,
+        or None
+        :param yMask: same as xMask, but for the y data
+        :return: an array with the 2D bin (x bin*yBinNum + y bin) of each
+        point, or -1 for points outside of the histogram or masked
+        """
+        xBins = findBins(xValues, self.xBinEdges)
+        yBins = findBins(yValues, self.yBinEdges)
+        binIds = xBins*self.yBinNum+yBins
+        binIds[(xBins < 0) | (yBins < 0)] = -1
+        if xMask is not None:
+            binIds[xMask] = -1
+        if yMask is not None:
+            binIds[yMask] = -1
+        return binIds
+
+    def flatView(self, data):
+        """
+        Flattens data to 1D without making a copy, when that is possible
+        (C-contiguous arrays, including np.memmap). Any other array is
+        returned as it is and read a block at a time (see iterBlocks).
+        Masked arrays are split into their data and mask.
+        :param data: an array of any shape, possibly masked
+        :return: (1) the data, (2) an array that is True where the data is
+        masked, or None if nothing is masked
+        """
+        mask = None
+        if np.ma.isMaskedArray(data):
+            if np.ma.getmask(data) is not np.ma.nomask:
+                mask = self.flatView(np.ma.getmaskarray(data))[0]
+            data = np.ma.getdata(data)
+        data = np.asanyarray(data)
+        if data.flags['C_CONTIGUOUS']:
+            data = data.reshape(-1)
+        return data, mask
+
+    def iterBlocks(self):
+        """
+        Steps through the x and y data (and masks) a block of about blockSize
+        values at a time so that the work arrays stay small. Data that could
+        not be flattened without a copy is split along its first axis, so
+        only one block of it is copied at a time.
+        :return: a generator of (xBlock, yBlock, xMaskBlock, yMaskBlock,
+        flatOffset) with 1D blocks, where flatOffset is the position of the
+        first value of the block in the flattened data
+        """
+        rowSize = 1
+        if self.xData.ndim > 1 or self.yData.ndim > 1:
+            rowSize = self.dataSize//self.dataShape[0]
+        rowNum = self.dataSize//rowSize
+        rowsPerBlock = max(1, self.blockSize//rowSize)
+        for rowStart in range(0, rowNum, rowsPerBlock):
+            rowEnd = min(rowStart+rowsPerBlock, rowNum)
+            blocks = [self.getBlock(data, rowStart, rowEnd, rowSize)
+                      for data in (self.xData, self.yData,
+                                   self.xMask, self.yMask)]
+            yield tuple(blocks)+(rowStart*rowSize,)
+
+    def getBlock(self, data, rowStart, rowEnd, rowSize):
+        """
+        Returns a block of data as a 1D array (see iterBlocks)
+        :param data: the data, either flattened or in its original shape
+        :param rowStart: the first row (along the first axis) of the block
+        :param rowEnd: one past the last row of the block
+        :param rowSize: the number of values in one row
+        :return: the block, or None if data is None
+        """
+        if data is None:
+            return None
+        if data.ndim == 1:
+            return data[rowStart*rowSize:rowEnd*rowSize]
+        return np.ravel(data[rowStart:rowEnd])
+
+    def dataAt(self, data, positions):
+        """
+        Looks up values by their position in the flattened data, whether or
+        not the data was stored flattened
+        :param data: the data, either flattened or in its original shape
+        :param positions: positions in the flattened data
+        :return: the values at those positions
+        """
+        if data.ndim == 1:
+            return data[positions]
+        return data.flat[positions]
+
+    def buildSpatialIndex(self):
+        """
+        Builds a k-d tree over the fractional positions of the scatter points
+        so that nearest point lookups take O(log n) time instead of checking
+        every plotted point. Needs to be called again whenever xDataFrac or
+        yDataFrac change.
+        :return:
+        """
+        self.spatialIndex = spatial.cKDTree(np.column_stack((self.xDataFrac,
+                                                             self.yDataFrac)))
+        return
 
     def findNearestPointToClick(self, xClickVal, yClickVal):
         """
@@ -637,11 +1637,36 @@ class ClickHist:
         2D histogram
         :return: The 1D array index of the closest point
         """
-        error = ((self.xDataFrac-xClickVal)**2 +
-                 (self.yDataFrac-yClickVal)**2)**0.5
-        minError = np.amin(error)
-        locOfMinError = np.where(error == minError)[0][0]
-        return locOfMinError
+        minError, locOfMinError = self.spatialIndex.query([xClickVal,
+                                                           yClickVal])
+        return int(locOfMinError)
+
+    def findNearestPointToValues(self, xVal, yVal):
+        """
+        Same as findNearestPointToClick, but for a location given in data
+        values (with units)
+        :param xVal: the x value of the location
+        :param yVal: the y value of the location
+        :return: The 1D array index of the closest point
+        """
+        return self.findNearestPointToClick(
+            self.convertValueToFrac(xVal, self.xBinEdges, self.xBinEdgesFrac),
+            self.convertValueToFrac(yVal, self.yBinEdges, self.yBinEdgesFrac))
+
+    def findNearestPointsToClick(self, xClickVal, yClickVal, k):
+        """
+        Same as findNearestPointToClick, but for the k closest points
+        :param xClickVal: The fractional x location of the click within the
+        2D histogram
+        :param yClickVal: The fractional y location of the click within the
+        2D histogram
+        :param k: The number of points to return
+        :return: The 1D array indices of the k closest points, closest first
+        """
+        k = min(k, len(self.xDataFrac))
+        errors, locsOfMinError = self.spatialIndex.query([xClickVal,
+                                                          yClickVal], k=k)
+        return np.atleast_1d(locsOfMinError)
 
     def calcFracPastBinMin(self, value, binEdges, bin):
         """
@@ -671,15 +1696,44 @@ class ClickHist:
                       (binEdges[bin+1]-binEdges[bin]))
         return binEdges[bin]+valPastBin
 
-    def findPercentile(self, dataArray, point):
+    def convertValueToFrac(self, value, binEdges, binEdgesFrac):
         """
-        Determines the percentile that a particular data value belongs to
-        among the data
+        Converts an actual value with units to a fractional location in a
+        histogram (e.g. from 50 mm/day to 0.5), the reverse of
+        convertFracToValue. Values outside the histogram are moved to its
+        nearest edge.
+        :param value: the value to convert
+        :param binEdges: the bin edge values (with units) along the axis
+        :param binEdgesFrac: the fractional bin edge values
+        :return: the fractional location along the axis
+        """
+        value = min(max(value, binEdges[0]), binEdges[-1])
+        bin = min(np.searchsorted(binEdges, value, side='right')-1,
+                  len(binEdges)-2)
+        return (binEdgesFrac[bin] +
+                self.calcFracPastBinMin(value, binEdges, bin) *
+                (binEdgesFrac[bin+1]-binEdgesFrac[bin]))
+
+    def makePercentileEngine(self, dataArray, mask, binEdges):
+        """
+        Creates the object used to look up percentiles along one axis, based
+        on the percentileEngine option ('scan', 'sorted', or 'sketch')
         :param dataArray: An array with all data points, even those not plotted
-        :param point: The value of a particular point
-        :return: The percentile (0.0-99.9) of point relative to dataArray
+        :param mask: An array that is True where dataArray is masked, or None
+        :param binEdges: the bin edges along the axis (used by 'sketch')
+        :return: An object with percentile() and percentiles() methods
         """
-        return stats.percentileofscore(dataArray, point)
+        if self.percentileEngine == 'scan':
+            return ScanPercentiles(dataArray, mask)
+        elif self.percentileEngine == 'sorted':
+            return SortedPercentiles(dataArray, mask)
+        elif self.percentileEngine == 'sketch':
+            engine = SketchPercentiles(binEdges)
+            engine.add(dataArray, mask)
+            return engine
+        else:
+            raise ValueError('percentileEngine should be \'scan\', ' +
+                             '\'sorted\', or \'sketch\'')
 
     def setDo(self, doObject):
         """
@@ -689,3 +1743,154 @@ class ClickHist:
         """
         self.doObject = doObject
         return
+
+
+class ScanPercentiles:
+    def __init__(self, dataArray, mask=None):
+        """
+        Determines percentiles by checking every data point on each lookup
+        (the original ClickHist behavior). The unmasked data is copied out
+        once, here, rather than on every lookup.
+        :param dataArray: An array with all data points, even those not plotted
+        :param mask: An array that is True where dataArray is masked, or None
+        :return:
+        """
+        self.dataArray = np.ravel(dataArray)
+        if mask is not None:
+            self.dataArray = self.dataArray[~np.ravel(mask)]
+
+    def percentile(self, point):
+        """
+        Determines the percentile that a particular data value belongs to
+        among the data
+        :param point: The value of a particular point
+        :return: The percentile (0.0-100.0) of point relative to the data
+        """
+        return stats.percentileofscore(self.dataArray, point)
+
+    def percentiles(self, points):
+        """
+        Same as percentile, but for an array of values
+        :param points: The values of any number of points
+        :return: An array with the percentile of each point
+        """
+        return np.array([self.percentile(point)
+                         for point in np.ravel(points)])
+
+
+class SortedPercentiles:
+    def __init__(self, dataArray, mask=None):
+        """
+        Determines percentiles with a binary search over a sorted copy of the
+        data, which is only made once. Results are the same as
+        scipy.stats.percentileofscore (with its default kind='rank').
+        :param dataArray: An array with all data points, even those not plotted
+        :param mask: An array that is True where dataArray is masked, or None
+        :return:
+        """
+        if mask is not None:
+            dataArray = np.ravel(dataArray)[~np.ravel(mask)]
+        self.sortedData = np.sort(dataArray, axis=None)
+
+    def percentile(self, point):
+        """
+        Determines the percentile that a particular data value belongs to
+        among the data
+        :param point: The value of a particular point
+        :return: The percentile (0.0-100.0) of point relative to the data
+        """
+        return float(self.percentiles(point))
+
+    def percentiles(self, points):
+        """
+        Same as percentile, but for an array of values
+        :param points: The values of any number of points
+        :return: An array (or scalar, for a scalar input) with the percentile
+        of each point
+        """
+        # Count the values strictly below and at or below each point, then
+        # average the two (adding one if the point is in the data) the same
+        # way as percentileofscore's 'rank'
+        below = np.searchsorted(self.sortedData, points, side='left')
+        belowOrEqual = np.searchsorted(self.sortedData, points, side='right')
+        return ((below+belowOrEqual+(belowOrEqual > below)) *
+                (50.0/self.sortedData.size))
+
+
+class SketchPercentiles:
+    def __init__(self, binEdges, subdivisions=1000):
+        """
+        Determines percentiles approximately from a fine-grained histogram
+        of the data, which can be built up one chunk at a time and merged
+        with others, so the data never needs to be in memory all at once.
+        Each histogram bin is split into subdivisions equal parts, and values
+        are assumed to be spread evenly within each part. Values outside of
+        the bin edges are only counted.
+        :param binEdges: the bin edges of the ClickHist axis
+        :param subdivisions: the number of parts to split each bin into
+        :return:
+        """
+        binNum = len(binEdges)-1
+        self.edges = np.interp(np.arange(binNum*subdivisions+1.) /
+                               subdivisions, np.arange(binNum+1.), binEdges)
+        self.counts = np.zeros(len(self.edges)-1, dtype=np.int64)
+        self.countBelow = 0
+        self.countAbove = 0
+        self.size = 0
+
+    def add(self, dataArray, mask=None):
+        """
+        Adds data to the sketch
+        :param dataArray: An array with any number of data points
+        :param mask: An array that is True where dataArray is masked, or None
+        :return:
+        """
+        dataArray = np.ravel(dataArray)
+        if mask is not None:
+            dataArray = dataArray[~np.ravel(mask)]
+        self.counts += np.histogram(dataArray, self.edges)[0]
+        self.countBelow += np.count_nonzero(dataArray < self.edges[0])
+        self.countAbove += np.count_nonzero(dataArray > self.edges[-1])
+        # NaNs are in none of the counts, so they aren't in the size either
+        self.size += np.count_nonzero(~np.isnan(dataArray))
+        return
+
+    def merge(self, other):
+        """
+        Adds the data of another sketch with the same bin edges to this one
+        :param other: another SketchPercentiles
+        :return:
+        """
+        self.counts += other.counts
+        self.countBelow += other.countBelow
+        self.countAbove += other.countAbove
+        self.size += other.size
+        return
+
+    def percentile(self, point):
+        """
+        Determines the (approximate) percentile that a particular data value
+        belongs to among the data
+        :param point: The value of a particular point
+        :return: The percentile (0.0-100.0) of point relative to the data
+        """
+        return float(self.percentiles(point))
+
+    def percentiles(self, points):
+        """
+        Same as percentile, but for an array of values
+        :param points: The values of any number of points
+        :return: An array (or scalar, for a scalar input) with the percentile
+        of each point
+        """
+        # Count everything in the parts below each point, plus the fraction
+        # of the part that the point lies in
+        cumCounts = np.concatenate(([0], np.cumsum(self.counts)))
+        countBelowPoints = np.interp(points, self.edges, cumCounts)
+        countBelowPoints = np.where(np.asarray(points) > self.edges[-1],
+                                    (self.countBelow+cumCounts[-1] +
+                                     self.countAbove),
+                                    countBelowPoints+self.countBelow)
+        countBelowPoints = np.where(np.asarray(points) < self.edges[0],
+                                    0, countBelowPoints)
+        return countBelowPoints*(100.0/self.size)
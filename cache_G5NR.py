@@ -0,0 +1,232 @@
+# cache_G5NR keeps results that are slow to compute (or download) in files on
+# disk so that later sessions can reuse them, and has the file helpers that go
+# with that (writing files atomically and evicting old files once a folder
+# gets too big)
+
+# List of imports
+# hashlib is used to build cache keys.
+# np is used to save and load arrays.
+# tempfile is used to write files atomically.
+import hashlib
+import numpy as np
+import os
+import tempfile
+
+# Bump this whenever the contents of the ClickHist cache files change
+clickHistCacheVersion = 2
+
+
+def atomicWrite(path, data):
+    """
+    Writes a file so that no one ever sees it partially written: the data is
+    first written to a temporary file in the same folder, which is then
+    renamed to path (replacing any existing file)
+    :param path: the file to write
+    :param data: the contents of the file (text is written as UTF-8), or a
+    function that takes an open (binary) file and writes to it
+    :return:
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    fileHandle, tempPath = tempfile.mkstemp(dir=folder, prefix='.tmp_')
+    try:
+        with os.fdopen(fileHandle, 'wb') as outFile:
+            if callable(data):
+                data(outFile)
+            else:
+                if not isinstance(data, bytes):
+                    data = data.encode('utf-8')
+                outFile.write(data)
+        os.chmod(tempPath, 0o644)
+        os.rename(tempPath, path)
+    except:
+        os.remove(tempPath)
+        raise
+    return
+
+
+def evictLRU(folder, maxBytes, keep=None):
+    """
+    Deletes the least recently used files in a folder (by modification time,
+    so readers should touch() files they use) until the folder holds at most
+    maxBytes
+    :param folder: the folder to clean up
+    :param maxBytes: the most bytes the files in the folder may use
+    :param keep: a file that is never deleted (e.g. the one just saved, so
+    that a file bigger than maxBytes is still kept until the next save)
+    :return: the number of files deleted
+    """
+    files = []
+    totalBytes = 0
+    for filename in os.listdir(folder):
+        path = os.path.join(folder, filename)
+        if filename.startswith('.tmp_') or not os.path.isfile(path):
+            continue
+        fileStat = os.stat(path)
+        totalBytes += fileStat.st_size
+        # The kept file still counts toward maxBytes
+        if keep is None or os.path.abspath(path) != os.path.abspath(keep):
+            files.append((fileStat.st_mtime, fileStat.st_size, path))
+
+    deleted = 0
+    for mtime, fileSize, path in sorted(files):
+        if totalBytes <= maxBytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            # Someone else got to it first
+            pass
+        totalBytes -= fileSize
+        deleted += 1
+    return deleted
+
+
+def touch(path):
+    """
+    Marks a file as just used (see evictLRU)
+    :param path: the file to mark
+    :return:
+    """
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+    return
+
+
+def makeKey(*parts):
+    """
+    Builds a cache key from any number of arrays, strings, and numbers
+    :param parts: the values that the cached result depends on
+    :return: a hex string that changes whenever any of the parts change
+    """
+    keyHash = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            keyHash.update(str(part.dtype).encode('utf-8'))
+            keyHash.update(str(part.shape).encode('utf-8'))
+            keyHash.update(np.ascontiguousarray(part).tobytes())
+        else:
+            keyHash.update(repr(part).encode('utf-8'))
+        keyHash.update(b'|')
+    return keyHash.hexdigest()
+
+
+class ClickHistCache:
+    def __init__(self, cacheDir, maxBytes=2**30):
+        """
+        Stores the precomputed parts of ClickHists (the histogram, the
+        fractional positions and bins of the scatter points, their positions
+        in the data, and the sampling seed) as one .npz file per key
+        :param cacheDir: the folder to keep the cache files in
+        :param maxBytes: the most bytes the cache may use before the least
+        recently used files are deleted
+        :return:
+        """
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+
+        if not os.path.exists(self.cacheDir):
+            os.makedirs(self.cacheDir)
+
+    def pathFor(self, key):
+        """
+        :param key: a cache key (see makeKey)
+        :return: the path of the cache file for key
+        """
+        return os.path.join(self.cacheDir, 'ClickHist_'+key+'.npz')
+
+    def load(self, key):
+        """
+        Loads a cache entry
+        :param key: a cache key (see makeKey)
+        :return: a dict of the arrays saved for key, or None if there are
+        none (or the file can't be read)
+        """
+        path = self.pathFor(key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with np.load(path) as cacheFile:
+                if int(cacheFile['version']) != clickHistCacheVersion:
+                    return None
+                arrays = dict((name, cacheFile[name])
+                              for name in cacheFile.files)
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        touch(path)
+        return arrays
+
+    def save(self, key, **arrays):
+        """
+        Saves a cache entry (atomically, so that a session reading the cache
+        at the same time never sees a partial file) and then evicts old
+        entries if the cache is too big
+        :param key: a cache key (see makeKey)
+        :param arrays: the arrays to save
+        :return:
+        """
+        arrays['version'] = clickHistCacheVersion
+        path = self.pathFor(key)
+        atomicWrite(path, lambda outFile: np.savez(outFile, **arrays))
+        evictLRU(self.cacheDir, self.maxBytes, keep=path)
+        return
+
+
+class ImageCache:
+    def __init__(self, cacheDir, maxBytes=2**30):
+        """
+        Stores downloaded G5NR quicklook images as one file per image
+        variable and time, so that cases close in time (in this session or
+        any other using the same folder) don't download them again
+        :param cacheDir: the folder to keep the images in
+        :param maxBytes: the most bytes the cache may use before the least
+        recently used images are deleted
+        :return:
+        """
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+
+        if not os.path.exists(self.cacheDir):
+            os.makedirs(self.cacheDir)
+
+    def pathFor(self, imageVar, imageDatetime):
+        """
+        :param imageVar: the name of the image variable (e.g. 'storms')
+        :param imageDatetime: a datetime with the time of the image
+        :return: the path of the cache file for the image
+        """
+        return os.path.join(self.cacheDir,
+                            imageVar+'_' +
+                            imageDatetime.strftime('%Y%m%d_%H%M')+'.png')
+
+    def load(self, imageVar, imageDatetime):
+        """
+        Loads a cached image
+        :param imageVar: the name of the image variable
+        :param imageDatetime: a datetime with the time of the image
+        :return: the contents of the image file, or None if it isn't cached
+        """
+        path = self.pathFor(imageVar, imageDatetime)
+        try:
+            with open(path, 'rb') as imageFile:
+                content = imageFile.read()
+        except (IOError, OSError):
+            return None
+        touch(path)
+        return content
+
+    def save(self, imageVar, imageDatetime, content):
+        """
+        Saves an image (atomically, so that a session reading the cache at
+        the same time never sees a partial file) and then evicts old images
+        if the cache is too big
+        :param imageVar: the name of the image variable
+        :param imageDatetime: a datetime with the time of the image
+        :param content: the contents of the image file
+        :return:
+        """
+        path = self.pathFor(imageVar, imageDatetime)
+        atomicWrite(path, content)
+        evictLRU(self.cacheDir, self.maxBytes, keep=path)
+        return
@@ -0,0 +1,132 @@
+# caseNotebook_G5NR builds the Case Notebooks (.ipynb files) written by
+# ClickHistDo for each case, working on the notebook as parsed JSON (cells
+# and their source lines) rather than as lines of text
+
+# List of imports
+# atomicWrite is used so that a notebook is never seen half written.
+# copy is used to start each notebook from a fresh copy of the template.
+# json is used to read the template and write the notebooks.
+# os is used to check whether the template has changed.
+from cache_G5NR import atomicWrite
+import copy
+import json
+import os
+
+
+def markdownCell(sourceLines):
+    """
+    :param sourceLines: the lines of the cell (joined as is, so include any
+    line breaks)
+    :return: a new markdown cell
+    """
+    return {'cell_type': 'markdown',
+            'metadata': {},
+            'source': list(sourceLines)}
+
+
+def codeCell(sourceLines):
+    """
+    :param sourceLines: the lines of the cell (joined as is, so include any
+    line breaks)
+    :return: a new (not yet run) code cell
+    """
+    return {'cell_type': 'code',
+            'execution_count': None,
+            'metadata': {},
+            'outputs': [],
+            'source': list(sourceLines)}
+
+
+def findCell(notebook, text):
+    """
+    :param notebook: a notebook
+    :param text: text to look for
+    :return: the position of the last cell with text in its source, or -1
+    if there is none
+    """
+    cellIndex = -1
+    for cc in range(0, len(notebook['cells'])):
+        if text in ''.join(notebook['cells'][cc]['source']):
+            cellIndex = cc
+    return cellIndex
+
+
+class CaseNotebookBuilder:
+    def __init__(self, templatePath):
+        """
+        Builds Case Notebooks from a template notebook, which is parsed
+        once and kept in memory (it is parsed again only if the file
+        changes on disk). The template needs a cell containing
+        'Quick Stats' and a code cell containing 'loadBundle()'.
+        :param templatePath: the template notebook
+        :return:
+        """
+        self.templatePath = templatePath
+        self.templateStat = None
+        self.template = None
+        self.loadTemplate()
+
+    def loadTemplate(self):
+        """
+        Parses the template, unless the parsed copy is still current
+        :return: the parsed template
+        """
+        fileStat = os.stat(self.templatePath)
+        templateStat = (fileStat.st_mtime, fileStat.st_size)
+        if self.template is None or templateStat != self.templateStat:
+            with open(self.templatePath, 'rb') as templateFile:
+                template = json.loads(templateFile.read().decode('utf-8'))
+            if findCell(template, 'Quick Stats') < 0:
+                raise ValueError(self.templatePath+' has no Quick Stats cell')
+            if findCell(template, 'loadBundle()') < 0:
+                raise ValueError(self.templatePath+' has no loadBundle() ' +
+                                 'cell')
+            self.template = template
+            self.templateStat = templateStat
+        return self.template
+
+    def build(self, date, stats, topCells, bundlePaths):
+        """
+        Builds the notebook for one case
+        :param date: the creation date to show
+        :param stats: lines describing the case (time, location, values,
+        percentiles), shown under Quick Stats
+        :param topCells: cells to put right after the Quick Stats cell (e.g.
+        the quicklook images)
+        :param bundlePaths: the paths of the case's bundles (relative to the
+        notebook), each added as a (commented out) loadBundle call
+        :return: the notebook
+        """
+        notebook = copy.deepcopy(self.loadTemplate())
+
+        # Creation date
+        for cell in notebook['cells']:
+            cell['source'] = [sourceLine.replace('INSERT_DATE', date)
+                              for sourceLine in cell['source']]
+
+        # Add case metadata to the Quick Stats cell, then the new cells
+        # right after it
+        statsIndex = findCell(notebook, 'Quick Stats')
+        notebook['cells'][statsIndex]['source'].extend(
+            [stat+'<br>' for stat in stats])
+        notebook['cells'][statsIndex+1:statsIndex+1] = topCells
+
+        # Add the load calls for all generated bundles
+        loadCell = notebook['cells'][findCell(notebook, 'loadBundle()')]
+        loadIndex = [ll for ll in range(0, len(loadCell['source']))
+                     if 'loadBundle()' in loadCell['source'][ll]][-1]
+        loadCell['source'][loadIndex:loadIndex+1] = [
+            '#loadBundle(\''+bundlePath+'\')\n' for bundlePath in bundlePaths]
+
+        return notebook
+
+    def write(self, notebook, path):
+        """
+        Writes a notebook (atomically, so a partial notebook is never seen)
+        :param notebook: the notebook
+        :param path: the file to write
+        :return:
+        """
+        atomicWrite(path, json.dumps(notebook, indent=1, sort_keys=True,
+                                     ensure_ascii=False)+'\n')
+        return
@@ -0,0 +1,281 @@
+# catalog_G5NR keeps a catalog of the cases saved by ClickHistDo in a single
+# SQLite file, so that checking whether a case was already saved and finding
+# cases by time and location don't need to look through the Output folders
+
+# List of imports
+# calendar is used to convert datetimes to Unix/Epoch times.
+# datetime is used to read the times in filenames.
+# os is used to find the files of cases saved before the catalog existed.
+# re is used to read the case information out of those filenames.
+# sqlite3 is used to store the catalog.
+# threading is used so that several threads can share one catalog.
+import calendar
+import datetime
+import os
+import re
+import sqlite3
+import threading
+
+# The information in a commonFilename (see ClickHistDo.do), e.g.
+# Precip_quantile_99.500_SKEDot_quantile_12.250_lat_10_lon_330_time_
+# 20050601_0630, at the start of a filename (after the prefix of the ISL
+# scripts, if any)
+commonFilenamePattern = re.compile(
+    r'(?:zidv_Maker_)?(?P<commonFilename>'
+    r'(?P<xVarName>.+?)_quantile_(?P<xPer>[0-9.]+)_'
+    r'(?P<yVarName>.+?)_quantile_(?P<yPer>[0-9.]+)_'
+    r'lat_(?P<lat>-?[0-9]+)_lon_(?P<lon>-?[0-9]+)_'
+    r'time_(?P<time>[0-9]{8}_[0-9]{4}))')
+
+# The information kept for each case (besides its commonFilename)
+caseFields = ['flatIndex', 'lat', 'lon', 'time', 'xVarName', 'yVarName',
+              'xValue', 'yValue', 'xPer', 'yPer', 'metadata']
+
+# The kind of file kept in each Output folder
+artifactKinds = {'CaseNotebooks': 'notebook',
+                 'GeneratedBundles': 'bundle',
+                 'GeneratedBundlesZ': 'zbundle',
+                 'Scripts': 'script',
+                 'Images': 'image'}
+
+
+def toUnixTime(value):
+    """
+    :param value: a datetime (UTC) or a Unix/Epoch time in seconds
+    :return: the Unix/Epoch time in seconds
+    """
+    if isinstance(value, datetime.datetime):
+        return int(calendar.timegm(value.timetuple()))
+    return int(value)
+
+
+def createTables(connection):
+    """
+    Migration 1: creates the case and artifact tables and their indexes
+    :param connection: an open connection to the catalog
+    :return:
+    """
+    connection.execute('CREATE TABLE cases ('
+                       'id INTEGER PRIMARY KEY, '
+                       'commonFilename TEXT UNIQUE NOT NULL, '
+                       'flatIndex INTEGER, '
+                       'lat REAL, lon REAL, time INTEGER, '
+                       'xVarName TEXT, yVarName TEXT, '
+                       'xValue REAL, yValue REAL, '
+                       'xPer REAL, yPer REAL, '
+                       'metadata TEXT, created TEXT)')
+    connection.execute('CREATE TABLE artifacts ('
+                       'caseId INTEGER NOT NULL REFERENCES cases(id), '
+                       'kind TEXT NOT NULL, '
+                       'path TEXT NOT NULL, '
+                       'UNIQUE (caseId, path))')
+    connection.execute('CREATE INDEX casesByTime ON cases (time)')
+    connection.execute('CREATE INDEX casesByLocation ON cases (lat, lon)')
+    connection.execute('CREATE INDEX artifactsByCase ON artifacts (caseId)')
+    return
+
+
+# Every change to the tables is added here as a new function (never change
+# an old one), and the catalog's user_version is the number that have been
+# applied
+migrations = [createTables]
+
+
+class CaseCatalog:
+    def __init__(self, path, outputDir=None):
+        """
+        Opens (or creates) a catalog, bringing its tables up to date
+        :param path: the catalog file
+        :param outputDir: an Output folder to import when the catalog is
+        first created, so that cases saved before the catalog existed are in
+        it too (optional)
+        :return:
+        """
+        self.path = path
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+
+        isNew = self.migrate() == 0
+        if isNew and outputDir is not None and os.path.isdir(outputDir):
+            self.importOutput(outputDir)
+
+    def migrate(self):
+        """
+        Applies any migrations that haven't been applied to the catalog yet
+        :return: the version of the catalog before migrating (0 for a new
+        catalog)
+        """
+        with self.lock:
+            version = self.connection.execute(
+                'PRAGMA user_version').fetchone()[0]
+            for vv in range(version, len(migrations)):
+                with self.connection:
+                    migrations[vv](self.connection)
+                    self.connection.execute('PRAGMA user_version = ' +
+                                            str(vv+1))
+        return version
+
+    def hasCase(self, commonFilename):
+        """
+        :param commonFilename: the commonFilename of a case
+        :return: True if the case is in the catalog with its notebook (the
+        notebook is written last, so a case without one was not finished)
+        """
+        with self.lock:
+            return self.connection.execute(
+                'SELECT 1 FROM cases JOIN artifacts '
+                'ON artifacts.caseId = cases.id '
+                'WHERE commonFilename = ? AND kind = \'notebook\'',
+                (commonFilename,)).fetchone() is not None
+
+    def addCase(self, commonFilename, artifacts=(), **fields):
+        """
+        Adds a case (or updates it, if it is already in the catalog) along
+        with the files made for it
+        :param commonFilename: the commonFilename of the case
+        :param artifacts: (kind, path) pairs for the files made for the case
+        (e.g. ('bundle', './Session/Output/GeneratedBundles/...xidv'))
+        :param fields: any of flatIndex, lat, lon, time (a datetime or Unix
+        time), xVarName, yVarName, xValue, yValue, xPer, yPer, metadata
+        :return: the id of the case
+        """
+        for name in fields:
+            if name not in caseFields:
+                raise TypeError('Unknown case field \''+name+'\'')
+        if fields.get('time') is not None:
+            fields['time'] = toUnixTime(fields['time'])
+        if 'flatIndex' in fields and fields['flatIndex'] is not None:
+            fields['flatIndex'] = int(fields['flatIndex'])
+        for name in ['lat', 'lon', 'xValue', 'yValue', 'xPer', 'yPer']:
+            if fields.get(name) is not None:
+                fields[name] = float(fields[name])
+        names = sorted(fields.keys())
+        created = str(datetime.datetime.now().replace(microsecond=0))
+
+        with self.lock:
+            with self.connection:
+                row = self.connection.execute(
+                    'SELECT id FROM cases WHERE commonFilename = ?',
+                    (commonFilename,)).fetchone()
+                if row is None:
+                    caseId = self.connection.execute(
+                        'INSERT INTO cases (commonFilename, created' +
+                        ''.join([', '+name for name in names]) +
+                        ') VALUES (?, ?'+', ?'*len(names)+')',
+                        [commonFilename, created] +
+                        [fields[name] for name in names]).lastrowid
+                else:
+                    caseId = row['id']
+                    if len(names) > 0:
+                        self.connection.execute(
+                            'UPDATE cases SET ' +
+                            ', '.join([name+' = ?' for name in names]) +
+                            ' WHERE id = ?',
+                            [fields[name] for name in names]+[caseId])
+                self.connection.executemany(
+                    'INSERT OR IGNORE INTO artifacts (caseId, kind, path) '
+                    'VALUES (?, ?, ?)',
+                    [(caseId, kind, path) for kind, path in artifacts])
+        return caseId
+
+    def findCases(self, latRange=None, lonRange=None, timeRange=None):
+        """
+        Finds the cases in an area and/or time span
+        :param latRange: (southernmost, northernmost) latitude, or None for
+        any latitude
+        :param lonRange: (westernmost, easternmost) longitude, or None for
+        any longitude (a range with westernmost > easternmost crosses the
+        dateline, e.g. (330, 30))
+        :param timeRange: (first, last) time, as datetimes or Unix times, or
+        None for any time
+        :return: a list of the matching cases (sqlite3.Row, usable like
+        dicts), by time
+        """
+        conditions = []
+        values = []
+        if latRange is not None:
+            conditions.append('lat BETWEEN ? AND ?')
+            values.extend(latRange)
+        if lonRange is not None:
+            if lonRange[0] <= lonRange[1]:
+                conditions.append('lon BETWEEN ? AND ?')
+            else:
+                conditions.append('(lon >= ? OR lon <= ?)')
+            values.extend(lonRange)
+        if timeRange is not None:
+            conditions.append('time BETWEEN ? AND ?')
+            values.extend([toUnixTime(timeRange[0]),
+                           toUnixTime(timeRange[1])])
+
+        query = 'SELECT * FROM cases'
+        if len(conditions) > 0:
+            query += ' WHERE '+' AND '.join(conditions)
+        with self.lock:
+            return self.connection.execute(query+' ORDER BY time',
+                                           values).fetchall()
+
+    def artifactsFor(self, commonFilename):
+        """
+        :param commonFilename: the commonFilename of a case
+        :return: a list of (kind, path) pairs for the files made for the
+        case
+        """
+        with self.lock:
+            return [(row['kind'], row['path']) for row in
+                    self.connection.execute(
+                        'SELECT kind, path FROM artifacts JOIN cases '
+                        'ON artifacts.caseId = cases.id '
+                        'WHERE commonFilename = ? ORDER BY kind, path',
+                        (commonFilename,))]
+
+    def importOutput(self, outputDir):
+        """
+        Adds the cases found in an Output folder (by reading the time,
+        location, and percentiles out of the filenames) to the catalog.
+        Only cases with a notebook are added, since a case whose notebook
+        was never written (e.g. one that failed after its bundles were
+        saved) still needs to be done.
+        :param outputDir: the Output folder of a session
+        :return: the number of cases added
+        """
+        cases = {}
+        for folder in sorted(artifactKinds.keys()):
+            folderPath = os.path.join(outputDir, folder)
+            if not os.path.isdir(folderPath):
+                continue
+            for filename in sorted(os.listdir(folderPath)):
+                match = commonFilenamePattern.match(filename)
+                if match is None:
+                    continue
+                case = cases.setdefault(match.group('commonFilename'),
+                                        {'match': match, 'artifacts': []})
+                case['artifacts'].append((artifactKinds[folder],
+                                          os.path.join(folderPath,
+                                                       filename)))
+        cases = dict((commonFilename, case)
+                     for commonFilename, case in cases.items()
+                     if 'notebook' in [kind for kind, path
+                                       in case['artifacts']])
+
+        for commonFilename in sorted(cases.keys()):
+            match = cases[commonFilename]['match']
+            self.addCase(commonFilename, cases[commonFilename]['artifacts'],
+                         lat=float(match.group('lat')),
+                         lon=float(match.group('lon')),
+                         time=datetime.datetime.strptime(match.group('time'),
+                                                         '%Y%m%d_%H%M'),
+                         xVarName=match.group('xVarName'),
+                         yVarName=match.group('yVarName'),
+                         xPer=float(match.group('xPer')),
+                         yPer=float(match.group('yPer')))
+        return len(cases)
+
+    def close(self):
+        """
+        Closes the catalog
+        :return:
+        """
+        with self.lock:
+            self.connection.close()
+        return
@@ -0,0 +1,223 @@
+# dataset_G5NR loads several G5NR variables over the same area and times
+# once, into read-only arrays that share one flat index, so that a ClickHist
+# can be made for any pair of them without reading or copying the data again
+# (and the 2D histograms of every pair can be counted in a single pass).
+
+# List of imports
+# ClickHist is made for each pair of variables, and findBins places values
+# in bins the same way ClickHist does.
+# ClickHistDo is made with the coordinates of the dataset.
+# housekeeping_G5NR has the bins, units, and formats of each variable, and
+# selects the coordinates of the area.
+# saveArray is used to keep shared copies of the variables, and toRanges
+# reads area selections.
+# np is used to count the histograms.
+# os is used to find shared copies of the variables.
+from ClickHist_G5NR import ClickHist, findBins
+from ClickHistDo_G5NR import ClickHistDo
+import housekeeping_G5NR
+from loader_G5NR import saveArray, toRanges
+import numpy as np
+import os
+
+
+class G5NRDataset:
+    def __init__(self, loader, varNames, timeRange, latRange, lonRange,
+                 **kwargs):
+        """
+        Loads each variable once, over the same area and times
+        :param loader: a G5NRLoader
+        :param varNames: the variables to load (names from housekeeping_G5NR,
+        e.g. ['Precip', 'W500', 'SKEDot'])
+        :param timeRange: (first, last+1) time index
+        :param latRange: (first, last+1) latitude index, or slices from
+        housekeeping_G5NR.getSlices
+        :param lonRange: (first, last+1) longitude index, or slices from
+        housekeeping_G5NR.getSlices
+        :param kwargs: binEdges - a dict of bin edges to use instead of those
+        in housekeeping_G5NR for some variables, shared - True to keep each
+        variable in a single memory-mapped file in the loader's store (so
+        that every process or session that loads the same dataset uses the
+        same memory), blockSize - the number of values counted at a time by
+        allPairHists
+        :return:
+        """
+        self.loader = loader
+        self.varNames = list(varNames)
+        self.timeRange = timeRange
+        self.latRange = latRange
+        self.lonRange = lonRange
+
+        # kwargs may replace these (binEdges, shared, blockSize)
+        self.binEdges = dict((varName,
+                              housekeeping_G5NR.binOptions[varName])
+                             for varName in self.varNames
+                             if varName in housekeeping_G5NR.binOptions)
+        self.shared = False
+        self.blockSize = 2**20
+        if 'binEdges' in kwargs:
+            self.binEdges.update(kwargs['binEdges'])
+        if 'shared' in kwargs:
+            self.shared = kwargs['shared']
+        if 'blockSize' in kwargs:
+            self.blockSize = kwargs['blockSize']
+        if self.shared and self.loader.storeDir is None:
+            raise ValueError('shared needs a loader with a storeDir')
+
+        # The coordinates of the area (in the order of the data)
+        lons, lats, self.times = self.loader.coordinates(self.timeRange)
+        self.lons = housekeeping_G5NR.takeSlices(
+            lons, [slice(start, end)
+                   for start, end in toRanges(self.lonRange)])
+        self.lats = housekeeping_G5NR.takeSlices(
+            lats, [slice(start, end)
+                   for start, end in toRanges(self.latRange)])
+
+        # Each variable, as a read-only (time, lat, lon) array
+        self.data = {}
+        for varName in self.varNames:
+            self.data[varName] = self.loadVariable(varName)
+        self.shape = self.data[self.varNames[0]].shape
+        for varName in self.varNames:
+            if self.data[varName].shape != self.shape:
+                raise ValueError(varName+' has a different shape')
+
+        # Histograms counted by allPairHists, by (xName, yName)
+        self.hists = {}
+
+    def loadVariable(self, varName):
+        """
+        Loads a variable (or, with shared, opens the copy of it in the
+        store) and makes it read only
+        :param varName: the name of the variable
+        :return: the variable, as a (time, lat, lon) array (masked if any
+        values are missing)
+        """
+        folder = None
+        if self.shared:
+            folder = self.loader.storeFolder(
+                {'kind': 'dataset', 'variable': varName,
+                 'time': toRanges(self.timeRange),
+                 'lat': toRanges(self.latRange),
+                 'lon': toRanges(self.lonRange)})
+            path = os.path.join(folder, 'data.npy')
+            maskPath = os.path.join(folder, 'mask.npy')
+            if os.path.isfile(path):
+                data = np.load(path, mmap_mode='r')
+                if os.path.isfile(maskPath):
+                    return np.ma.MaskedArray(data,
+                                             np.load(maskPath, mmap_mode='r'))
+                return data
+
+        values = self.loader.load(varName, self.timeRange, self.latRange,
+                                  self.lonRange)
+        data = np.ascontiguousarray(np.ma.getdata(values))
+        mask = None
+        if np.ma.is_masked(values):
+            mask = np.ascontiguousarray(np.ma.getmaskarray(values))
+
+        if folder is not None:
+            saveArray(path, data)
+            if mask is not None:
+                saveArray(maskPath, mask)
+            return self.loadVariable(varName)
+
+        data.flags.writeable = False
+        if mask is None:
+            return data
+        mask.flags.writeable = False
+        return np.ma.MaskedArray(data, mask)
+
+    def clickHist(self, xName, yName, **kwargs):
+        """
+        Makes a ClickHist of two of the variables, using the arrays of the
+        dataset as they are (no copies), the bins, units, and formats from
+        housekeeping_G5NR, and the histogram from allPairHists if it was
+        counted
+        :param xName: the x variable
+        :param yName: the y variable
+        :param kwargs: any ClickHist options (these replace the defaults
+        from the dataset)
+        :return: the ClickHist
+        """
+        options = {'xVarName': xName, 'yVarName': yName}
+        for name, option, table in [
+                (xName, 'xUnits', housekeeping_G5NR.varUnitOptions),
+                (yName, 'yUnits', housekeeping_G5NR.varUnitOptions),
+                (xName, 'xFmtStr', housekeeping_G5NR.fmtStrOptions),
+                (yName, 'yFmtStr', housekeeping_G5NR.fmtStrOptions)]:
+            if name in table:
+                options[option] = table[name]
+        if (xName, yName) in self.hists:
+            options['hist'] = self.hists[(xName, yName)]
+        options.update(kwargs)
+        return ClickHist(self.binEdges[xName], self.binEdges[yName],
+                         self.data[xName], self.data[yName], **options)
+
+    def clickHistDo(self, xName, yName, bundles, bundleTags, sessionName,
+                    **kwargs):
+        """
+        Makes a ClickHistDo for the ClickHist of a pair of the variables,
+        over the area and times of the dataset (the variable names are part
+        of the name of each case, so each pair needs its own ClickHistDo)
+        :param xName: the x variable
+        :param yName: the y variable
+        :param bundles: the name(s) of the template bundle(s)
+        :param bundleTags: the tag of each bundle
+        :param sessionName: the name of the session
+        :param kwargs: any ClickHistDo options (except xVarName and
+        yVarName, which are xName and yName)
+        :return: the ClickHistDo
+        """
+        options = dict(kwargs, xVarName=xName, yVarName=yName)
+        return ClickHistDo(self.lons, self.lats, self.times,
+                           housekeeping_G5NR.startDatetime, bundles,
+                           bundleTags, sessionName, **options)
+
+    def allPairHists(self):
+        """
+        Counts the 2D histogram of every pair of variables in one pass over
+        the data: the bins of each variable are found once per block, then
+        combined for each pair
+        :return: a dict from (xName, yName) to the histogram (x bins by y
+        bins), for every ordered pair of different variables
+        """
+        names = [varName for varName in self.varNames
+                 if varName in self.binEdges]
+        binNums = dict((varName, len(self.binEdges[varName])-1)
+                       for varName in names)
+        hists = {}
+        for ii in range(0, len(names)):
+            for jj in range(ii+1, len(names)):
+                hists[(names[ii], names[jj])] = np.zeros(
+                    binNums[names[ii]]*binNums[names[jj]])
+
+        size = int(np.prod(self.shape))
+        flat = {}
+        for varName in names:
+            data = self.data[varName]
+            mask = None
+            if np.ma.isMaskedArray(data):
+                mask = np.ma.getmaskarray(data).reshape(-1)
+            flat[varName] = (np.ma.getdata(data).reshape(-1), mask)
+
+        for start in range(0, size, self.blockSize):
+            end = min(start+self.blockSize, size)
+            bins = {}
+            for varName in names:
+                bins[varName] = findBins(flat[varName][0][start:end],
+                                         self.binEdges[varName])
+                if flat[varName][1] is not None:
+                    bins[varName][flat[varName][1][start:end]] = -1
+            for xName, yName in hists:
+                inHist = (bins[xName] >= 0) & (bins[yName] >= 0)
+                hists[(xName, yName)] += np.bincount(
+                    bins[xName][inHist]*binNums[yName]+bins[yName][inHist],
+                    minlength=binNums[xName]*binNums[yName])
+
+        for xName, yName in list(hists.keys()):
+            hist = hists[(xName, yName)].reshape(binNums[xName],
+                                                 binNums[yName])
+            self.hists[(xName, yName)] = hist
+            self.hists[(yName, xName)] = hist.T
+        return self.hists
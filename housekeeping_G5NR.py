@@ -92,7 +92,92 @@ class flushfile():
 
 
 def getIntEdges(dim, low, high):
-    lowInt = np.argmin(abs(dim-low))
-    highInt = np.argmin(abs(dim-high))
-    return lowInt, highInt
-
+    """
+    Finds the grid points nearest to low and high (by binary search, so dim
+    must be monotonic)
+    :param dim: a coordinate array (e.g. longitudes)
+    :param low: the low end of the range
+    :param high: the high end of the range
+    :return: the index of the points nearest to low and high
+    """
+    return nearestIndex(dim, low), nearestIndex(dim, high)
+
+
+def nearestIndex(dim, value):
+    """
+    :param dim: a monotonic (ascending or descending) coordinate array
+    :param value: a coordinate value
+    :return: the index of the point in dim nearest to value
+    """
+    dim = np.asarray(dim)
+    descending = len(dim) > 1 and dim[0] > dim[-1]
+    if descending:
+        position = len(dim)-np.searchsorted(dim[::-1], value)
+    else:
+        position = np.searchsorted(dim, value)
+    # The nearest point is on one side or the other of where value would go
+    candidates = [index for index in [position-1, position]
+                  if 0 <= index < len(dim)]
+    return min(candidates, key=lambda index: abs(dim[index]-value))
+
+
+def getSlices(dim, low, high, cyclic=False, period=360.):
+    """
+    Finds the grid points from low to high (inclusive), by binary search
+    :param dim: a monotonic (ascending or descending) coordinate array; for
+    a cyclic coordinate, ascending and covering at most one period (starting
+    anywhere, e.g. 0 to 359 or -180 to 179)
+    :param low: the low end of the range (for a cyclic coordinate, the
+    western end, e.g. 300 for 300E to 20E)
+    :param high: the high end of the range (for a cyclic coordinate, the
+    eastern end, which may be past the end of dim, e.g. 20 or 380)
+    :param cyclic: True for a coordinate that wraps around (longitude)
+    :param period: the period of a cyclic coordinate
+    :return: a list of slices of dim that together hold the range, in order
+    - one slice, or two for a range that wraps past the end of dim (the
+    points at the end of dim, then those at the start), or none if no
+    points are in the range
+    """
+    dim = np.asarray(dim)
+    if not cyclic:
+        if len(dim) > 1 and dim[0] > dim[-1]:
+            start = len(dim)-np.searchsorted(dim[::-1], high, side='right')
+            stop = len(dim)-np.searchsorted(dim[::-1], low, side='left')
+        else:
+            start = np.searchsorted(dim, low, side='left')
+            stop = np.searchsorted(dim, high, side='right')
+        if stop <= start:
+            return []
+        return [slice(int(start), int(stop))]
+
+    # Measure everything from the first point of dim, so that dim goes from
+    # 0 up to less than period
+    # A high end west of the low end is on the next time around
+    span = high-low
+    if span < 0:
+        span = span % period
+    if span >= period:
+        return [slice(0, len(dim))]
+    offsets = (dim-dim[0]) % period
+    lowOffset = (low-dim[0]) % period
+    highOffset = lowOffset+span
+    start = np.searchsorted(offsets, lowOffset, side='left')
+    if highOffset < period:
+        stop = np.searchsorted(offsets, highOffset, side='right')
+        if stop <= start:
+            return []
+        return [slice(int(start), int(stop))]
+    wrapStop = np.searchsorted(offsets, highOffset-period, side='right')
+    return [piece for piece in [slice(int(start), len(dim)),
+                                slice(0, int(wrapStop))]
+            if piece.stop > piece.start]
+
+
+def takeSlices(dim, slices):
+    """
+    :param dim: a coordinate array
+    :param slices: slices of it (from getSlices)
+    :return: the points in the slices, in order, as one array
+    """
+    return np.concatenate([np.asarray(dim)[piece] for piece in slices] +
+                          [np.asarray(dim)[0:0]])
@@ -0,0 +1,246 @@
+# idvRender_G5NR turns the ISL scripts written by ClickHistDo into movies,
+# images, and .zidv files by running IDV on them. Several cases can share one
+# ISL script (so IDV only starts once for all of them), and the scripts are
+# run a few at a time by a RenderScheduler, which keeps track of which cases
+# are done and tries failed scripts again.
+
+# List of imports
+# atomicWrite is used so that the status file is never seen half written.
+# json is used to save the status of each script and case.
+# cpu_count is used to pick the default number of workers.
+# ThreadPool is used to run several IDVs at the same time (each worker waits
+# on its own IDV process).
+# os is used to check for the status file and to stop IDV.
+# re is used to find the body of a rendered ISL script.
+# signal is used to stop IDV (and everything runIDV started).
+# subprocess is used to run IDV.
+# sys is used to pick how to start IDV in its own process group.
+# threading is used to stop IDVs that run too long and to share the status.
+# time is used to record when each script finished.
+from cache_G5NR import atomicWrite
+import json
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+# The command that runs IDV on a script ('{script}' is replaced by the
+# script, or the script is added to the end if it isn't there)
+defaultRenderCommand = ['runIDV', '{script}']
+
+# An ISL script: the opening <isl> tag, then everything in it
+islPattern = re.compile(br'^\s*(?P<open><isl[^>]*>)(?P<body>.*)</isl>\s*$',
+                        re.DOTALL)
+
+
+def joinISL(scripts):
+    """
+    Combines ISL scripts into one that does everything each of them does,
+    in order
+    :param scripts: the contents of the ISL scripts (as bytes)
+    :return: the combined script (as bytes), using the <isl> tag of the first
+    script
+    """
+    openTag = None
+    bodies = []
+    for script in scripts:
+        match = islPattern.match(script)
+        if match is None:
+            raise ValueError('Not an ISL script: '+repr(script[:40]))
+        if openTag is None:
+            openTag = match.group('open')
+        bodies.append(match.group('body').strip(b'\r\n'))
+    if openTag is None:
+        raise ValueError('No ISL scripts to join')
+    return openTag+b'\n'+b'\n'.join(bodies)+b'\n</isl>\n'
+
+
+class RenderScheduler:
+    def __init__(self, command=None, workers=None, retries=1, timeout=None,
+                 cwd=None, statusPath=None):
+        """
+        Runs ISL scripts through IDV (or any command), several at a time
+        :param command: the command, as a list (default defaultRenderCommand)
+        - a local stand-in for runIDV can be used here
+        :param workers: how many scripts to run at the same time (default:
+        the number of cores)
+        :param retries: how many more times to run a script that fails
+        :param timeout: seconds to let a script run before stopping it and
+        counting it as failed (default: no limit)
+        :param cwd: the folder to run the command in (the ISL templates use
+        paths relative to the session folder)
+        :param statusPath: a file to keep the status in, so that scripts
+        finished by an earlier run are not run again (optional)
+        :return:
+        """
+        self.command = defaultRenderCommand
+        if command is not None:
+            self.command = list(command)
+        self.workers = workers
+        if self.workers is None:
+            self.workers = cpu_count()
+        self.retries = retries
+        self.timeout = timeout
+        self.cwd = cwd
+        self.statusPath = statusPath
+        self.lock = threading.Lock()
+
+        # Each script's status ('pending', 'running', 'done', or 'failed'),
+        # attempts, return code, the end of its output, when it finished, and
+        # the cases it renders
+        self.jobs = {}
+        if self.statusPath is not None and os.path.isfile(self.statusPath):
+            with open(self.statusPath, 'rb') as statusFile:
+                self.jobs = json.loads(statusFile.read().decode('utf-8'))
+            # Anything that was running when the last run stopped starts over
+            for job in self.jobs.values():
+                if job['status'] == 'running':
+                    job['status'] = 'pending'
+
+    def add(self, script, cases=()):
+        """
+        Adds a script to run (scripts already done are not run again)
+        :param script: the ISL script
+        :param cases: the commonFilenames of the cases the script renders
+        :return:
+        """
+        with self.lock:
+            if script in self.jobs:
+                job = self.jobs[script]
+                job['cases'] = sorted(set(job['cases']) | set(cases))
+                if job['status'] == 'failed':
+                    job['status'] = 'pending'
+                    job['attempts'] = 0
+            else:
+                self.jobs[script] = {'status': 'pending', 'attempts': 0,
+                                     'returncode': None, 'output': '',
+                                     'finished': None,
+                                     'cases': sorted(set(cases))}
+        return
+
+    def run(self, progress=None):
+        """
+        Runs every pending script, workers at a time, trying each failed
+        script again up to retries times
+        :param progress: a function called as progress(script, job, done,
+        total) as each script finishes (optional)
+        :return: the status of each case (see caseStatus)
+        """
+        scripts = sorted([script for script in self.jobs
+                          if self.jobs[script]['status'] != 'done'])
+        pool = ThreadPool(max(min(self.workers, len(scripts)), 1))
+        try:
+            done = 0
+            for script in pool.imap_unordered(self.runScript, scripts):
+                done += 1
+                if progress is not None:
+                    progress(script, self.jobs[script], done, len(scripts))
+        finally:
+            pool.terminate()
+        return self.caseStatus()
+
+    def runScript(self, script):
+        """
+        Runs one script until it succeeds or is out of retries
+        :param script: the ISL script
+        :return: the script
+        """
+        job = self.jobs[script]
+        while True:
+            with self.lock:
+                job['status'] = 'running'
+                job['attempts'] += 1
+                self.saveStatus()
+            returncode, output = self.runCommand(script)
+            with self.lock:
+                job['returncode'] = returncode
+                job['output'] = output[-2000:]
+                job['finished'] = time.time()
+                if returncode == 0:
+                    job['status'] = 'done'
+                elif job['attempts'] > self.retries:
+                    job['status'] = 'failed'
+                else:
+                    job['status'] = 'pending'
+                self.saveStatus()
+                if job['status'] != 'pending':
+                    return script
+
+    def runCommand(self, script):
+        """
+        Runs the command on a script, stopping it after timeout seconds
+        :param script: the ISL script
+        :return: the return code (None if it could not be run or was
+        stopped) and the output (stdout and stderr together, as text)
+        """
+        command = [part.replace('{script}', script) for part in self.command]
+        if '{script}' not in ''.join(self.command):
+            command.append(script)
+        # The command runs in its own process group, so that stopping it
+        # also stops what it started (runIDV is a shell script that starts
+        # the IDV JVM, which would otherwise keep running and keep the
+        # output open)
+        if sys.version_info[0] >= 3:
+            groupOptions = {'start_new_session': True}
+        else:
+            groupOptions = {'preexec_fn': os.setsid}
+        try:
+            process = subprocess.Popen(command, cwd=self.cwd,
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT,
+                                       **groupOptions)
+        except OSError as error:
+            return None, 'Could not run '+command[0]+': '+str(error)
+
+        timer = None
+        timedOut = []
+        if self.timeout is not None:
+            def stop():
+                timedOut.append(True)
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except OSError:
+                    # Everything in the group already finished
+                    pass
+            timer = threading.Timer(self.timeout, stop)
+            timer.start()
+        try:
+            output = process.communicate()[0]
+        finally:
+            if timer is not None:
+                timer.cancel()
+        output = output.decode('utf-8', 'replace')
+        if len(timedOut) > 0:
+            return None, output+'\n(Stopped after '+str(self.timeout)+' s)'
+        return process.returncode, output
+
+    def saveStatus(self):
+        """
+        Writes the status file (call with the lock held)
+        :return:
+        """
+        if self.statusPath is not None:
+            atomicWrite(self.statusPath, json.dumps(self.jobs, indent=1,
+                                                    sort_keys=True))
+        return
+
+    def caseStatus(self):
+        """
+        :return: a dict from the commonFilename of each case to its status
+        ('done' once any script rendering it is done, otherwise the status of
+        its scripts: 'failed', 'running', or 'pending')
+        """
+        rank = {'done': 3, 'running': 2, 'pending': 1, 'failed': 0}
+        statuses = {}
+        with self.lock:
+            for job in self.jobs.values():
+                for case in job['cases']:
+                    if (case not in statuses or
+                            rank[job['status']] > rank[statuses[case]]):
+                        statuses[case] = job['status']
+        return statuses
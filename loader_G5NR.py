@@ -0,0 +1,277 @@
+# loader_G5NR reads G5NR variables (over OPeNDAP or from local netCDF files)
+# a chunk of times at a time, converts them to the units used by CHAD as
+# they are read, and keeps every chunk it reads in a local store of .npy
+# files, so that later sessions read the same data from disk (memory mapped)
+# instead of from the server.
+
+# List of imports
+# atomicWrite is used so that a chunk in the store is never seen half written.
+# hashlib is used to name the store folder of each variable and area.
+# housekeeping_G5NR has the names of the coordinates and variables, and the
+# unit conversions.
+# json is used to describe each store folder.
+# netCDF4 is used to read the data.
+# np is used to save, load, and scale the data.
+# os is used to find the chunks already in the store.
+from cache_G5NR import atomicWrite
+import hashlib
+import housekeeping_G5NR
+import json
+import netCDF4
+import numpy as np
+import os
+
+# Bump this whenever the contents of the store files change
+storeVersion = 1
+
+
+def toRanges(selection):
+    """
+    :param selection: a (first, last+1) index pair, a slice, or a list of
+    slices (from housekeeping_G5NR.getSlices)
+    :return: a list of (first, last+1) index pairs
+    """
+    if isinstance(selection, slice):
+        selection = [selection]
+    if len(selection) > 0 and isinstance(selection[0], slice):
+        return [(int(piece.start), int(piece.stop)) for piece in selection]
+    return [(int(selection[0]), int(selection[1]))]
+
+
+def saveArray(path, data):
+    """
+    Saves an array as a .npy file (atomically)
+    :param path: the file to write
+    :param data: the array
+    :return:
+    """
+    atomicWrite(path, lambda outFile: np.save(outFile, data))
+    return
+
+
+class G5NRLoader:
+    def __init__(self, source, storeDir=None, timeChunk=24*7):
+        """
+        Reads G5NR data a chunk of times at a time
+        :param source: the OPeNDAP URL or path of the netCDF file
+        :param storeDir: the folder to keep the chunks that are read in
+        (optional - without it, everything is read from source every time)
+        :param timeChunk: the number of times in a chunk (chunks start at
+        multiples of timeChunk, so that different time ranges share them)
+        :return:
+        """
+        self.source = source
+        self.storeDir = storeDir
+        self.timeChunk = timeChunk
+        self.dataset = None
+
+        if self.storeDir is not None and not os.path.exists(self.storeDir):
+            os.makedirs(self.storeDir)
+
+    def open(self):
+        """
+        Opens the source (only when something has to be read from it)
+        :return: the netCDF4 Dataset
+        """
+        if self.dataset is None:
+            self.dataset = netCDF4.Dataset(self.source, 'r')
+        return self.dataset
+
+    def close(self):
+        """
+        Closes the source, if it is open
+        :return:
+        """
+        if self.dataset is not None:
+            self.dataset.close()
+            self.dataset = None
+        return
+
+    def storeFolder(self, description):
+        """
+        :param description: a dict describing what is kept in the folder
+        :return: the store folder for it (made if needed), or None if there
+        is no store
+        """
+        if self.storeDir is None:
+            return None
+        description = dict(description, source=self.source,
+                           version=storeVersion)
+        text = json.dumps(description, sort_keys=True)
+        folder = os.path.join(self.storeDir,
+                              hashlib.sha1(text.encode('utf-8')).hexdigest())
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+            atomicWrite(os.path.join(folder, 'description.json'), text)
+        return folder
+
+    def coordinates(self, timeRange=None):
+        """
+        Reads the coordinates, in the units CHAD uses (time in seconds
+        after startDatetime)
+        :param timeRange: (first, last+1) time index, or None for all times
+        :return: the longitudes, latitudes, and times (for timeRange)
+        """
+        folder = self.storeFolder(
+            {'kind': 'coordinates',
+             'timeMult': housekeeping_G5NR.timeValueMult,
+             'timeOffset': housekeeping_G5NR.timeValueOffset})
+        names = ['lon', 'lat', 'time']
+        paths = [None, None, None]
+        if folder is not None:
+            paths = [os.path.join(folder, name+'.npy') for name in names]
+
+        if folder is None or not all([os.path.isfile(path)
+                                      for path in paths]):
+            variables = self.open().variables
+            values = [np.ma.getdata(variables[
+                          housekeeping_G5NR.lonValueName][:]),
+                      np.ma.getdata(variables[
+                          housekeeping_G5NR.latValueName][:]),
+                      (np.ma.getdata(variables[
+                          housekeeping_G5NR.timeValueName][:]) *
+                       housekeeping_G5NR.timeValueMult +
+                       housekeeping_G5NR.timeValueOffset)]
+            if folder is not None:
+                for path, value in zip(paths, values):
+                    saveArray(path, value)
+        else:
+            values = [np.load(path) for path in paths]
+
+        if timeRange is not None:
+            values[2] = values[2][timeRange[0]:timeRange[1]]
+        return values[0], values[1], values[2]
+
+    def iterChunks(self, varName, timeRange, latRange, lonRange, mult=None):
+        """
+        Reads a variable over an area and time range, one chunk of times at
+        a time (from the store when the chunk is there, otherwise from the
+        source, adding it to the store)
+        :param varName: the name of the variable, either as in
+        housekeeping_G5NR (e.g. 'Precip', which also sets mult) or as in the
+        file (e.g. 'PREC')
+        :param timeRange: (first, last+1) time index
+        :param latRange: (first, last+1) latitude index, or slices from
+        housekeeping_G5NR.getSlices
+        :param lonRange: (first, last+1) longitude index, or slices from
+        housekeeping_G5NR.getSlices (e.g. two for an area that crosses the
+        end of the longitudes, which are read separately and put side by
+        side)
+        :param mult: what to multiply the values by (default: from
+        housekeeping_G5NR for its names, otherwise 1)
+        :return: an iterator of (chunk, timeStart), where chunk is a
+        (time, lat, lon) array (read only if it comes from the store, and
+        masked if any values are missing) and timeStart is the index of its
+        first time
+        """
+        fileVarName = housekeeping_G5NR.valueNameOptions.get(varName,
+                                                             varName)
+        if mult is None:
+            mult = housekeeping_G5NR.varMultOptions.get(varName, 1.)
+        latRanges = toRanges(latRange)
+        lonRanges = toRanges(lonRange)
+        folder = self.storeFolder({'kind': 'variable',
+                                   'variable': fileVarName,
+                                   'lat': latRanges,
+                                   'lon': lonRanges,
+                                   'mult': mult,
+                                   'timeChunk': self.timeChunk})
+
+        timeStart, timeEnd = timeRange
+        chunkStart = (timeStart//self.timeChunk)*self.timeChunk
+        while chunkStart < timeEnd:
+            chunkEnd = chunkStart+self.timeChunk
+            chunk = self.loadChunk(folder, fileVarName, chunkStart, chunkEnd,
+                                   latRanges, lonRanges, mult)
+            # The chunk may be cut short by the end of the data
+            first = max(timeStart, chunkStart)
+            last = min(timeEnd, chunkStart+len(chunk))
+            if last > first:
+                yield chunk[first-chunkStart:last-chunkStart], first
+            if chunkStart+len(chunk) < chunkEnd:
+                break
+            chunkStart = chunkEnd
+
+    def loadChunk(self, folder, fileVarName, chunkStart, chunkEnd, latRanges,
+                  lonRanges, mult):
+        """
+        Loads one whole chunk of a variable (see iterChunks)
+        :return: the chunk
+        """
+        if folder is not None:
+            path = os.path.join(folder, "{:07d}".format(chunkStart)+'.npy')
+            maskPath = path[:-len('.npy')]+'.mask.npy'
+            if os.path.isfile(path):
+                data = np.load(path, mmap_mode='r')
+                if os.path.isfile(maskPath):
+                    return np.ma.MaskedArray(data, np.load(maskPath))
+                return data
+
+        # Each contiguous block (one per pair of lat and lon ranges) is
+        # read on its own, then the blocks are put together
+        variable = self.open().variables[fileVarName]
+        blocks = [[variable[chunkStart:chunkEnd, latStart:latEnd,
+                            lonStart:lonEnd]
+                   for lonStart, lonEnd in lonRanges]
+                  for latStart, latEnd in latRanges]
+        if len(latRanges) == 1 and len(lonRanges) == 1:
+            chunk = blocks[0][0]
+        else:
+            chunk = np.ma.concatenate([np.ma.concatenate(row, axis=2)
+                                       for row in blocks], axis=1)
+        data = np.ma.getdata(chunk)
+        if not np.issubdtype(data.dtype, np.floating):
+            data = data.astype(np.float64)
+        # Convert units without making another copy
+        if mult != 1.:
+            np.multiply(data, mult, out=data)
+
+        # A chunk cut short by the end of the data isn't kept, since more
+        # times may be added to the source later
+        masked = np.ma.is_masked(chunk)
+        if folder is not None and len(data) == chunkEnd-chunkStart:
+            saveArray(path, data)
+            if masked:
+                saveArray(maskPath, np.ma.getmaskarray(chunk))
+        if masked:
+            return np.ma.MaskedArray(data, np.ma.getmaskarray(chunk))
+        return data
+
+    def load(self, varName, timeRange, latRange, lonRange, mult=None):
+        """
+        Reads a variable over an area and time range (see iterChunks) into
+        one array
+        :return: a (time, lat, lon) array
+        """
+        chunks = [chunk for chunk, timeStart in
+                  self.iterChunks(varName, timeRange, latRange, lonRange,
+                                  mult)]
+        if len(chunks) == 1:
+            return chunks[0]
+        if any([np.ma.isMaskedArray(chunk) for chunk in chunks]):
+            return np.ma.concatenate(chunks)
+        return np.concatenate(chunks)
+
+    def iterPairChunks(self, xName, yName, timeRange, latRange, lonRange):
+        """
+        Reads two variables over the same area and time range, one chunk of
+        times at a time, as ClickHist.fromChunks expects them
+        :param xName: the name of the x variable (see iterChunks)
+        :param yName: the name of the y variable (see iterChunks)
+        :param timeRange: (first, last+1) time index
+        :param latRange: (first, last+1) latitude index, or slices (see
+        iterChunks)
+        :param lonRange: (first, last+1) longitude index, or slices (see
+        iterChunks)
+        :return: an iterator of (xChunk, yChunk, flatOffset), where
+        flatOffset is the position of the first value of the chunks in the
+        flattened (time, lat, lon) data
+        """
+        pointsPerTime = (sum([end-start for start, end in
+                              toRanges(latRange)]) *
+                         sum([end-start for start, end in
+                              toRanges(lonRange)]))
+        for (xChunk, timeStart), (yChunk, yTimeStart) in zip(
+                self.iterChunks(xName, timeRange, latRange, lonRange),
+                self.iterChunks(yName, timeRange, latRange, lonRange)):
+            yield xChunk, yChunk, (timeStart-timeRange[0])*pointsPerTime
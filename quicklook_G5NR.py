@@ -0,0 +1,414 @@
+# quicklook_G5NR downloads the G5NR quicklook images (global PNGs from the
+# G5NR web site) for a case, all at the same time, with timeouts, retries,
+# and connections that are reused between requests, keeping a copy of each
+# image on disk if asked to. It also crops the area around each case out of
+# the global images (as arrays, so many cases can share one decoded image).
+
+# List of imports
+# httplib (http.client in Python 3) and urlparse (urllib.parse) are used to
+# make requests over connections that are kept open.
+# io is used to decode downloaded images in memory.
+# itertools is used to hand back cached images along with downloaded ones.
+# np is used to crop the images.
+# OrderedDict keeps decoded images in the order they were last used.
+# Image is used to decode the images.
+# socket is needed to catch timeouts.
+# ThreadPool is used to make the requests at the same time.
+# threading is used to give each thread of the pool its own connections.
+# time is used to wait between retries.
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+from collections import OrderedDict
+import io
+import itertools
+from multiprocessing.pool import ThreadPool
+import numpy as np
+from PIL import Image
+import socket
+import threading
+import time
+try:
+    from urlparse import urljoin, urlsplit
+except ImportError:
+    from urllib.parse import urljoin, urlsplit
+
+defaultBaseURL = 'http://g5nr.nccs.nasa.gov/static/naturerun/fimages/'
+
+# The G5NR global images start at 17.5 W, not 0 E
+imageLonStart = -17.5
+
+
+def makeImageURL(imageVar, imageDatetime, baseURL=defaultBaseURL):
+    """
+    Builds the URL of the G5NR quicklook image of a variable at a time
+    :param imageVar: the name of the image variable (e.g. 'storms')
+    :param imageDatetime: a datetime with the time of the image
+    :param baseURL: where the images are kept (everything before the
+    variable name)
+    :return: the URL of the image
+    """
+    return (baseURL +
+            imageVar.upper() +
+            '/Y'+"{:4d}".format(imageDatetime.year) +
+            '/M'+"{:02d}".format(imageDatetime.month) +
+            '/D'+"{:02d}".format(imageDatetime.day) +
+            '/'+imageVar+'_globe_c1440_NR_BETA9-SNAP_' +
+            "{:4d}".format(imageDatetime.year) +
+            "{:02d}".format(imageDatetime.month) +
+            "{:02d}".format(imageDatetime.day) +
+            '_'+"{:02d}".format(imageDatetime.hour) +
+            "{:02d}".format(imageDatetime.minute) +
+            'z.png')
+
+
+def decodeFrame(content):
+    """
+    Decodes a (global) image
+    :param content: the contents of the image file
+    :return: the image as a (height, width, 3) array of RGB values
+    """
+    return np.asarray(Image.open(io.BytesIO(content)).convert('RGB'))
+
+
+def cropEvents(frame, lons, lats, lonWidth=60., latHeight=30.,
+               markerRadius=5, markerColor=(255, 0, 0)):
+    """
+    Crops the area around each of several events out of one global image,
+    with a square marker at each event. Crops wrap around in longitude,
+    and are moved up or down to stay inside the image at the poles (with
+    the marker still on the event).
+    :param frame: the global image, as returned by decodeFrame
+    :param lons: the longitude of each event
+    :param lats: the latitude of each event
+    :param lonWidth: the degrees of longitude in each crop
+    :param latHeight: the degrees of latitude in each crop
+    :param markerRadius: the marker extends this many pixels past the
+    event on each side
+    :param markerColor: the RGB color of the marker
+    :return: a (number of events, height, width, 3) array of crops
+    """
+    frameHeight, frameWidth = frame.shape[0:2]
+    halfWidth = int(frameWidth*(lonWidth/2./360.))
+    halfHeight = int(frameHeight*(latHeight/2./180.))
+    lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+    lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+
+    # Find the pixel of each event
+    centX = (((lons-imageLonStart) % 360.)/360.*frameWidth).astype(np.intp)
+    centY = ((90.-lats)/180.*frameHeight).astype(np.intp)
+    centY = np.clip(centY, 0, frameHeight-1)
+
+    # Columns wrap around the globe, while rows stop at the poles
+    upper = np.clip(centY-halfHeight, 0, frameHeight-2*halfHeight)
+    rows = upper[:, None]+np.arange(2*halfHeight)
+    cols = (centX[:, None]-halfWidth+np.arange(2*halfWidth)) % frameWidth
+    crops = frame[rows[:, :, None], cols[:, None, :]]
+
+    # Stamp the markers (the event is always in the middle column)
+    markerRows = np.clip(centY-upper, markerRadius,
+                         2*halfHeight-markerRadius-1)
+    for ee in range(0, len(crops)):
+        crops[ee, markerRows[ee]-markerRadius:
+              markerRows[ee]+markerRadius+1,
+              halfWidth-markerRadius:halfWidth+markerRadius+1] = markerColor
+    return crops
+
+
+class FrameCache:
+    def __init__(self, maxFrames=8):
+        """
+        Keeps the most recently used decoded global images in memory, so
+        that cases at the same time don't decode the same image again
+        :param maxFrames: the most images to keep
+        :return:
+        """
+        self.maxFrames = maxFrames
+        self.frames = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :param key: the (imageVar, imageDatetime) of the image
+        :return: the decoded image, or None if it isn't kept
+        """
+        with self.lock:
+            if key not in self.frames:
+                return None
+            frame = self.frames.pop(key)
+            self.frames[key] = frame
+            return frame
+
+    def put(self, key, frame):
+        """
+        Keeps a decoded image, forgetting the least recently used images if
+        there are too many
+        :param key: the (imageVar, imageDatetime) of the image
+        :param frame: the decoded image
+        :return:
+        """
+        with self.lock:
+            self.frames.pop(key, None)
+            self.frames[key] = frame
+            while len(self.frames) > self.maxFrames:
+                self.frames.popitem(last=False)
+        return
+
+
+class FetchError(Exception):
+    """
+    Raised when a request gets a response that is worth trying again
+    """
+    pass
+
+
+class MissingImageError(Exception):
+    """
+    Raised when the server says an image isn't there (or can't be had)
+    """
+    pass
+
+
+class QuicklookFetcher:
+    def __init__(self, timeout=10., retries=2, backoff=0.5, workers=4,
+                 cache=None, offline=False, maxFrames=8):
+        """
+        Fetches images over HTTP(S), several at a time
+        :param timeout: the seconds to wait for a connection or for data
+        before giving up on an attempt
+        :param retries: the number of times to try again after a failed
+        attempt (missing images are not tried again)
+        :param backoff: the seconds to wait before the first retry, doubled
+        for every retry after that
+        :param workers: the number of images fetched at the same time
+        :param cache: an ImageCache (from cache_G5NR) to check before
+        downloading an image and to save downloaded images to, or None
+        :param offline: True to only use images from the cache (never
+        connecting to the server)
+        :param maxFrames: the most decoded images to keep in memory (see
+        iterFrames)
+        :return:
+        """
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.workers = workers
+        self.cache = cache
+        self.offline = offline
+        self.frames = FrameCache(maxFrames)
+
+        # The pool is only started when it is first needed (poolLock makes
+        # sure that threads sharing the fetcher start only one), and each of
+        # its threads keeps its own open connections (see getConnection)
+        self.pool = None
+        self.poolLock = threading.Lock()
+        self.local = threading.local()
+
+    def fetchAll(self, urls, keys=None):
+        """
+        Fetches several images at the same time
+        :param urls: the URLs of the images
+        :param keys: the (imageVar, imageDatetime) of each image, used to
+        look the images up in the cache (optional)
+        :return: a list with the contents of each image, or None for images
+        that could not be fetched
+        """
+        contents = [None]*len(urls)
+        for ii, content in self.iterFetch(urls, keys):
+            contents[ii] = content
+        return contents
+
+    def iterFetch(self, urls, keys=None):
+        """
+        Fetches several images at the same time, handing back each one as
+        soon as it is done, so that one slow image doesn't hold up the rest.
+        Images in the cache come first, and the rest start downloading right
+        away (before the generator is used).
+        :param urls: the URLs of the images
+        :param keys: the (imageVar, imageDatetime) of each image, used to
+        look the images up in the cache (optional)
+        :return: a generator of (position in urls, contents of the image or
+        None if it could not be fetched), in the order they finish
+        """
+        if keys is None:
+            keys = [None]*len(urls)
+
+        # Check the cache first
+        ready = []
+        toFetch = []
+        for ii in range(0, len(urls)):
+            content = None
+            if self.cache is not None and keys[ii] is not None:
+                content = self.cache.load(*keys[ii])
+            if content is not None or self.offline:
+                ready.append((ii, content))
+            else:
+                toFetch.append((ii, urls[ii], keys[ii]))
+
+        if len(toFetch) == 0:
+            return iter(ready)
+        with self.poolLock:
+            if self.pool is None:
+                self.pool = ThreadPool(self.workers)
+            fetches = self.pool.imap_unordered(self.fetchIndexed, toFetch)
+        return itertools.chain(ready, fetches)
+
+    def iterFrames(self, urls, keys):
+        """
+        Same as iterFetch, but hands back decoded images, using (and
+        filling) the fetcher's FrameCache so that an image already decoded
+        isn't fetched or decoded again
+        :param urls: the URLs of the images
+        :param keys: the (imageVar, imageDatetime) of each image
+        :return: a generator of (position in urls, decoded image or None if
+        it could not be fetched or decoded)
+        """
+        ready = []
+        toFetch = []
+        for ii in range(0, len(urls)):
+            frame = self.frames.get(keys[ii])
+            if frame is not None:
+                ready.append((ii, frame))
+            else:
+                toFetch.append(ii)
+
+        fetches = self.iterFetch([urls[ii] for ii in toFetch],
+                                 [keys[ii] for ii in toFetch])
+        return itertools.chain(ready,
+                               ((toFetch[jj],
+                                 self.decodeAndKeep(keys[toFetch[jj]],
+                                                    content))
+                                for jj, content in fetches))
+
+    def decodeAndKeep(self, key, content):
+        """
+        :param key: the (imageVar, imageDatetime) of the image
+        :param content: the contents of the image file, or None
+        :return: the decoded image (now also in the FrameCache), or None if
+        there is no image or it can't be decoded
+        """
+        if content is None:
+            return None
+        # PIL raises many kinds of errors for truncated or broken files, and
+        # any of them only means this one image is missing
+        try:
+            frame = decodeFrame(content)
+        except Exception:
+            return None
+        self.frames.put(key, frame)
+        return frame
+
+    def fetchIndexed(self, indexedURL):
+        """
+        :param indexedURL: a (position, URL, cache key or None) triple
+        :return: the position and the result of fetch for the URL
+        """
+        ii, url, key = indexedURL
+        content = self.fetch(url)
+        if content is not None and self.cache is not None and key is not None:
+            try:
+                self.cache.save(key[0], key[1], content)
+            except (IOError, OSError):
+                # The image can still be used without being cached
+                pass
+        return ii, content
+
+    def fetch(self, url):
+        """
+        Fetches one image, retrying (with backoff) after timeouts, dropped
+        connections, and server errors
+        :param url: the URL of the image
+        :return: the contents of the image, or None if it could not be
+        fetched
+        """
+        for attempt in range(0, self.retries+1):
+            if attempt > 0:
+                time.sleep(self.backoff*(2**(attempt-1)))
+            try:
+                return self.fetchOnce(url)
+            except (FetchError, httplib.HTTPException, socket.error,
+                    socket.timeout):
+                # The connection may be in a bad state, so start over
+                self.dropConnection(url)
+            except MissingImageError:
+                # Not there - trying again won't help
+                return None
+            except Exception:
+                # Anything else (e.g. a bad URL) won't get better either,
+                # and only this image should be lost to it
+                self.dropConnection(url)
+                return None
+        return None
+
+    def fetchOnce(self, url, redirects=5):
+        """
+        Makes a single request for an image (following redirects)
+        :param url: the URL of the image
+        :param redirects: the most redirects to follow
+        :return: the contents of the image
+        """
+        connection, path = self.getConnection(url)
+        connection.request('GET', path,
+                           headers={'Connection': 'keep-alive'})
+        response = connection.getresponse()
+        content = response.read()
+
+        if response.status == 200:
+            return content
+        if (response.status in [301, 302, 303, 307, 308] and
+                redirects > 0 and response.getheader('Location')):
+            return self.fetchOnce(urljoin(url,
+                                          response.getheader('Location')),
+                                  redirects-1)
+        if response.status >= 500:
+            raise FetchError(url+' returned '+str(response.status))
+        raise MissingImageError(url+' returned '+str(response.status))
+
+    def getConnection(self, url):
+        """
+        Returns this thread's open connection to the server of a URL,
+        opening one if needed
+        :param url: the URL to request
+        :return: the connection and the path to request over it
+        """
+        scheme, netloc, path, query, fragment = urlsplit(url)
+        if query:
+            path += '?'+query
+        if not hasattr(self.local, 'connections'):
+            self.local.connections = {}
+
+        if (scheme, netloc) not in self.local.connections:
+            if scheme == 'https':
+                connection = httplib.HTTPSConnection(netloc,
+                                                     timeout=self.timeout)
+            else:
+                connection = httplib.HTTPConnection(netloc,
+                                                    timeout=self.timeout)
+            self.local.connections[(scheme, netloc)] = connection
+        return self.local.connections[(scheme, netloc)], path
+
+    def dropConnection(self, url):
+        """
+        Closes and forgets this thread's connection to the server of a URL
+        :param url: the URL that was requested
+        :return:
+        """
+        scheme, netloc = urlsplit(url)[0:2]
+        connections = getattr(self.local, 'connections', {})
+        connection = connections.pop((scheme, netloc), None)
+        if connection is not None:
+            connection.close()
+        return
+
+    def close(self):
+        """
+        Stops the threads of the pool (a new pool is started if more images
+        are fetched afterwards)
+        :return:
+        """
+        with self.poolLock:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool = None
+        return
@@ -0,0 +1,164 @@
+# templates_G5NR fills in the placeholder values in the IDV bundle and ISL
+# script templates, all in memory and in a single pass over each template,
+# instead of running sed once per placeholder. Templates can also be compiled
+# once and kept in memory (see TemplateCache).
+
+# List of imports
+# atomicWrite is used so that a rendered file is never seen half written.
+# os is used to check whether template files have changed.
+# re is used to find every placeholder in one pass.
+from cache_G5NR import atomicWrite
+import os
+import re
+
+
+def toBytes(value):
+    """
+    :param value: a string (or anything that can be made into one, like a
+    number)
+    :return: value as UTF-8 bytes
+    """
+    if isinstance(value, bytes):
+        return value
+    if not isinstance(value, type(u'')):
+        value = str(value)
+    return value.encode('utf-8')
+
+
+def makePattern(placeholders):
+    """
+    Builds one regular expression that matches any of the placeholders
+    :param placeholders: the placeholder strings (matched literally)
+    :return: the compiled (bytes) regular expression
+    """
+    # Longer placeholders go first so that a placeholder that contains
+    # another one is still matched whole
+    placeholders = sorted([toBytes(placeholder)
+                           for placeholder in placeholders],
+                          key=len, reverse=True)
+    return re.compile(b'|'.join([re.escape(placeholder)
+                                 for placeholder in placeholders]))
+
+
+def renderString(text, replacements):
+    """
+    Replaces every occurrence of each placeholder in text, in a single pass
+    (so a value that was just put in is never replaced again)
+    :param text: the template contents
+    :param replacements: a dict from each placeholder to its value
+    :return: the filled in text (as bytes)
+    """
+    return CompiledTemplate(text, replacements.keys()).render(replacements)
+
+
+def renderTemplate(templatePath, outPath, replacements):
+    """
+    Fills in a template file and writes the result (atomically, so no
+    partial or backup files are ever left behind)
+    :param templatePath: the template file to read
+    :param outPath: the file to write
+    :param replacements: a dict from each placeholder to its value
+    :return:
+    """
+    with open(templatePath, 'rb') as templateFile:
+        text = templateFile.read()
+    atomicWrite(outPath, renderString(text, replacements))
+    return
+
+
+class CompiledTemplate:
+    def __init__(self, text, placeholders):
+        """
+        Splits a template into the literal text between placeholders and
+        the placeholder found at each slot between them, so that rendering
+        only has to join pieces together
+        :param text: the template contents
+        :param placeholders: the placeholder strings (matched literally)
+        :return:
+        """
+        text = toBytes(text)
+        self.placeholders = frozenset([toBytes(placeholder)
+                                       for placeholder in placeholders])
+
+        # segments always has one more entry than slots, with
+        # segments[ii] coming right before slots[ii]
+        self.segments = []
+        self.slots = []
+        lastEnd = 0
+        if len(self.placeholders) > 0:
+            for match in makePattern(self.placeholders).finditer(text):
+                self.segments.append(text[lastEnd:match.start()])
+                self.slots.append(match.group(0))
+                lastEnd = match.end()
+        self.segments.append(text[lastEnd:])
+
+    def render(self, replacements):
+        """
+        Fills in the template
+        :param replacements: a dict from each placeholder to its value
+        (placeholders without a value are left as they are)
+        :return: the filled in text (as bytes)
+        """
+        replacements = dict((toBytes(placeholder), toBytes(value))
+                            for placeholder, value in replacements.items())
+        pieces = [None]*(2*len(self.slots)+1)
+        pieces[::2] = self.segments
+        pieces[1::2] = [replacements.get(slot, slot) for slot in self.slots]
+        return b''.join(pieces)
+
+
+class TemplateCache:
+    def __init__(self):
+        """
+        Keeps compiled templates in memory, keyed by file, so that each
+        template is only read and scanned for placeholders once (or again
+        if the file changes on disk)
+        :return:
+        """
+        self.templates = {}
+
+    def load(self, templatePath, placeholders):
+        """
+        Returns the compiled template for a file, compiling it first if it
+        isn't cached, has changed on disk (by modification time or size),
+        or was compiled for different placeholders
+        :param templatePath: the template file
+        :param placeholders: the placeholder strings in the template
+        :return: the CompiledTemplate
+        """
+        fileStat = os.stat(templatePath)
+        placeholders = frozenset([toBytes(placeholder)
+                                  for placeholder in placeholders])
+        if templatePath in self.templates:
+            mtime, fileSize, template = self.templates[templatePath]
+            if (mtime == fileStat.st_mtime and
+                    fileSize == fileStat.st_size and
+                    template.placeholders == placeholders):
+                return template
+
+        with open(templatePath, 'rb') as templateFile:
+            template = CompiledTemplate(templateFile.read(), placeholders)
+        self.templates[templatePath] = (fileStat.st_mtime, fileStat.st_size,
+                                        template)
+        return template
+
+    def render(self, templatePath, replacements):
+        """
+        Fills in a (cached) template file
+        :param templatePath: the template file
+        :param replacements: a dict from each placeholder to its value
+        :return: the filled in text (as bytes)
+        """
+        return self.load(templatePath,
+                         replacements.keys()).render(replacements)
+
+    def renderTo(self, templatePath, outPath, replacements):
+        """
+        Fills in a (cached) template file and writes the result atomically
+        :param templatePath: the template file
+        :param outPath: the file to write
+        :param replacements: a dict from each placeholder to its value
+        :return:
+        """
+        atomicWrite(outPath, self.render(templatePath, replacements))
+        return
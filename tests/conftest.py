@@ -0,0 +1,121 @@
+# The CHAD_G5NR modules live at the top of the repository (they are imported
+# from the notebooks there), so the tests import them from there too.
+
+# List of imports
+# BaseHTTPRequestHandler and ThreadingHTTPServer run a local stand-in for
+# the G5NR image server.
+# netCDF4 and np are used to write a small stand-in for the G5NR data.
+# os and sys are used to import the modules.
+# pytest makes the stand-in a fixture.
+# threading runs the stand-in in the background.
+# time is used to make slow responses.
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import netCDF4
+import numpy as np
+import os
+import pytest
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+
+class ImageServer:
+    def __init__(self):
+        """
+        A local HTTP server that answers each path with the responses set
+        for it, in order (repeating the last one), or 404 for any other
+        path, and records every request
+        :return:
+        """
+        self.responses = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                status, body, delay = server.respond(self.path)
+                time.sleep(delay)
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (IOError, OSError):
+                    # The client gave up waiting
+                    pass
+
+        self.httpServer = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpServer.daemon_threads = True
+        self.url = 'http://127.0.0.1:'+str(self.httpServer.server_port)+'/'
+        self.thread = threading.Thread(target=self.httpServer.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def respond(self, path):
+        """
+        :param path: the path requested
+        :return: the (status, body, seconds to wait first) to answer with
+        """
+        with self.lock:
+            self.requests.append(path)
+            responses = self.responses.get(path)
+            if not responses:
+                return 404, b'not here', 0.
+            if len(responses) > 1:
+                return responses.pop(0)
+            return responses[0]
+
+    def requestsFor(self, path):
+        """
+        :param path: a path
+        :return: how many times it was requested
+        """
+        with self.lock:
+            return self.requests.count(path)
+
+    def close(self):
+        self.httpServer.shutdown()
+        self.httpServer.server_close()
+
+
+@pytest.fixture
+def imageServer():
+    server = ImageServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def g5nrFile(tmp_path):
+    """
+    Writes a small netCDF file laid out like the G5NR data (on a 4 degree
+    grid), with PREC (one missing value, at time 3, lat 4, lon 5) and
+    SKEDOT
+    :return: the path of the file
+    """
+    path = str(tmp_path/'g5nr.nc')
+    randomState = np.random.RandomState(0)
+    dataset = netCDF4.Dataset(path, 'w')
+    dataset.createDimension('time', None)
+    dataset.createDimension('lat', 45)
+    dataset.createDimension('lon', 90)
+    dataset.createVariable('lon', 'f8', ('lon',))[:] = np.arange(90)*4.
+    dataset.createVariable('lat', 'f8', ('lat',))[:] = np.arange(45)*4.-88.
+    dataset.createVariable('time', 'f8', ('time',))[:] = np.arange(50)*30.
+    prec = dataset.createVariable('PREC', 'f4', ('time', 'lat', 'lon'),
+                                  fill_value=-999.)
+    prec[:] = randomState.rand(50, 45, 90).astype(np.float32)*1e-3
+    prec[3, 4, 5] = np.ma.masked
+    dataset.createVariable('SKEDOT', 'f4', ('time', 'lat', 'lon'))[:] = \
+        randomState.randn(50, 45, 90).astype(np.float32)
+    dataset.close()
+    return path
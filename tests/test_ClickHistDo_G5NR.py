@@ -0,0 +1,107 @@
+# Tests that ClickHistDo saves each case once, under its own name.
+
+# List of imports
+# ClickHistDo is the class being tested.
+# datetime is used for the start of the times.
+# np is used to make the coordinates.
+# os and shutil are used to set up a session folder with the templates.
+# pytest checks the errors.
+from ClickHistDo_G5NR import ClickHistDo
+import datetime
+import numpy as np
+import os
+import pytest
+import shutil
+
+repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def makeDo(tmp_path, monkeypatch, **kwargs):
+    """
+    Makes a ClickHistDo for a 0.25 degree grid, working in tmp_path (with
+    no quicklook images, so nothing is fetched)
+    :param tmp_path: the folder to work in
+    :param monkeypatch: used to change to that folder
+    :param kwargs: any ClickHistDo options
+    :return: the ClickHistDo
+    """
+    shutil.copytree(os.path.join(repoDir, 'Templates'),
+                    str(tmp_path/'Templates'))
+    monkeypatch.chdir(str(tmp_path))
+    options = {'imageVar': []}
+    options.update(kwargs)
+    return ClickHistDo(np.arange(0., 10., 0.25), np.arange(0., 5., 0.25),
+                       np.arange(0., 4.)*3600., datetime.datetime(2005, 6, 1),
+                       ['G5NR_template_quick'], ['quick'], 'Session',
+                       **options)
+
+
+def test_doManyNameClashes(tmp_path, monkeypatch):
+    doObject = makeDo(tmp_path, monkeypatch)
+    # 0, 1, and 2 are in the same whole degree of lon and lat, so their
+    # cases would have the same name, and 5 is given twice
+    results = doObject.doMany([0, 1, 2, 5, 5], xPer=[50.]*5, yPer=[50.]*5,
+                              progress=lambda stage, done, total: None)
+    assert ([result['status'] for result in results] ==
+            ['created', 'failed', 'failed', 'created', 'skipped'])
+    assert results[1]['commonFilename'] == results[0]['commonFilename']
+    assert results[1]['artifacts'] == []
+    assert 'same commonFilename' in results[1]['error']
+    assert 'same flat index' in results[4]['error']
+    assert (sorted([case['flatIndex']
+                    for case in doObject.catalog.findCases()]) == [0, 5])
+
+    # Running again skips everything that was saved
+    results = doObject.doMany([0, 5], xPer=[50.]*2, yPer=[50.]*2,
+                              progress=lambda stage, done, total: None)
+    assert [result['status'] for result in results] == ['skipped']*2
+
+
+def test_doManyNeedsPercentiles(tmp_path, monkeypatch):
+    doObject = makeDo(tmp_path, monkeypatch)
+    with pytest.raises(ValueError):
+        doObject.doMany([0, 5])
+
+
+def test_savedCaseFetchesNothing(tmp_path, monkeypatch, imageServer):
+    # The image is missing, so it isn't kept anywhere and would be
+    # requested again
+    doObject = makeDo(tmp_path, monkeypatch, imageVar=['storms'],
+                      imageBaseURL=imageServer.url, imageRetries=0)
+    doObject.do(5, xPer=50., yPer=50.)
+    requests = len(imageServer.requests)
+    assert requests == 1
+    doObject.do(5, xPer=50., yPer=50.)
+    assert len(imageServer.requests) == requests
+
+
+def test_savedCaseMissingFromCatalogIsRecorded(tmp_path, monkeypatch):
+    doObject = makeDo(tmp_path, monkeypatch)
+
+    # A run that stops between writing the notebook and the catalog
+    def crash(case):
+        raise KeyboardInterrupt()
+    monkeypatch.setattr(doObject, 'recordCase', crash)
+    with pytest.raises(KeyboardInterrupt):
+        doObject.do(5, xPer=50., yPer=50.)
+    monkeypatch.undo()
+    monkeypatch.chdir(str(tmp_path))
+    assert doObject.catalog.findCases() == []
+
+    # Doing it again finds the notebook, and records the case
+    doObject.do(5, xPer=50., yPer=50.)
+    cases = doObject.catalog.findCases()
+    assert [case['flatIndex'] for case in cases] == [5]
+    assert doObject.catalog.hasCase(cases[0]['commonFilename'])
+
+    # Same for doMany
+    monkeypatch.setattr(doObject, 'recordCase', crash)
+    with pytest.raises(KeyboardInterrupt):
+        doObject.do(8, xPer=50., yPer=50.)
+    monkeypatch.undo()
+    monkeypatch.chdir(str(tmp_path))
+    results = doObject.doMany([8], xPer=[50.], yPer=[50.],
+                              progress=lambda stage, done, total: None)
+    assert results[0]['status'] == 'skipped'
+    assert (sorted([case['flatIndex']
+                    for case in doObject.catalog.findCases()]) == [5, 8])
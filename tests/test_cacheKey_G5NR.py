@@ -0,0 +1,59 @@
+# Tests how ClickHist identifies its data in the cache.
+
+# List of imports
+# matplotlib is set to a backend that needs no display.
+# ClickHist builds the cache keys.
+# np is used to make the data.
+# os is used to change the modification time of the data files.
+import matplotlib
+matplotlib.use('Agg')
+from ClickHist_G5NR import ClickHist
+import numpy as np
+import os
+
+binEdges = np.linspace(0, 1, 6)
+
+
+def makeKey(xData, yData, **kwargs):
+    """
+    :param xData: the x data
+    :param yData: the y data
+    :param kwargs: any ClickHist options
+    :return: the cache key of a headless ClickHist of the data
+    """
+    return ClickHist(binEdges, binEdges, xData, yData, headless=True,
+                     **kwargs).makeCacheKey()
+
+
+def test_memoryMappedKey(tmp_path):
+    rs = np.random.RandomState(0)
+    xPath = str(tmp_path/'x.npy')
+    yPath = str(tmp_path/'y.npy')
+    np.save(xPath, rs.rand(20, 30))
+    np.save(yPath, rs.rand(20, 30))
+    xData = np.load(xPath, mmap_mode='r')
+    yData = np.load(yPath, mmap_mode='r')
+    key = makeKey(xData, yData)
+    assert makeKey(xData, yData) == key
+    # Other parts of the same file are other data
+    assert makeKey(xData[1:], yData[1:]) != key
+    # A rewritten file is other data
+    os.utime(xPath, (0, 0))
+    assert makeKey(xData, yData) != key
+
+
+def test_sampledAndGivenKeys():
+    rs = np.random.RandomState(1)
+    xData = rs.rand(20, 30)
+    yData = rs.rand(20, 30)
+    key = makeKey(xData, yData)
+    assert makeKey(xData.copy(), yData.copy()) == key
+    # Every value is sampled when there are fewer than cacheSamples
+    changed = xData.copy()
+    changed[10, 10] += 0.5
+    assert makeKey(changed, yData) != key
+    # A given cacheKey stands for the data
+    assert (makeKey(xData, yData, cacheKey='run 1') ==
+            makeKey(changed, yData, cacheKey='run 1'))
+    assert (makeKey(xData, yData, cacheKey='run 1') !=
+            makeKey(xData, yData, cacheKey='run 2'))
@@ -0,0 +1,18 @@
+# Tests that the caches keep what was just saved.
+
+# List of imports
+# ImageCache is the cache being tested.
+# datetime is used for the times of the images.
+from cache_G5NR import ImageCache
+import datetime
+
+
+def test_keepsImageBiggerThanCache(tmp_path):
+    cache = ImageCache(str(tmp_path), maxBytes=100)
+    time = datetime.datetime(2005, 6, 1)
+    cache.save('storms', time, b'x'*60)
+    # Saving a bigger image makes room for it, but keeps it
+    cache.save('storms', time+datetime.timedelta(minutes=30), b'y'*150)
+    assert cache.load('storms', time) is None
+    assert (cache.load('storms', time+datetime.timedelta(minutes=30)) ==
+            b'y'*150)
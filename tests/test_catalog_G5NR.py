@@ -0,0 +1,48 @@
+# Tests which cases the case catalog counts as already saved.
+
+# List of imports
+# CaseCatalog is the catalog being tested.
+# os is used to make an Output folder.
+from catalog_G5NR import CaseCatalog
+import os
+
+commonFilenames = ['Precip_quantile_99.500_SKEDot_quantile_12.250_lat_10_'
+                   'lon_330_time_20050601_0630',
+                   'Precip_quantile_50.000_SKEDot_quantile_50.000_lat_-5_'
+                   'lon_020_time_20050602_1200']
+
+
+def touch(path):
+    """
+    Makes an empty file (and its folder)
+    :param path: the file to make
+    :return:
+    """
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    open(path, 'w').close()
+    return
+
+
+def test_importNeedsNotebook(tmp_path):
+    # The first case was finished, but the second stopped after its bundle
+    outputDir = str(tmp_path/'Output')
+    for commonFilename in commonFilenames:
+        touch(os.path.join(outputDir, 'GeneratedBundles',
+                           commonFilename+'_ir.xidv'))
+    touch(os.path.join(outputDir, 'CaseNotebooks',
+                       commonFilenames[0]+'.ipynb'))
+
+    catalog = CaseCatalog(str(tmp_path/'catalog.sqlite'), outputDir)
+    assert catalog.hasCase(commonFilenames[0])
+    assert not catalog.hasCase(commonFilenames[1])
+    catalog.close()
+
+
+def test_hasCaseNeedsNotebook(tmp_path):
+    catalog = CaseCatalog(str(tmp_path/'catalog.sqlite'))
+    catalog.addCase(commonFilenames[0], [('bundle', 'a.xidv')], lat=10.)
+    assert not catalog.hasCase(commonFilenames[0])
+    catalog.addCase(commonFilenames[0], [('notebook', 'a.ipynb')])
+    assert catalog.hasCase(commonFilenames[0])
+    catalog.close()
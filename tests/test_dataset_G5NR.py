@@ -0,0 +1,32 @@
+# Tests that G5NRDataset keeps the cases of each pair of variables apart.
+
+# List of imports
+# matplotlib is set to a backend that needs no display.
+# G5NRDataset and G5NRLoader are the classes being tested.
+# os and shutil are used to set up a session folder with the templates.
+import matplotlib
+matplotlib.use('Agg')
+from dataset_G5NR import G5NRDataset
+from loader_G5NR import G5NRLoader
+import os
+import shutil
+
+repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_clickHistDoPerPair(g5nrFile, tmp_path, monkeypatch):
+    shutil.copytree(os.path.join(repoDir, 'Templates'),
+                    str(tmp_path/'Templates'))
+    monkeypatch.chdir(str(tmp_path))
+    dataset = G5NRDataset(G5NRLoader(g5nrFile), ['Precip', 'SKEDot'],
+                          (0, 10), (20, 30), (0, 20))
+
+    names = []
+    for xName, yName in [('Precip', 'SKEDot'), ('SKEDot', 'Precip')]:
+        doObject = dataset.clickHistDo(xName, yName, ['G5NR_template_quick'],
+                                       ['quick'], 'Session', imageVar=[])
+        assert (doObject.xVarName, doObject.yVarName) == (xName, yName)
+        names.append(doObject.describeCase(7, xPer=50.,
+                                           yPer=50.)['commonFilename'])
+    assert names[0].startswith('Precip_quantile')
+    assert names[1].startswith('SKEDot_quantile')
@@ -0,0 +1,53 @@
+# Tests that ClickHist runs each queued case once.
+
+# List of imports
+# matplotlib is set to a backend that needs no display.
+# ClickHist queues the cases.
+# np is used to make the data.
+# threading is used to hold the doObject until the test lets it go.
+import matplotlib
+matplotlib.use('Agg')
+from ClickHist_G5NR import ClickHist
+import numpy as np
+import threading
+
+
+class HeldDo:
+    def __init__(self):
+        """
+        A doObject that waits until release is set, recording each case
+        :return:
+        """
+        self.doObjectHint = 'wait'
+        self.release = threading.Event()
+        self.lock = threading.Lock()
+        self.flatIndices = []
+
+    def do(self, flatIndex, **kwargs):
+        self.release.wait(10)
+        with self.lock:
+            self.flatIndices.append(int(flatIndex))
+
+
+def test_repeatedPointRunsOnce():
+    rs = np.random.RandomState(0)
+    binEdges = np.linspace(0, 1, 6)
+    clickHist = ClickHist(binEdges, binEdges, rs.rand(20, 30),
+                          rs.rand(20, 30), headless=True, doWorkers=2)
+    doObject = HeldDo()
+    clickHist.setDo(doObject)
+
+    # The same point, confirmed again while it is queued or running
+    assert clickHist.submitPoint(3)
+    assert not clickHist.submitPoint(3)
+    assert clickHist.submitPoint(4)
+    doObject.release.set()
+    finished = clickHist.waitForDo()
+    assert len(finished) == 2
+    assert (sorted(doObject.flatIndices) ==
+            sorted([int(clickHist.plotPos[3]), int(clickHist.plotPos[4])]))
+
+    # Once it is finished, it can be done again
+    assert clickHist.submitPoint(3)
+    clickHist.waitForDo()
+    assert len(doObject.flatIndices) == 3
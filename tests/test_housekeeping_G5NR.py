@@ -0,0 +1,81 @@
+# Tests the grid lookups of housekeeping_G5NR (nearestIndex, getSlices and
+# takeSlices) against the obvious linear scans they replaced.
+
+# List of imports
+# getSlices, nearestIndex and takeSlices are what is tested.
+# np is used to make the coordinates.
+from housekeeping_G5NR import getSlices, nearestIndex, takeSlices
+import numpy as np
+
+
+def scanNearest(dim, value):
+    """
+    :param dim: a coordinate array
+    :param value: a coordinate value
+    :return: the index of the point in dim nearest to value, by a full scan
+    """
+    return int(np.argmin(np.abs(np.asarray(dim)-value)))
+
+
+def test_nearestIndex():
+    # Ascending and descending latitudes, checked on, between, and outside
+    # the grid points (values halfway between points are left out, since
+    # either point is as near)
+    ascending = np.arange(-88., 90., 4.)
+    for dim in [ascending, ascending[::-1]]:
+        for value in [-100., -88., -87., -60.5, 0., 1.9, 45., 88., 95.]:
+            assert nearestIndex(dim, value) == scanNearest(dim, value)
+    assert nearestIndex(np.array([5.]), 100.) == 0
+
+
+def test_getSlicesNotCyclic():
+    lats = np.arange(-88., 90., 4.)
+    assert np.array_equal(takeSlices(lats, getSlices(lats, -10., 10.)),
+                          np.array([-8., -4., 0., 4., 8.]))
+    # The ends of the range are included
+    assert np.array_equal(takeSlices(lats, getSlices(lats, -8., 8.)),
+                          np.array([-8., -4., 0., 4., 8.]))
+    # Descending latitudes come back in their own order
+    assert np.array_equal(takeSlices(lats[::-1],
+                                     getSlices(lats[::-1], -8., 8.)),
+                          np.array([8., 4., 0., -4., -8.]))
+    # No points in the range
+    assert getSlices(lats, 1., 3.) == []
+    assert getSlices(lats[::-1], 1., 3.) == []
+    assert len(takeSlices(lats, [])) == 0
+
+
+def test_getSlicesCyclic():
+    # 0 to 356 and -180 to 176 cover the same points, in a different order
+    for lons in [np.arange(0., 360., 4.), np.arange(-180., 180., 4.)]:
+        # A range that doesn't cross the end of the grid is one slice
+        slices = getSlices(lons, 100., 120., cyclic=True)
+        assert len(slices) == 1
+        assert np.array_equal(takeSlices(lons, slices) % 360.,
+                              np.arange(100., 121., 4.))
+
+        # Crossing longitude 0 (360), given either as 340 to 20 or as 340
+        # to 380, goes from the western end to the eastern end
+        for high in [20., 380.]:
+            slices = getSlices(lons, 340., high, cyclic=True)
+            assert np.array_equal(takeSlices(lons, slices) % 360.,
+                                  np.arange(340., 381., 4.) % 360.)
+
+        # A whole period (or more) is every point, once
+        assert np.array_equal(takeSlices(lons,
+                                         getSlices(lons, 10., 370.,
+                                                   cyclic=True)),
+                              lons)
+        # No points in the range
+        assert getSlices(lons, 1., 3., cyclic=True) == []
+
+
+def test_getSlicesCyclicWrapsIntoTwoSlices():
+    lons = np.arange(0., 360., 4.)
+    # The points at the end of the grid, then those at the start
+    slices = getSlices(lons, 350., 10., cyclic=True)
+    assert slices == [slice(88, 90), slice(0, 3)]
+    assert np.array_equal(takeSlices(lons, slices),
+                          np.array([352., 356., 0., 4., 8.]))
+    # Ending exactly at the last point doesn't wrap
+    assert getSlices(lons, 340., 356., cyclic=True) == [slice(85, 90)]
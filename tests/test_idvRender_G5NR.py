@@ -0,0 +1,54 @@
+# Tests that RenderScheduler stops scripts that run too long.
+
+# List of imports
+# RenderScheduler runs the stand-in for runIDV.
+# os is used to make the stand-in executable.
+# time is used to check that the timeout stops the stand-in in time.
+from idvRender_G5NR import RenderScheduler
+import os
+import time
+
+
+def makeStandIn(folder, body):
+    """
+    Writes a shell script to use in place of runIDV
+    :param folder: the folder to write it in
+    :param body: the commands in the script
+    :return: the path of the script
+    """
+    path = os.path.join(str(folder), 'runIDV')
+    with open(path, 'w') as scriptFile:
+        scriptFile.write('#!/bin/sh\n'+body+'\n')
+    os.chmod(path, 0o755)
+    return path
+
+
+def test_timeoutStopsChildren(tmp_path):
+    # Like runIDV starting the IDV JVM, the stand-in starts a child that
+    # keeps the output open
+    standIn = makeStandIn(tmp_path, 'sleep 60 &\nwait')
+    scheduler = RenderScheduler(command=[standIn, '{script}'], workers=1,
+                                retries=0, timeout=1)
+    scheduler.add('case.isl', ['case'])
+    start = time.time()
+    statuses = scheduler.run()
+    assert time.time()-start < 30
+    assert statuses == {'case': 'failed'}
+    assert scheduler.jobs['case.isl']['returncode'] is None
+
+
+def test_retriesUntilDone(tmp_path):
+    # The stand-in fails the first time, then succeeds
+    standIn = makeStandIn(tmp_path, 'if [ -e ran ]; then exit 0; fi\n'
+                                    'touch ran\nexit 1')
+    scheduler = RenderScheduler(command=[standIn], workers=1, retries=1,
+                                cwd=str(tmp_path),
+                                statusPath=str(tmp_path/'status.json'))
+    scheduler.add('case.isl', ['case'])
+    assert scheduler.run() == {'case': 'done'}
+    assert scheduler.jobs['case.isl']['attempts'] == 2
+    # A new scheduler with the same status file has nothing left to do
+    scheduler = RenderScheduler(command=[standIn], workers=1,
+                                cwd=str(tmp_path),
+                                statusPath=str(tmp_path/'status.json'))
+    assert scheduler.caseStatus() == {'case': 'done'}
@@ -0,0 +1,77 @@
+# Tests that G5NRLoader keeps what it reads in its .npy store and reads it
+# back from there.
+
+# List of imports
+# G5NRLoader is the class being tested.
+# housekeeping_G5NR has the unit conversions.
+# netCDF4 reads the file directly, to compare with.
+# np is used to compare the data.
+# os is used to look in the store.
+from loader_G5NR import G5NRLoader
+import housekeeping_G5NR
+import netCDF4
+import numpy as np
+import os
+
+
+def readDirectly(path, fileVarName, timeRange, latRange, lonRange):
+    """
+    :return: the values of a variable, read straight from the file
+    """
+    dataset = netCDF4.Dataset(path, 'r')
+    try:
+        return dataset.variables[fileVarName][
+            timeRange[0]:timeRange[1], latRange[0]:latRange[1],
+            lonRange[0]:lonRange[1]]
+    finally:
+        dataset.close()
+
+
+def test_storeRoundTrip(g5nrFile, tmp_path):
+    storeDir = str(tmp_path/'store')
+    expected = (readDirectly(g5nrFile, 'PREC', (0, 50), (0, 10), (0, 20)) *
+                np.float32(housekeeping_G5NR.varMultOptions['Precip']))
+
+    # Read from the file, converted in place (staying float32), with the
+    # missing value still masked, then the same again from the store
+    for run in range(0, 2):
+        loader = G5NRLoader(g5nrFile, storeDir=storeDir, timeChunk=16)
+        values = loader.load('Precip', (0, 50), (0, 10), (0, 20))
+        loader.close()
+        assert values.dtype == np.float32
+        assert np.ma.allclose(values, expected)
+        assert values.mask[3, 4, 5]
+        assert np.ma.count_masked(values) == 1
+
+    # Only whole chunks are kept (the file ends at time 50, so the chunk
+    # starting at 48 may still grow)
+    stored = sorted(filename for folder in os.listdir(storeDir)
+                    for filename in os.listdir(os.path.join(storeDir,
+                                                            folder))
+                    if filename[0].isdigit())
+    assert stored == ['0000000.mask.npy', '0000000.npy', '0000016.npy',
+                      '0000032.npy']
+
+
+def test_storedArraysAreReused(g5nrFile, tmp_path):
+    storeDir = str(tmp_path/'store')
+    loader = G5NRLoader(g5nrFile, storeDir=storeDir, timeChunk=16)
+    first = loader.load('SKEDot', (0, 32), (5, 15), (10, 30))
+    coordinates = loader.coordinates((0, 32))
+    loader.close()
+
+    # With the file gone, everything comes from the store, memory mapped
+    # and read only
+    os.rename(g5nrFile, g5nrFile+'.moved')
+    loader = G5NRLoader(g5nrFile, storeDir=storeDir, timeChunk=16)
+    chunks = list(loader.iterChunks('SKEDot', (0, 32), (5, 15), (10, 30)))
+    assert [timeStart for chunk, timeStart in chunks] == [0, 16]
+    for chunk, timeStart in chunks:
+        assert isinstance(chunk, np.memmap)
+        assert chunk.dtype == np.float32
+        assert not chunk.flags.writeable
+    second = loader.load('SKEDot', (0, 32), (5, 15), (10, 30))
+    assert np.array_equal(second, first)
+    for old, new in zip(coordinates, loader.coordinates((0, 32))):
+        assert np.array_equal(old, new)
+    assert loader.dataset is None
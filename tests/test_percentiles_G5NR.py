@@ -0,0 +1,64 @@
+# Tests that the percentile engines of ClickHist agree with each other.
+
+# List of imports
+# ScanPercentiles (the original behavior) is the reference for the others.
+# np is used to make the data.
+from ClickHist_G5NR import ScanPercentiles, SketchPercentiles
+import numpy as np
+
+
+def makeSketch(data, binEdges):
+    """
+    :param data: the data to add to the sketch
+    :param binEdges: the bin edges of the sketch
+    :return: a SketchPercentiles with the data added
+    """
+    sketch = SketchPercentiles(binEdges)
+    sketch.add(data)
+    return sketch
+
+
+def test_sketchMatchesScan():
+    # A standard normal sample, with values on both sides of the bin edges
+    data = np.random.RandomState(0).standard_normal(20000)
+    binEdges = np.array([-1., 0., 1.])
+    scan = ScanPercentiles(data)
+    sketch = makeSketch(data, binEdges)
+
+    # Below, inside, and above the edges
+    for point in [-5., -1.5, -1., -0.5, 0., 0.3, 1., 1.5, 5.]:
+        # The sketch only knows how many values are outside of the edges,
+        # so it is exact at the edges and beyond the data, and within the
+        # part of the data outside of the edges otherwise
+        tolerance = 0.1
+        if point < binEdges[0]:
+            tolerance = 100.*np.mean(data < binEdges[0])
+        elif point > binEdges[-1]:
+            tolerance = 100.*np.mean(data > binEdges[-1])
+        assert (abs(sketch.percentile(point)-scan.percentile(point)) <=
+                tolerance)
+    assert sketch.percentile(-5.) == 0.
+    assert sketch.percentile(5.) == 100.
+
+
+def test_sketchIgnoresNaNs():
+    data = np.random.RandomState(1).standard_normal(1000)
+    binEdges = np.array([-1., 0., 1.])
+    withNaNs = makeSketch(np.concatenate((data, [np.nan]*100)), binEdges)
+    withoutNaNs = makeSketch(data, binEdges)
+    points = np.array([-5., -0.5, 0.5, 5.])
+    assert np.allclose(withNaNs.percentiles(points),
+                       withoutNaNs.percentiles(points))
+    assert withNaNs.percentile(5.) == 100.
+
+
+def test_scanLeavesOutMaskedValues():
+    # Masked values (here, everything above 10) don't count, and the mask
+    # is applied once, when the engine is made
+    data = np.arange(20.).reshape(4, 5)
+    scan = ScanPercentiles(data, mask=data >= 10.)
+    points = np.array([-1., 4.5, 9.5, 15.])
+    assert np.allclose(scan.percentiles(points),
+                       ScanPercentiles(np.arange(10.)).percentiles(points))
+    assert scan.percentile(15.) == 100.
+    assert scan.dataArray.shape == (10,)
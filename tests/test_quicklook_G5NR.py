@@ -0,0 +1,118 @@
+# Tests QuicklookFetcher against a local stand-in for the G5NR image server
+# (the imageServer fixture in conftest.py).
+
+# List of imports
+# ImageCache keeps fetched images on disk.
+# datetime is used for the times of the images.
+# io and Image are used to make a PNG to serve.
+# np is used to make the image.
+# QuicklookFetcher is the class being tested, and quicklook_G5NR is used to
+# replace its decoding.
+from cache_G5NR import ImageCache
+import datetime
+import io
+import numpy as np
+from PIL import Image
+import quicklook_G5NR
+from quicklook_G5NR import QuicklookFetcher
+
+imageKey = ('storms', datetime.datetime(2005, 6, 1))
+
+
+def makePNG():
+    """
+    :return: the contents of a small PNG file
+    """
+    outFile = io.BytesIO()
+    Image.fromarray(np.arange(4*8*3, dtype=np.uint8).reshape(4, 8, 3)).save(
+        outFile, 'PNG')
+    return outFile.getvalue()
+
+
+def makeFetcher(**kwargs):
+    """
+    :param kwargs: any QuicklookFetcher options
+    :return: a QuicklookFetcher that doesn't wait long between retries
+    """
+    options = {'timeout': 5., 'retries': 2, 'backoff': 0.01}
+    options.update(kwargs)
+    return QuicklookFetcher(**options)
+
+
+def test_retriesServerErrors(imageServer):
+    png = makePNG()
+    imageServer.responses['/a.png'] = [(503, b'busy', 0.), (500, b'', 0.),
+                                       (200, png, 0.)]
+    fetcher = makeFetcher()
+    assert fetcher.fetchAll([imageServer.url+'a.png']) == [png]
+    assert imageServer.requestsFor('/a.png') == 3
+    fetcher.close()
+
+
+def test_giveUpAfterRetries(imageServer):
+    imageServer.responses['/a.png'] = [(500, b'', 0.)]
+    fetcher = makeFetcher(retries=1)
+    assert fetcher.fetchAll([imageServer.url+'a.png']) == [None]
+    assert imageServer.requestsFor('/a.png') == 2
+    fetcher.close()
+
+
+def test_timeoutIsRetried(imageServer):
+    png = makePNG()
+    imageServer.responses['/a.png'] = [(200, png, 2.), (200, png, 0.)]
+    fetcher = makeFetcher(timeout=0.5, retries=1)
+    assert fetcher.fetchAll([imageServer.url+'a.png']) == [png]
+    assert imageServer.requestsFor('/a.png') == 2
+    fetcher.close()
+
+
+def test_missingImageIsNotRetried(imageServer):
+    fetcher = makeFetcher()
+    assert fetcher.fetchAll([imageServer.url+'gone.png']) == [None]
+    assert imageServer.requestsFor('/gone.png') == 1
+    fetcher.close()
+
+
+def test_brokenImageIsSkipped(imageServer):
+    png = makePNG()
+    imageServer.responses['/bad.png'] = [(200, png[:len(png)//2], 0.)]
+    imageServer.responses['/good.png'] = [(200, png, 0.)]
+    fetcher = makeFetcher()
+    frames = dict(fetcher.iterFrames(
+        [imageServer.url+'bad.png', imageServer.url+'good.png'],
+        [('bad', imageKey[1]), ('good', imageKey[1])]))
+    assert frames[0] is None
+    assert frames[1].shape == (4, 8, 3)
+    fetcher.close()
+
+
+def test_frameAndDiskCaches(imageServer, tmp_path):
+    imageServer.responses['/a.png'] = [(200, makePNG(), 0.)]
+    cache = ImageCache(str(tmp_path))
+    fetcher = makeFetcher(cache=cache)
+    # Decoded once, then kept in memory
+    for tries in range(0, 2):
+        frames = list(fetcher.iterFrames([imageServer.url+'a.png'],
+                                         [imageKey]))
+        assert frames[0][1].shape == (4, 8, 3)
+    assert imageServer.requestsFor('/a.png') == 1
+    fetcher.close()
+
+    # Another fetcher (e.g. another session) reads it from disk
+    fetcher = makeFetcher(cache=ImageCache(str(tmp_path)), offline=True)
+    frames = list(fetcher.iterFrames([imageServer.url+'a.png'], [imageKey]))
+    assert frames[0][1].shape == (4, 8, 3)
+    assert imageServer.requestsFor('/a.png') == 1
+    fetcher.close()
+
+
+def test_anyDecodingErrorIsSkipped(imageServer, monkeypatch):
+    # PIL raises more than IOError for some broken files
+    def decodeFrame(content):
+        raise SyntaxError('broken PNG file')
+    monkeypatch.setattr(quicklook_G5NR, 'decodeFrame', decodeFrame)
+    imageServer.responses['/a.png'] = [(200, makePNG(), 0.)]
+    fetcher = makeFetcher()
+    frames = list(fetcher.iterFrames([imageServer.url+'a.png'], [imageKey]))
+    assert frames == [(0, None)]
+    fetcher.close()